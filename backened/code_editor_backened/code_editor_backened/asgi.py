@@ -11,12 +11,15 @@ import os
 import django
 from channels.routing import ProtocolTypeRouter, URLRouter
 from django.core.asgi import get_asgi_application
-from code_editor_backened.routing import websocket_urlpatterns
+from django.urls import re_path
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'code_editor_backened.settings')
 django.setup()
+django_application = get_asgi_application()
+
+from code_editor_backened.routing import websocket_urlpatterns, http_urlpatterns
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": URLRouter(http_urlpatterns + [re_path(r'', django_application)]),
     "websocket": URLRouter(websocket_urlpatterns),  # WebSocket support via Channels.
 })
@@ -1,6 +1,13 @@
 from django.urls import re_path
-from editor.consumers import InteractiveExecConsumer
+from editor.consumers import InteractiveExecConsumer, ExecutionStreamConsumer, BulkExecutionConsumer
 
 websocket_urlpatterns = [
     re_path(r'^ws/interactive/$', InteractiveExecConsumer.as_asgi()),
 ]
+
+# HTTP endpoints served by Channels instead of Django; everything else goes
+# to the Django application (see asgi.py).
+http_urlpatterns = [
+    re_path(r'^api/execute/stream/$', ExecutionStreamConsumer.as_asgi()),
+    re_path(r'^api/execute/bulk/$', BulkExecutionConsumer.as_asgi()),
+]
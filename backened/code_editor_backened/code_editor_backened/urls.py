@@ -22,7 +22,7 @@ from django.conf import settings
 urlpatterns = [
     path('admin/', admin.site.urls),
     # Add your API URLs here
-    # path('api/', include('editor.urls')),
+    path('api/', include('editor.urls')),
     
     # For all other routes, serve the React app
     re_path(r'^.*$', TemplateView.as_view(template_name='index.html')),
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class EditorConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'editor'
+
+    def ready(self):
+        # Probe the toolchains once per process rather than per request.
+        from .services import languages
+        languages.probe()
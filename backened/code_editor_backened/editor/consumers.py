@@ -1,94 +1,334 @@
 # consumers.py
 import os
 import json
+import base64
 import asyncio
+from urllib.parse import parse_qs
+from channels.generic.http import AsyncHttpConsumer
 from channels.generic.websocket import AsyncWebsocketConsumer
-from .services import interactive_executor  # adjust your import as needed
+from django.conf import settings
+from .serializers import CodeExecutionSerializer
+from .services import code_executor
+from .services import workspace
+from .services import protocol
+from .services import sessions
+from .services import clients
+from .services import ratelimit
+from .views import check_language
 
 
 class InteractiveExecConsumer(AsyncWebsocketConsumer):
     async def connect(self):
-        await self.accept()
-        self.process = None  # The Docker process (interactive)
-        self.output_task = None
-        self.tmp_files = []
+        self.session = None
+        self.client = clients.from_scope(self.scope)
+        wait = ratelimit.take(ratelimit.ACTION_CONNECT, self.client)
+        if wait:
+            # Accepted first: a connection refused during the handshake
+            # gets a bare 403 and no close code.
+            await self.accept()
+            await self.close(code=protocol.CLOSE_RATE_LIMITED, reason=ratelimit.retry_after(wait))
+            return
 
-    async def disconnect(self, close_code):
-        if self.process and self.process.returncode is None:
-            self.process.kill()
-        if self.output_task:
-            self.output_task.cancel()
-        for filepath in self.tmp_files:
+        # Binary framing is used when the client offers it, JSON otherwise.
+        subprotocol = protocol.choose_subprotocol(self.scope.get("subprotocols", []))
+        self.binary = subprotocol == protocol.SUBPROTOCOL_BINARY
+        await self.accept(subprotocol=subprotocol)
+
+        # A client that lost its connection reconnects with
+        # ?resume=<session token>&last_seq=<last sequence number it saw>.
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        session = sessions.get_session(query.get("resume", [None])[0])
+        if session is not None:
             try:
-                os.unlink(filepath)
-            except Exception:
-                pass
+                last_seq = int(query.get("last_seq", ["0"])[0])
+            except ValueError:
+                last_seq = 0
+            complete = await session.attach(self, last_seq)
+            self.session = session
+            await session.emit(protocol.FRAME_CONTROL, {
+                "session": session.token,
+                "workspace": session.workspace_id,
+                "resumed": True,
+                "complete": complete,
+            })
+            return
+
+        try:
+            self.session = await sessions.create_session(self.client)
+        except OSError as e:
+            await self.close(code=protocol.CLOSE_SERVER_ERROR, reason=str(e)[:120])
+            return
+        await self.session.attach(self)
+        await self.session.emit(protocol.FRAME_CONTROL, {
+            "session": self.session.token,
+            "workspace": self.session.workspace_id,
+            "resumed": False,
+        })
+
+    async def disconnect(self, close_code):
+        # The program keeps running for the grace period so the client can resume.
+        if self.session is not None:
+            self.session.detach(self)
+
+    async def send_frame(self, frame_type, payload, stream, seq, run_id=0):
+        """
+        Sends one typed message to the client, as a binary frame or as the
+        equivalent JSON message depending on the negotiated subprotocol.
+        """
+        if self.binary:
+            await self.send(bytes_data=protocol.encode_frame(frame_type, stream, seq, payload, run_id))
+            return
+        await self.send(protocol.encode_json(frame_type, payload, seq, run_id))
+        if frame_type in protocol.FIGURE_FORMATS:
+            await self.send(bytes_data=payload)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if self.session is None:
+            return
+        if bytes_data is not None:
+            await self.receive_frame(bytes_data)
+            return
 
-    async def receive(self, text_data):
         try:
             data = json.loads(text_data)
         except Exception:
-            await self.send(json.dumps({"error": "Invalid JSON."}))
+            data = None
+        if not isinstance(data, dict):
+            await self.session.emit(protocol.FRAME_ERROR, "Invalid JSON.")
             return
 
+        # Every run-level action may name the run it targets; without one
+        # the most recently started run is used. A bad id is refused here,
+        # before it can reach a frame header.
         action = data.get("action")
+        run_id = data.get("run")
+        if run_id is not None and not protocol.is_run_id(run_id):
+            await self.session.emit(protocol.FRAME_ERROR, "Invalid run id.")
+            return
+        if action in ("start", "restart") or (action == "execute" and self.session.get_kernel(run_id) is None):
+            # Everything that spawns an interpreter: runs, kernel starts
+            # (a first cell) and restarts.
+            wait = ratelimit.take(ratelimit.ACTION_START, self.client)
+            if wait:
+                await self.session.emit(protocol.FRAME_ERROR, ratelimit.describe(wait), run_id=run_id or 0)
+                return
+
         if action == "start":
             language = data.get("language", "").lower().strip()
             code = data.get("code", "")
-            await self.start_session(language, code)
+            # Optional pre-supplied stdin lines, e.g. for scripted demos and tests.
+            inputs = data.get("inputs") or []
+            if not isinstance(inputs, list):
+                await self.session.emit(protocol.FRAME_ERROR, "inputs must be a list of lines.")
+                return
+            await self.session.start_run(
+                run_id, language, code, inputs, bool(data.get("eof")),
+                checkpoints=bool(data.get("checkpoints")),
+                # true/false overrides the static check for input() and sys.stdin.
+                interactive=data.get("interactive")
+            )
         elif action == "input":
             user_input = data.get("data", "")
-            if self.process and self.process.stdin:
-                self.process.stdin.write(user_input.encode('utf-8') + b'\n')
-                await self.process.stdin.drain()
+            await self.write_input(run_id, user_input.encode('utf-8'))
+        elif action == "eof":
+            await self.write_input(run_id, sessions.END_OF_INPUT)
+        elif action == "rewind":
+            # Checkpointed runs: answer prompt N again without rerunning the setup.
+            await self.session.rewind_run(run_id, data.get("prompt"))
+        elif action == "execute":
+            # Kernel mode: run one cell in the namespace kept by the kernel.
+            await self.session.execute_cell(run_id, data.get("code", ""), data.get("cell"))
+        elif action == "interrupt":
+            await self.session.interrupt_run(run_id)
+        elif action == "restart":
+            await self.session.restart_kernel(run_id)
+        elif action in ("stop", "cancel"):
+            await self.session.stop_run(run_id)
+        elif action == "upload":
+            await self.upload_file(data.get("name", ""), data.get("data", ""))
+        elif action == "end":
+            # Explicit end of session: no grace period.
+            await self.session.close()
+            await self.close()
         else:
-            await self.send(json.dumps({"error": "Unknown action."}))
-
-    async def start_session(self, language, code):
-        if language == "python":
-            ext = "py"
-        elif language == "c":
-            ext = "c"
-        elif language in ("cpp", "c++"):
-            ext = "cpp"
-        elif language == "javascript":
-            ext = "js"
+            await self.session.emit(protocol.FRAME_ERROR, "Unknown action.")
+
+    async def receive_frame(self, data):
+        """Handles a binary frame from the client (only stdin lines for now)."""
+        try:
+            frame_type, _stream, run_id, _seq, payload = protocol.decode_frame(data)
+        except ValueError as e:
+            await self.session.emit(protocol.FRAME_ERROR, str(e))
+            return
+        if frame_type == protocol.FRAME_INPUT:
+            await self.write_input(run_id or None, payload)
         else:
-            await self.send(json.dumps({"error": "Unsupported language."}))
+            await self.session.emit(protocol.FRAME_ERROR, "Unknown frame type.")
+
+    async def write_input(self, run_id, line):
+        """Queues type-ahead input for a run; never waits on the program."""
+        run = self.session.get_run(run_id)
+        if run is None:
+            await self.session.emit(protocol.FRAME_ERROR, "No such run.", run_id=run_id or 0)
             return
+        await run.queue_input(line)
 
-        source_filepath = interactive_executor.create_temp_file(code, ext)
-        self.tmp_files.append(source_filepath)
-        mount_dir = os.path.dirname(source_filepath)
-        
+    async def upload_file(self, name, encoded):
+        """Stores a base64-encoded file in the session workspace."""
         try:
-            self.process = await interactive_executor.start_interactive_docker(language, source_filepath, mount_dir)
+            content = base64.b64decode(encoded, validate=True)
+            await asyncio.to_thread(workspace.save_upload, self.session.workspace_path, name, [content])
         except Exception as e:
-            await self.send(json.dumps({"error": str(e)}))
+            await self.session.emit(protocol.FRAME_ERROR, f"Upload failed: {e}")
             return
+        await self.session.emit(protocol.FRAME_CONTROL, {"uploaded": os.path.basename(name)})
+
+
+class StreamingPostConsumer(AsyncHttpConsumer):
+    """
+    Base for POST endpoints that stream their response and stop working
+    when the client goes away. Subclasses implement post(body). Served
+    outside Django's middleware, so CORS headers are added here.
+    """
+
+    async def http_request(self, message):
+        # handle() runs as a task so that http.disconnect is still
+        # dispatched while the response streams, and can cancel it.
+        self.body.append(message.get("body", b""))
+        if not message.get("more_body"):
+            self.stream_task = asyncio.create_task(self.handle(b"".join(self.body)))
+
+    async def disconnect(self):
+        task = getattr(self, "stream_task", None)
+        if task is not None:
+            task.cancel()
+
+    def cors_headers(self):
+        origin = dict(self.scope.get("headers", [])).get(b"origin")
+        allowed = getattr(settings, "CORS_ALLOWED_ORIGINS", [])
+        if origin and (getattr(settings, "CORS_ALLOW_ALL_ORIGINS", False) or origin.decode("latin-1") in allowed):
+            return [(b"Access-Control-Allow-Origin", origin), (b"Vary", b"Origin")]
+        return []
 
-        # Start reading output in chunks (32 bytes per read)
-        self.output_task = asyncio.create_task(self.read_stream(self.process.stdout, "output"))
-        asyncio.create_task(self.read_stream(self.process.stderr, "error"))
-    
-    async def read_stream(self, stream, stream_type):
+    async def send_json_response(self, status, data, headers=()):
+        await self.send_response(status, json.dumps(data).encode("utf-8"), headers=[
+            (b"Content-Type", b"application/json"),
+        ] + list(headers) + self.cors_headers())
+
+    async def start_stream(self, content_type):
+        await self.send_headers(status=200, headers=[
+            (b"Content-Type", content_type),
+            (b"Cache-Control", b"no-cache"),
+            # Keeps reverse proxies from buffering the stream.
+            (b"X-Accel-Buffering", b"no"),
+        ] + self.cors_headers())
+
+    async def handle(self, body):
+        method = self.scope["method"]
+        if method == "OPTIONS":
+            await self.send_response(204, b"", headers=[
+                (b"Access-Control-Allow-Methods", b"POST, OPTIONS"),
+                (b"Access-Control-Allow-Headers", b"Content-Type"),
+            ] + self.cors_headers())
+            return
+        if method != "POST":
+            await self.send_json_response(405, {"error": f"Method {method} not allowed."})
+            return
         try:
-            while True:
-                # Read a full line to ensure we get complete messages (including our marker)
-                line_bytes = await stream.readline()
-                if not line_bytes:
-                    break
-                text = line_bytes.decode('utf-8', errors='replace')
-                # Check if the line contains the explicit prompt marker.
-                if text.startswith("PROMPT:"):
-                    # Remove the marker from the output text.
-                    message = text[len("PROMPT:"):]
-                    payload = {"output": message, "prompt": "true"}
-                else:
-                    payload = {"output": text}
-                await self.send(json.dumps(payload))
-        except asyncio.CancelledError:
-            pass
-        except Exception as e:
-            await self.send(json.dumps({"error": str(e)}))
+            data = json.loads(body or b"{}")
+        except ValueError:
+            await self.send_json_response(400, {"error": "Invalid JSON."})
+            return
+        wait = ratelimit.take(ratelimit.ACTION_EXECUTE, clients.from_scope(self.scope), self.cost(data))
+        if wait:
+            await self.send_json_response(429, {"error": ratelimit.describe(wait)}, headers=[
+                (b"Retry-After", ratelimit.retry_after(wait).encode("ascii")),
+            ])
+            return
+        await self.post(data)
+
+    def cost(self, data):
+        """Rate-limit tokens the request takes: one per program it runs."""
+        return 1
+
+
+class ExecutionStreamConsumer(StreamingPostConsumer):
+    """
+    POST /api/execute/stream/
+    Same body as POST /api/execute/, answered with a text/event-stream:
+    "stdout" and "stderr" events (JSON strings) as the program writes them,
+    then an "exit" event with exit_code, timed_out and execution_time.
+    Disconnecting cancels the run.
+    """
+
+    async def post(self, data):
+        serializer = CodeExecutionSerializer(data=data)
+        if not serializer.is_valid():
+            await self.send_json_response(400, serializer.errors)
+            return
+        data = serializer.validated_data
+        language, error = check_language(data["language_code"], runnable=True)
+        if error:
+            await self.send_json_response(400, {"error": error})
+            return
+
+        await self.start_stream(b"text/event-stream")
+        events = code_executor.stream_code(
+            language, data["code"], data.get("user_input", ""), clients.from_scope(self.scope)
+        )
+        try:
+            async for event, payload in events:
+                await self.send_body(
+                    f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode("utf-8"),
+                    more_body=True
+                )
+        finally:
+            # Kills the program if we got here by cancellation.
+            await events.aclose()
+        await self.send_body(b"")
+
+
+class BulkExecutionConsumer(StreamingPostConsumer):
+    """
+    POST /api/execute/bulk/
+    Accepts a JSON array of independent snippets, each like the body of
+    POST /api/execute/. All are validated first; a single invalid one
+    fails the request with a 400 listing the errors by position. They
+    then run in parallel (at most CODE_BULK_CONCURRENCY at a time) and
+    each result is streamed as one NDJSON line, {"index": <position>,
+    ...}, in completion order. Disconnecting cancels what is left.
+    """
+
+    def cost(self, data):
+        return min(len(data), code_executor.BULK_MAX_ITEMS) if isinstance(data, list) else 1
 
+    async def post(self, data):
+        if not isinstance(data, list) or not data:
+            await self.send_json_response(400, {"error": "Expected a non-empty JSON array of snippets."})
+            return
+        if len(data) > code_executor.BULK_MAX_ITEMS:
+            await self.send_json_response(400, {"error": f"At most {code_executor.BULK_MAX_ITEMS} snippets are allowed."})
+            return
+        serializer = CodeExecutionSerializer(data=data, many=True)
+        if not serializer.is_valid():
+            await self.send_json_response(400, serializer.errors)
+            return
+        items = []
+        errors = []
+        for item in serializer.validated_data:
+            language, error = check_language(item["language_code"])
+            errors.append({"language_code": [error]} if error else {})
+            items.append(dict(item, language=language))
+        if any(errors):
+            await self.send_json_response(400, errors)
+            return
+
+        await self.start_stream(b"application/x-ndjson")
+        results = code_executor.execute_bulk(items, clients.from_scope(self.scope))
+        try:
+            async for index, result in results:
+                line = json.dumps(dict(result, index=index)) + "\n"
+                await self.send_body(line.encode("utf-8"), more_body=True)
+        finally:
+            await results.aclose()
+        await self.send_body(b"")
@@ -1,19 +1,15 @@
 from django.core.management.base import BaseCommand
-from editor.services.language_handler import check_language_support, initialize_languages
+from editor.services import languages
 
 
 class Command(BaseCommand):
-    help = 'Initialize the database with default programming languages'
+    help = 'Check which programming languages this server can run'
 
     def handle(self, *args, **options):
         self.stdout.write('Checking language support...')
-        support = check_language_support()
-        
-        for language, supported in support.items():
-            status = 'Available' if supported else 'Not available'
-            self.stdout.write(f'  {language}: {status}')
-        
-        self.stdout.write('Initializing programming languages...')
-        initialize_languages()
-        
-        self.stdout.write(self.style.SUCCESS('Successfully initialized programming languages'))
\ No newline at end of file
+        for language in languages.describe():
+            status = 'Available' if language['available'] else 'Not available'
+            version = f" ({language['version']})" if language['version'] else ''
+            self.stdout.write(f"  {language['name']}: {status}{version}")
+
+        self.stdout.write(self.style.SUCCESS('Language registry is ready'))
@@ -1,4 +1,5 @@
 from rest_framework import serializers
+from .services.judge import COMPARATORS, DEFAULT_FLOAT_TOLERANCE
 
 class CodeExecutionSerializer(serializers.Serializer):
     code = serializers.CharField(
@@ -16,6 +17,68 @@ class CodeExecutionSerializer(serializers.Serializer):
         help_text="Optional input for interactive programs."
     )
 
+class TestCaseSerializer(serializers.Serializer):
+    stdin = serializers.CharField(required=False, allow_blank=True, default="", trim_whitespace=False)
+    expected_stdout = serializers.CharField(required=True, allow_blank=True, trim_whitespace=False)
+
+class BatchExecutionSerializer(serializers.Serializer):
+    code = serializers.CharField(
+        required=True,
+        help_text="The source code to grade."
+    )
+    language_code = serializers.IntegerField(
+        required=True,
+        help_text="Language code (1: Python, 2: C, 3: C++, 4: JavaScript)"
+    )
+    cases = TestCaseSerializer(
+        many=True,
+        allow_empty=False,
+        help_text="Test cases, each with stdin and expected_stdout."
+    )
+    stop_on_failure = serializers.BooleanField(
+        required=False,
+        default=False,
+        help_text="Skip the cases that have not started once one fails."
+    )
+    time_limit = serializers.FloatField(
+        required=False,
+        min_value=0.1,
+        max_value=60,
+        help_text="Per-case time limit in seconds."
+    )
+    comparator = serializers.ChoiceField(
+        choices=COMPARATORS,
+        required=False,
+        default="exact",
+        help_text="exact (ignores trailing whitespace), whitespace (token by token) or float."
+    )
+    tolerance = serializers.FloatField(
+        required=False,
+        min_value=0,
+        default=DEFAULT_FLOAT_TOLERANCE,
+        help_text="Absolute/relative tolerance for the float comparator."
+    )
+
 class FileUploadSerializer(serializers.Serializer):
     file = serializers.FileField()
+    workspace = serializers.CharField(
+        required=False,
+        allow_blank=True,
+        default="",
+        help_text="Optional session workspace id to store the file in."
+    )
+
+
+class PreviewSerializer(serializers.Serializer):
+    files = serializers.DictField(
+        child=serializers.CharField(allow_blank=True, trim_whitespace=False),
+        allow_empty=False,
+        help_text="The bundle as {path: content}; must contain index.html."
+    )
 
+class JobSerializer(CodeExecutionSerializer):
+    time_limit = serializers.FloatField(
+        required=False,
+        min_value=0.1,
+        help_text="Time limit in seconds (capped by CODE_JOB_TIMEOUT_SECONDS)."
+    )
@@ -0,0 +1,177 @@
+import os
+import sys
+import ast
+import json
+import hashlib
+import threading
+import subprocess
+from collections import OrderedDict
+
+#--------------------------------------------------------------------------
+# Static analysis of submitted Python code (never executes it).
+#--------------------------------------------------------------------------
+# Recent sources whose syntax check result is remembered, by hash; students
+# resubmit the same broken code often.
+SYNTAX_CACHE_SIZE = int(os.environ.get("CODE_SYNTAX_CACHE_SIZE", "512"))
+# Deeply nested code can exhaust the compiler (RecursionError, MemoryError);
+# it is then checked again in a separate interpreter, for at most this long.
+SYNTAX_CHECK_TIMEOUT_SECONDS = float(os.environ.get("CODE_SYNTAX_CHECK_TIMEOUT_SECONDS", "10"))
+
+# Errors of the compiler itself rather than of the code's syntax.
+RESOURCE_ERRORS = (RecursionError, MemoryError, OverflowError)
+
+# Run with -I: reads the source from stdin and prints the error, if any.
+_CHECK_SCRIPT = """
+import sys, json
+try:
+    compile(sys.stdin.buffer.read(), "<main>", "exec", dont_inherit=True)
+except SyntaxError as e:
+    print(json.dumps([type(e).__name__, e.msg, e.lineno, e.offset, e.end_lineno, e.end_offset]))
+except Exception as e:
+    print(json.dumps([type(e).__name__, str(e) or "too deeply nested to compile", None, None, None, None]))
+"""
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _compile_error(code):
+    """The error of compiling code in-process, as a tuple, or None."""
+    try:
+        compile(code, "<main>", "exec", dont_inherit=True)
+    except SyntaxError as e:
+        return (type(e).__name__, e.msg, e.lineno, e.offset,
+                getattr(e, "end_lineno", None), getattr(e, "end_offset", None))
+    except ValueError as e:
+        # e.g. "source code string cannot contain null bytes"
+        return ("SyntaxError", str(e), None, None, None, None)
+    return None
+
+
+def _compile_error_in_subprocess(code):
+    """_compile_error() in a fresh interpreter, for code too deep to compile here."""
+    try:
+        result = subprocess.run(
+            [sys.executable, "-I", "-c", _CHECK_SCRIPT],
+            input=code.encode("utf-8", "surrogatepass"),
+            capture_output=True, timeout=SYNTAX_CHECK_TIMEOUT_SECONDS
+        )
+        if result.returncode == 0:
+            output = result.stdout.strip()
+            return tuple(json.loads(output)) if output else None
+    except (OSError, ValueError, subprocess.TimeoutExpired):
+        pass
+    return ("SyntaxError", "The code is too large or too deeply nested to compile.", None, None, None, None)
+
+
+def _syntax_error(code):
+    key = hashlib.sha256(code.encode("utf-8", "surrogatepass")).digest()
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    try:
+        error = _compile_error(code)
+    except RESOURCE_ERRORS:
+        error = _compile_error_in_subprocess(code)
+    with _cache_lock:
+        _cache[key] = error
+        while len(_cache) > SYNTAX_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return error
+
+
+def check_syntax(code):
+    """
+    Compiles the code in-process without running it. Returns None if it
+    compiles, otherwise a diagnostic dict with type, message, line, column,
+    end_line and end_column (1-based; any of them may be None).
+    Results are cached, so this is cheap for repeated submissions. Code too
+    deeply nested for this process's compiler is checked in a subprocess.
+    """
+    error = _syntax_error(code)
+    if error is None:
+        return None
+    kind, message, line, column, end_line, end_column = error
+    return {
+        "type": kind,
+        "message": message,
+        "line": line,
+        "column": column,
+        "end_line": end_line,
+        "end_column": end_column,
+    }
+
+
+def format_diagnostic(diagnostic):
+    """One-line text for a check_syntax diagnostic, as shown in the terminal."""
+    text = f"{diagnostic['type']}: {diagnostic['message']}"
+    if diagnostic["line"]:
+        text += f" (line {diagnostic['line']}"
+        if diagnostic["column"]:
+            text += f", column {diagnostic['column']}"
+        text += ")"
+    return text
+
+
+def find_imports(code):
+    """
+    Returns the top-level names of the modules the code imports, e.g.
+    {"numpy", "matplotlib"} for "import numpy as np; from matplotlib import
+    pyplot". Relative imports are skipped. Code that does not parse
+    imports nothing.
+    """
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError) + RESOURCE_ERRORS:
+        return set()
+
+    modules = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            modules.add(node.module.split(".")[0])
+    return modules
+
+
+# Names whose use means a program may read stdin. eval/exec/__import__ and
+# friends could reach input() in ways the AST cannot see, so they count too.
+INPUT_NAMES = {"input", "stdin", "fileinput", "getpass", "breakpoint",
+               "eval", "exec", "compile", "__import__", "import_module"}
+INPUT_MODULES = {"fileinput", "getpass", "pdb", "code", "readline", "select", "termios", "tty"}
+
+
+def reads_input(code):
+    """
+    True if the code may read standard input: it mentions input(),
+    sys.stdin or one of INPUT_NAMES, or imports one of INPUT_MODULES.
+    Errs on the side of True; code that does not parse reads input.
+    """
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError) + RESOURCE_ERRORS:
+        return True
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id in INPUT_NAMES:
+            return True
+        if isinstance(node, ast.Attribute) and node.attr in INPUT_NAMES:
+            return True
+        if isinstance(node, ast.alias) and node.name.split(".")[0] in INPUT_NAMES | INPUT_MODULES:
+            return True
+        if isinstance(node, ast.ImportFrom) and (node.module or "").split(".")[0] in INPUT_MODULES:
+            return True
+        if isinstance(node, ast.Constant) and node.value == "/dev/stdin":
+            return True
+        # open(0), os.read(0, n), os.fdopen(0)
+        if isinstance(node, ast.Call) and node.args and _is_fd_zero(node.args[0]):
+            func = node.func
+            name = func.id if isinstance(func, ast.Name) else getattr(func, "attr", None)
+            if name in ("open", "read", "fdopen"):
+                return True
+    return False
+
+
+def _is_fd_zero(node):
+    return isinstance(node, ast.Constant) and node.value == 0 and type(node.value) is int
@@ -0,0 +1,34 @@
+import os
+
+#--------------------------------------------------------------------------
+# Configuration: who a request comes from. A client is an IP address, for
+# REST calls and WebSocket sessions alike, so reconnecting does not give a
+# fresh share. Behind a reverse proxy the address is
+# taken from X-Forwarded-For, trusting this many proxies in front of us
+# (0: use the socket's peer address).
+#--------------------------------------------------------------------------
+TRUSTED_PROXY_HOPS = int(os.environ.get("CODE_TRUSTED_PROXY_HOPS", "0"))
+
+
+def _pick_address(forwarded_for, peer):
+    if TRUSTED_PROXY_HOPS > 0 and forwarded_for:
+        hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+        if hops:
+            # Each trusted proxy appended one entry; anything further left
+            # was written by the client and can be forged.
+            return hops[-min(TRUSTED_PROXY_HOPS, len(hops))]
+    return peer or "unknown"
+
+
+def from_request(request):
+    """Client key of a Django or DRF request."""
+    address = _pick_address(request.META.get("HTTP_X_FORWARDED_FOR"), request.META.get("REMOTE_ADDR"))
+    return f"ip:{address}"
+
+
+def from_scope(scope):
+    """Client key of an ASGI connection scope."""
+    headers = dict(scope.get("headers", []))
+    forwarded_for = headers.get(b"x-forwarded-for", b"").decode("latin-1")
+    peer = (scope.get("client") or [None])[0]
+    return f"ip:{_pick_address(forwarded_for, peer)}"
@@ -0,0 +1,558 @@
+import os
+import time
+import asyncio
+import shutil
+import signal
+import tempfile
+import subprocess
+import selectors
+import threading
+import py_compile
+import codecs
+from concurrent.futures import ThreadPoolExecutor, wait
+from . import workspace
+from . import judge
+from . import analysis
+from . import languages
+from . import scheduler
+from .interactive_executor import CODE_EXEC_DIR
+
+#--------------------------------------------------------------------------
+# Configuration: stateless (REST) execution. Programs are prepared once and
+# then run to completion with the whole of stdin supplied up front.
+#--------------------------------------------------------------------------
+EXEC_TIMEOUT_SECONDS = float(os.environ.get("CODE_EXEC_TIMEOUT_SECONDS", "10"))
+COMPILE_TIMEOUT_SECONDS = float(os.environ.get("CODE_COMPILE_TIMEOUT_SECONDS", "30"))
+# Test cases of a batch run in parallel on this many workers.
+EXEC_WORKERS = int(os.environ.get("CODE_EXEC_WORKERS", str(os.cpu_count() or 2)))
+BATCH_MAX_CASES = int(os.environ.get("CODE_BATCH_MAX_CASES", "100"))
+# In judge mode only this much stdout/stderr is kept for the response; the
+# comparison itself streams and never buffers the output.
+JUDGE_CAPTURE_BYTES = int(os.environ.get("CODE_JUDGE_CAPTURE_BYTES", str(64 * 1024)))
+JUDGE_READ_CHUNK = 64 * 1024
+
+# Verdicts reported for each test case of a batch.
+VERDICT_ACCEPTED = "AC"
+VERDICT_WRONG_ANSWER = "WA"
+VERDICT_TIME_LIMIT = "TLE"
+VERDICT_RUNTIME_ERROR = "RE"
+VERDICT_COMPILE_ERROR = "CE"
+VERDICT_SKIPPED = "SKIPPED"
+
+# Shared by all requests so concurrent batches cannot oversubscribe the host.
+_pool = ThreadPoolExecutor(max_workers=EXEC_WORKERS, thread_name_prefix="code-exec")
+
+
+class CompileError(Exception):
+    """
+    Raised by prepare_program when the source does not compile. For Python,
+    diagnostics holds the structured syntax error (see analysis.check_syntax).
+    """
+
+    def __init__(self, message, diagnostics=()):
+        super().__init__(message)
+        self.diagnostics = list(diagnostics)
+
+#--------------------------------------------------------------------------
+# Prepare (compile once)
+#--------------------------------------------------------------------------
+def prepare_program(language, code, build_dir):
+    """
+    Writes the source into build_dir and compiles it where the language
+    needs it (see languages.LANGUAGES). Returns the argv that runs the
+    program. Raises CompileError with the compiler output if compilation
+    fails.
+    """
+    entry = languages.get(language)
+    if entry is None or entry.run is None:
+        raise CompileError(f"{language} programs cannot be run.")
+    if not languages.is_available(entry):
+        raise CompileError(f"{entry.name} is not installed on this server.")
+
+    source = os.path.join(build_dir, f"main.{entry.extension}")
+    binary = os.path.join(build_dir, "main")
+    if entry.name == "python":
+        # Cached in-process check first: no file, no interpreter for a syntax error.
+        diagnostic = analysis.check_syntax(code)
+        if diagnostic:
+            raise CompileError(analysis.format_diagnostic(diagnostic), [diagnostic])
+        _write(source, code)
+        compiled = os.path.join(build_dir, "main.pyc")
+        try:
+            py_compile.compile(source, cfile=compiled, doraise=True)
+        except py_compile.PyCompileError as e:
+            if e.exc_type_name in {error.__name__ for error in analysis.RESOURCE_ERRORS}:
+                # Too deep for this process; the program's interpreter compiles it.
+                return languages.command(entry.run, source=source)
+            raise CompileError(e.msg)
+        return languages.command(entry.run, source=compiled)
+
+    _write(source, code)
+    if entry.compile:
+        try:
+            result = subprocess.run(
+                languages.command(entry.compile, source=source, binary=binary),
+                capture_output=True, text=True, timeout=COMPILE_TIMEOUT_SECONDS
+            )
+        except FileNotFoundError:
+            raise CompileError(f"{entry.compile[0]} is not installed.")
+        except subprocess.TimeoutExpired:
+            raise CompileError("Compilation timed out.")
+        if result.returncode != 0:
+            raise CompileError(result.stderr)
+    return languages.command(entry.run, source=source, binary=binary)
+
+
+def _write(path, content):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+#--------------------------------------------------------------------------
+# Run
+#--------------------------------------------------------------------------
+def run_judged(argv, stdin_text, comparator, cwd, timeout=EXEC_TIMEOUT_SECONDS, client=None):
+    """
+    Runs a prepared program and feeds its stdout to a streaming comparator
+    (see judge.make_comparator) as it is produced. The process group is
+    killed at the first mismatch, so wrong answers stop using CPU at once.
+    Returns a dict with stdout, stderr, exit_code, timed_out,
+    execution_time (seconds), matched, mismatch and killed (stopped on a
+    mismatch); stdout and stderr hold at most JUDGE_CAPTURE_BYTES each.
+    """
+    started = time.perf_counter()
+    try:
+        process = subprocess.Popen(
+            argv,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            preexec_fn=workspace.limit_file_size,
+            start_new_session=True
+        )
+    except OSError as e:
+        return {"stdout": "", "stderr": str(e), "exit_code": None, "timed_out": False,
+                "execution_time": 0.0, "matched": False, "mismatch": None, "killed": False}
+
+    scheduler.track(process.pid, client)
+    stderr_head = bytearray()
+    helpers = [
+        threading.Thread(target=_feed_stdin, args=(process.stdin, stdin_text.encode("utf-8")), daemon=True),
+        threading.Thread(target=_drain, args=(process.stderr, stderr_head), daemon=True),
+    ]
+    for helper in helpers:
+        helper.start()
+
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    stdout_head = []
+    captured = 0
+    timed_out = False
+    matched = True
+    deadline = started + timeout
+    with selectors.DefaultSelector() as selector:
+        selector.register(process.stdout, selectors.EVENT_READ)
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                timed_out = True
+                break
+            if not selector.select(remaining):
+                continue
+            data = os.read(process.stdout.fileno(), JUDGE_READ_CHUNK)
+            text = decoder.decode(data, final=not data)
+            if captured < JUDGE_CAPTURE_BYTES:
+                stdout_head.append(text[:JUDGE_CAPTURE_BYTES - captured])
+                captured += len(stdout_head[-1])
+            if not comparator.feed(text):
+                matched = False
+                break
+            if not data:
+                break
+
+    _kill_group(process.pid)
+    scheduler.untrack(process.pid)
+    process.stdout.close()
+    process.wait()
+    for helper in helpers:
+        # Bounded, in case something outside the group still holds a pipe.
+        helper.join(1)
+    killed = not matched
+    if matched and not timed_out:
+        matched = comparator.finish()
+
+    return {
+        "stdout": "".join(stdout_head),
+        "stderr": stderr_head.decode("utf-8", errors="replace"),
+        "exit_code": process.returncode,
+        "timed_out": timed_out,
+        "execution_time": round(time.perf_counter() - started, 3),
+        "matched": matched,
+        "mismatch": comparator.mismatch,
+        "killed": killed,
+    }
+
+
+def run_streaming(argv, stdin_text, cwd, on_output, timeout=EXEC_TIMEOUT_SECONDS, client=None):
+    """
+    Runs a prepared program and passes its output to on_output(stream,
+    text), stream being "stdout" or "stderr", as it is produced. Returns a
+    dict with exit_code, timed_out and execution_time.
+    """
+    started = time.perf_counter()
+    try:
+        process = subprocess.Popen(
+            argv,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            preexec_fn=workspace.limit_file_size,
+            start_new_session=True
+        )
+    except OSError as e:
+        on_output("stderr", str(e))
+        return {"exit_code": None, "timed_out": False, "execution_time": 0.0}
+
+    scheduler.track(process.pid, client)
+    feeder = threading.Thread(target=_feed_stdin, args=(process.stdin, stdin_text.encode("utf-8")), daemon=True)
+    feeder.start()
+    timed_out = False
+    deadline = started + timeout
+    with selectors.DefaultSelector() as selector:
+        for name, pipe in (("stdout", process.stdout), ("stderr", process.stderr)):
+            selector.register(pipe, selectors.EVENT_READ, (name, codecs.getincrementaldecoder("utf-8")(errors="replace")))
+        while selector.get_map():
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                timed_out = True
+                break
+            for key, _events in selector.select(remaining):
+                name, decoder = key.data
+                data = os.read(key.fileobj.fileno(), JUDGE_READ_CHUNK)
+                text = decoder.decode(data, final=not data)
+                if text:
+                    on_output(name, text)
+                if not data:
+                    selector.unregister(key.fileobj)
+
+    _kill_group(process.pid)
+    scheduler.untrack(process.pid)
+    process.stdout.close()
+    process.stderr.close()
+    process.wait()
+    feeder.join(1)
+    return {
+        "exit_code": process.returncode,
+        "timed_out": timed_out,
+        "execution_time": round(time.perf_counter() - started, 3),
+    }
+
+
+def _feed_stdin(pipe, data):
+    try:
+        pipe.write(data)
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        try:
+            pipe.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def _drain(pipe, head):
+    """Reads a pipe to EOF, keeping only the first JUDGE_CAPTURE_BYTES."""
+    for data in iter(lambda: pipe.read1(JUDGE_READ_CHUNK), b""):
+        if len(head) < JUDGE_CAPTURE_BYTES:
+            head.extend(data[:JUDGE_CAPTURE_BYTES - len(head)])
+    pipe.close()
+
+
+def _kill_group(pgid):
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+#--------------------------------------------------------------------------
+# Async execution: the program runs on the event loop, so no worker thread
+# is held while it runs, and its output can be streamed as it is written.
+#--------------------------------------------------------------------------
+STREAM_READ_BYTES = 64 * 1024
+
+
+async def stream_code(language, code, user_input="", client=None, priority=scheduler.PRIORITY_SHORT):
+    """
+    Runs code once with user_input as stdin. Async generator yielding
+    ("stdout", text) and ("stderr", text) as the program writes them, then
+    ("exit", {"exit_code", "timed_out", "execution_time"}). A compile error
+    comes out as its stderr, and the exit event carries its diagnostics.
+    Closing the generator (or cancelling its consumer) kills the program.
+    Nothing starts until client gets a program slot (see scheduler.py).
+    """
+    entry = languages.get(language)
+    timeout = languages.timeout(entry, EXEC_TIMEOUT_SECONDS) if entry else EXEC_TIMEOUT_SECONDS
+    async with scheduler.async_slot(client, priority):
+        build_dir = await asyncio.to_thread(tempfile.mkdtemp, prefix="exec_", dir=CODE_EXEC_DIR)
+        process = None
+        tasks = []
+        try:
+            try:
+                argv = await asyncio.to_thread(prepare_program, language, code, build_dir)
+            except CompileError as e:
+                yield "stderr", str(e)
+                yield "exit", {"exit_code": None, "timed_out": False, "execution_time": 0.0,
+                               "diagnostics": e.diagnostics}
+                return
+
+            started = time.perf_counter()
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *argv,
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    cwd=build_dir,
+                    preexec_fn=workspace.limit_file_size,
+                    start_new_session=True
+                )
+            except OSError as e:
+                yield "stderr", str(e)
+                yield "exit", {"exit_code": None, "timed_out": False, "execution_time": 0.0}
+                return
+
+            scheduler.track(process.pid, client)
+            # Both pipes feed one queue; each reader ends with (name, None).
+            events = asyncio.Queue()
+            tasks = [
+                asyncio.create_task(_pump(process.stdout, "stdout", events)),
+                asyncio.create_task(_pump(process.stderr, "stderr", events)),
+                asyncio.create_task(_feed(process.stdin, user_input.encode("utf-8"))),
+            ]
+            timed_out = False
+            open_streams = 2
+            deadline = started + timeout
+            while open_streams:
+                try:
+                    name, text = await asyncio.wait_for(events.get(), max(deadline - time.perf_counter(), 0))
+                except asyncio.TimeoutError:
+                    # Killing the group closes the pipes; the readers then drain.
+                    timed_out = True
+                    _kill_group(process.pid)
+                    deadline = float("inf")
+                    continue
+                if text is None:
+                    open_streams -= 1
+                    continue
+                yield name, text
+
+            scheduler.untrack(process.pid)
+            exit_code = await process.wait()
+            yield "exit", {
+                "exit_code": exit_code,
+                "timed_out": timed_out,
+                "execution_time": round(time.perf_counter() - started, 3),
+            }
+        finally:
+            for task in tasks:
+                task.cancel()
+            if process is not None:
+                # Also ends anything the program left running in the background.
+                _kill_group(process.pid)
+                scheduler.untrack(process.pid)
+                if process.returncode is None:
+                    await process.wait()
+            await asyncio.to_thread(shutil.rmtree, build_dir, True)
+
+
+async def _pump(stream, name, events):
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    while True:
+        data = await stream.read(STREAM_READ_BYTES)
+        text = decoder.decode(data, final=not data)
+        if text:
+            await events.put((name, text))
+        if not data:
+            break
+    await events.put((name, None))
+
+
+async def _feed(pipe, data):
+    try:
+        pipe.write(data)
+        await pipe.drain()
+        pipe.close()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+
+
+async def execute_code_async(language, code, user_input="", client=None, priority=scheduler.PRIORITY_SHORT):
+    """
+    Runs code once with user_input as stdin (POST /api/execute/), once
+    client gets a program slot (see scheduler.py). Returns JSON-ready
+    stdout, stderr, gui_output and execution_time, plus diagnostics when
+    the code does not compile.
+    """
+    entry = languages.get(language)
+    if entry is not None and entry.run is None:
+        return {"stdout": "", "stderr": "", "gui_output": code, "execution_time": 0.0}
+    timeout = languages.timeout(entry, EXEC_TIMEOUT_SECONDS) if entry else EXEC_TIMEOUT_SECONDS
+
+    output = {"stdout": [], "stderr": []}
+    async for name, data in stream_code(language, code, user_input, client, priority):
+        if name == "exit":
+            result = data
+        else:
+            output[name].append(data)
+
+    stderr = "".join(output["stderr"])
+    if result["timed_out"]:
+        stderr += f"\nTime limit of {timeout:g}s exceeded."
+    response = {
+        "stdout": "".join(output["stdout"]),
+        "stderr": stderr,
+        "gui_output": "",
+        "execution_time": result["execution_time"],
+    }
+    if "diagnostics" in result:
+        response["diagnostics"] = result["diagnostics"]
+    return response
+
+#--------------------------------------------------------------------------
+# Bulk execution of independent snippets (POST /api/execute/bulk/)
+#--------------------------------------------------------------------------
+BULK_MAX_ITEMS = int(os.environ.get("CODE_BULK_MAX_ITEMS", "500"))
+# Snippets of one bulk request that run at the same time.
+BULK_CONCURRENCY = int(os.environ.get("CODE_BULK_CONCURRENCY", str(EXEC_WORKERS)))
+
+
+async def execute_bulk(items, client=None, concurrency=BULK_CONCURRENCY):
+    """
+    Runs independent snippets ({"language", "code", "user_input"}), at
+    most concurrency at a time. Async generator yielding (index, result) in
+    completion order, result being what execute_code_async returns. The
+    snippets queue for program slots as client's batch work.
+    Closing it cancels the snippets still queued or running.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(index, item):
+        async with semaphore:
+            return index, await execute_code_async(
+                item["language"], item["code"], item.get("user_input", ""), client, scheduler.PRIORITY_BATCH
+            )
+
+    tasks = [asyncio.create_task(run(index, item)) for index, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Let cancelled runs kill their programs and remove their files.
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+#--------------------------------------------------------------------------
+# Batch execution against test cases (POST /api/execute/batch/)
+#--------------------------------------------------------------------------
+def judge_case(argv, case, cwd, timeout, comparator, tolerance, client=None):
+    """
+    Runs one test case in judge mode and returns its verdict and timing.
+    Called with a slot held for client (see scheduler.submit).
+    """
+    checker = judge.make_comparator(case.get("expected_stdout", ""), comparator, tolerance)
+    result = run_judged(argv, case.get("stdin", ""), checker, cwd, timeout, client)
+    if result["timed_out"]:
+        verdict = VERDICT_TIME_LIMIT
+    elif result["killed"]:
+        # Killed at the first mismatch, so the exit code says nothing.
+        verdict = VERDICT_WRONG_ANSWER
+    elif result["exit_code"] != 0:
+        verdict = VERDICT_RUNTIME_ERROR
+    elif not result["matched"]:
+        verdict = VERDICT_WRONG_ANSWER
+    else:
+        verdict = VERDICT_ACCEPTED
+    return {
+        "verdict": verdict,
+        "execution_time": result["execution_time"],
+        "exit_code": result["exit_code"],
+        "stdout": result["stdout"],
+        "stderr": result["stderr"],
+        "mismatch": result["mismatch"],
+    }
+
+
+async def execute_batch_async(language, code, cases, stop_on_failure=False, timeout=EXEC_TIMEOUT_SECONDS,
+                              comparator=judge.COMPARATOR_EXACT, tolerance=judge.DEFAULT_FLOAT_TOLERANCE,
+                              client=None):
+    """
+    Compiles code once and runs it against every case ({"stdin",
+    "expected_stdout"}) in parallel on the shared worker pool, each case
+    as client's batch work (see scheduler.submit), awaiting the cases
+    without holding up the event loop. Output is checked as it
+    streams with the given comparator (exact, whitespace or float; see
+    judge.py).
+    With stop_on_failure, cases not yet started when one fails are
+    reported as SKIPPED. Returns a dict with per-case results (in input
+    order), a summary verdict and the total wall time.
+    """
+    started = time.perf_counter()
+    build_dir = await asyncio.to_thread(tempfile.mkdtemp, prefix="batch_", dir=CODE_EXEC_DIR)
+    submitted = []
+    try:
+        try:
+            argv = await asyncio.to_thread(prepare_program, language, code, build_dir)
+        except CompileError as e:
+            return {
+                "verdict": VERDICT_COMPILE_ERROR,
+                "compile_output": str(e),
+                "diagnostics": e.diagnostics,
+                "cases": [],
+                "execution_time": round(time.perf_counter() - started, 3),
+            }
+
+        submitted = [
+            scheduler.submit(_pool, client, scheduler.PRIORITY_BATCH,
+                             judge_case, argv, case, build_dir, timeout, comparator, tolerance, client)
+            for case in cases
+        ]
+        futures = {asyncio.wrap_future(future): index for index, future in enumerate(submitted)}
+        results = [None] * len(cases)
+        pending = set(futures)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            failed = False
+            for future in done:
+                results[futures[future]] = future.result()
+                failed = failed or results[futures[future]]["verdict"] != VERDICT_ACCEPTED
+            if failed and stop_on_failure:
+                # Cases already running finish; the rest never start.
+                for future in pending:
+                    submitted[futures[future]].cancel()
+                await asyncio.wait(pending)
+                for future in pending:
+                    if not future.cancelled():
+                        results[futures[future]] = future.result()
+                break
+    finally:
+        # Also when the request is cancelled: no case may outlive build_dir.
+        for future in submitted:
+            future.cancel()
+        await asyncio.to_thread(wait, submitted)
+        await asyncio.to_thread(shutil.rmtree, build_dir, True)
+
+    for index, result in enumerate(results):
+        if result is None:
+            results[index] = {"verdict": VERDICT_SKIPPED, "execution_time": 0.0}
+    for index, result in enumerate(results):
+        result["case"] = index
+
+    failures = [r["verdict"] for r in results if r["verdict"] not in (VERDICT_ACCEPTED, VERDICT_SKIPPED)]
+    return {
+        "verdict": failures[0] if failures else VERDICT_ACCEPTED,
+        "passed": sum(r["verdict"] == VERDICT_ACCEPTED for r in results),
+        "total": len(results),
+        "cases": results,
+        "execution_time": round(time.perf_counter() - started, 3),
+    }
@@ -3,7 +3,13 @@ import os
 import uuid
 import asyncio
 import sys
+import errno
+import signal
+import termios
 import subprocess
+from . import workspace
+from . import janitor
+from . import languages
 
 #--------------------------------------------------------------------------
 # Configuration: Use a dedicated directory for code files.
@@ -32,56 +38,433 @@ def create_temp_file(content, extension):
 #--------------------------------------------------------------------------
 # Start an interactive Python process for direct execution
 #--------------------------------------------------------------------------
-async def start_interactive_python(source_filepath):
+PYTHON_RUNNER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "python_runner.py")
+
+# Inline figure limits, passed through to the runner.
+FIGURE_FORMAT = os.environ.get("CODE_FIGURE_FORMAT", "png")
+FIGURE_MAX_PX = int(os.environ.get("CODE_FIGURE_MAX_PX", "1200"))
+FIGURE_MAX_BYTES = int(os.environ.get("CODE_FIGURE_MAX_BYTES", str(2 * 1024 * 1024)))
+FIGURE_MAX_COUNT = int(os.environ.get("CODE_FIGURE_MAX_COUNT", "20"))
+# Programs write block-buffered stdout that the runner flushes this often
+# (and on every input() call), instead of running under -u.
+FLUSH_INTERVAL_MS = int(os.environ.get("CODE_FLUSH_INTERVAL_MS", "50"))
+# Prompts per run that can be rewound to (each keeps a forked process alive).
+MAX_CHECKPOINTS = int(os.environ.get("CODE_MAX_CHECKPOINTS", "8"))
+
+
+async def open_pipe_reader(read_fd):
     """
-    Launches a Python subprocess for direct code execution without Docker.
-    Creates a wrapper that overrides input() so that prompts are flushed.
-    Returns an asyncio subprocess.Process for the Python interpreter.
+    Wraps the read end of an os.pipe() in an asyncio StreamReader.
+    Returns (reader, transport); closing the transport closes the pipe.
     """
-    filename = os.path.basename(source_filepath)
-    
-    # Create a Python wrapper that flushes prompt output immediately
-    wrapper_content = f"""
-import sys, os 
-# Read the original code
-with open('{source_filepath}', 'r') as f:
-    code = f.read()
-exec_globals = {{"__name__": "__main__"}}
-def custom_input(prompt=''):
-    sys.stdout.write("PROMPT:" + prompt + "\\n")
-    sys.stdout.flush()
-    return sys.stdin.readline().rstrip("\\n")
-exec_globals['input'] = custom_input
-try:
-    exec(code, exec_globals)
-except Exception as e:
-    print(f"Error: {{type(e).__name__}}: {{e}}", file=sys.stderr)
-    sys.exit(1)
-"""
-    # Save the wrapper in our persistent directory
-    wrapper_filepath = create_temp_file(wrapper_content, "py")
-    
-    # Run Python directly (no Docker)
-    process = await asyncio.create_subprocess_exec(
-        sys.executable, "-u", wrapper_filepath,
-        stdin=asyncio.subprocess.PIPE,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    transport, _protocol = await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader),
+        os.fdopen(read_fd, "rb", buffering=0)
     )
+    return reader, transport
+
+
+async def start_interactive_python(source_filepath, cwd=None, owner=None, kernel=False, checkpoint_dir=None,
+                                   warm_modules=None, interactive=True):
+    """
+    Launches a Python subprocess for direct code execution without Docker.
+    The program is run by python_runner.py, which overrides input() so that
+    prompts are flushed and streams matplotlib figures over a side pipe.
+    The program runs with cwd (the session workspace) as its working directory.
+    The child leads its own process group so that everything it spawns can
+    be stopped together (see stop_process_group), and is registered with
+    the janitor under owner (the session token).
+    With kernel=True the runner stays alive and executes cells sent with
+    send_cell; source_filepath is ignored. With a checkpoint_dir the runner
+    forks at each prompt so the run can be rewound (see resume_checkpoint),
+    and reports its checkpoints and exit on process.status_stream.
+    With warm_modules the runner imports them and then waits for its job on
+    stdin (see prewarm.py); source_filepath is ignored. stdout is always
+    block-buffered; the runner flushes it every FLUSH_INTERVAL_MS and before
+    each prompt, so output still arrives while the program runs and little
+    is lost when it is stopped. With interactive=False stdin is /dev/null,
+    for programs that never read input.
+    Returns an asyncio subprocess.Process for the Python interpreter; the
+    figure stream is available as process.figure_stream.
+    """
+    figure_read_fd, figure_write_fd = os.pipe()
+    child_fds = [figure_write_fd]
+    env = os.environ.copy()
+    env.update({
+        "MPLBACKEND": "Agg",
+        "CODY_FIGURE_FD": str(figure_write_fd),
+        "CODY_FIGURE_FORMAT": FIGURE_FORMAT,
+        "CODY_FIGURE_MAX_PX": str(FIGURE_MAX_PX),
+        "CODY_FIGURE_MAX_BYTES": str(FIGURE_MAX_BYTES),
+        "CODY_FIGURE_MAX_COUNT": str(FIGURE_MAX_COUNT),
+    })
+    # Unbuffered output costs a write() and a reader wakeup per print().
+    env.pop("PYTHONUNBUFFERED", None)
+    stdin = asyncio.subprocess.PIPE
+    if not interactive:
+        stdin = asyncio.subprocess.DEVNULL
+    if not warm_modules:
+        # Warm interpreters learn the flush interval with their job.
+        env["CODY_FLUSH_MS"] = str(FLUSH_INTERVAL_MS)
+    runner_args = [source_filepath]
+    control_write_fd = None
+    status_read_fd = None
+    if warm_modules:
+        runner_args = ["--warm", ",".join(warm_modules)]
+    if kernel:
+        control_read_fd, control_write_fd = os.pipe()
+        child_fds.append(control_read_fd)
+        env["CODY_CONTROL_FD"] = str(control_read_fd)
+        runner_args = ["--kernel"]
+    if checkpoint_dir:
+        # Reports the server acts on (pids to kill) must not share stdout
+        # with the program's own output.
+        status_read_fd, status_write_fd = os.pipe()
+        child_fds.append(status_write_fd)
+        env["CODY_STATUS_FD"] = str(status_write_fd)
+        env["CODY_CHECKPOINT_DIR"] = checkpoint_dir
+        env["CODY_MAX_CHECKPOINTS"] = str(MAX_CHECKPOINTS)
+
+    try:
+        # Run Python directly (no Docker)
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, PYTHON_RUNNER, *runner_args,
+            stdin=stdin,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=cwd,
+            env=env,
+            pass_fds=child_fds,
+            preexec_fn=workspace.limit_file_size,
+            start_new_session=True
+        )
+    except Exception:
+        os.close(figure_read_fd)
+        for fd in (control_write_fd, status_read_fd):
+            if fd is not None:
+                os.close(fd)
+        raise
+    finally:
+        # Only the child keeps these ends, so we see EOF when it exits.
+        for fd in child_fds:
+            os.close(fd)
+
+    janitor.track(process, owner)
+    process.figure_stream, process.figure_transport = await open_pipe_reader(figure_read_fd)
+    process.control_transport = None
+    if control_write_fd is not None:
+        process.control_transport = await open_pipe_writer(control_write_fd)
+    process.status_stream = process.status_transport = None
+    if status_read_fd is not None:
+        process.status_stream, process.status_transport = await open_pipe_reader(status_read_fd)
     return process
 
+
+async def open_pipe_writer(write_fd):
+    """Wraps the write end of an os.pipe() in an asyncio write transport."""
+    loop = asyncio.get_running_loop()
+    transport, _protocol = await loop.connect_write_pipe(
+        asyncio.Protocol,
+        os.fdopen(write_fd, "wb", buffering=0)
+    )
+    return transport
+
+
+# Runner markers on stdout start with this byte: "\x1e<NAME>:<fields>\n".
+MARKER_PREFIX = b"\x1e"
+
+
+def send_cell(process, cell_id, code):
+    """Queues a cell on a kernel started with kernel=True."""
+    data = code.encode("utf-8")
+    process.control_transport.write(f"{cell_id} {len(data)}\n".encode("ascii") + data)
+
+
+async def read_figure(stream):
+    """
+    Reads one figure written by the runner and returns (format, data),
+    or None once the runner has exited.
+    """
+    header = await stream.readline()
+    if not header:
+        return None
+    fmt, size = header.decode("ascii").split()
+    data = await stream.readexactly(int(size))
+    return fmt, data
+
+async def resume_checkpoint(checkpoint_dir, n, attempts=50):
+    """
+    Wakes the process frozen at prompt n so that it forks a new branch.
+    Returns False if no process is waiting on that checkpoint.
+    """
+    fifo = os.path.join(checkpoint_dir, f"checkpoint_{n}")
+    for _attempt in range(attempts):
+        try:
+            # Non-blocking open fails with ENXIO until the holder is listening.
+            fd = os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError:
+            await asyncio.sleep(0.02)
+            continue
+        try:
+            os.write(fd, b"rewind\n")
+        finally:
+            os.close(fd)
+        return True
+    return False
+
+
+def kill_pid(pid, pgid):
+    """SIGKILLs pid if it is still in process group pgid (pids can be reused)."""
+    try:
+        if pid > 0 and os.getpgid(pid) == pgid:
+            os.kill(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+#--------------------------------------------------------------------------
+# Stop a program together with everything it started
+#--------------------------------------------------------------------------
+STOP_GRACE_SECONDS = float(os.environ.get("CODE_STOP_GRACE_MS", "100")) / 1000
+
+
+def signal_process_group(pgid, sig):
+    try:
+        os.killpg(pgid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def wait_for_exit(process, poll_interval=0.05):
+    """
+    Returns the exit code as soon as the process itself has exited.
+    process.wait() also waits for its pipes to close, which never happens
+    while a background grandchild keeps them open.
+    """
+    waiter = asyncio.ensure_future(process.wait())
+    try:
+        while not waiter.done():
+            if process.returncode is not None:
+                return process.returncode
+            await asyncio.wait({waiter}, timeout=poll_interval)
+        return waiter.result()
+    finally:
+        waiter.cancel()
+
+
+async def stop_process_group(process, grace=STOP_GRACE_SECONDS):
+    """
+    Sends SIGTERM to the process group led by process, gives it grace
+    seconds to exit, then SIGKILLs whatever is left of the group (including
+    grandchildren started by os.system or multiprocessing). Finally closes
+    every pipe to the process.
+    """
+    pgid = process.pid
+    if process.returncode is None:
+        signal_process_group(pgid, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(wait_for_exit(process), grace)
+        except asyncio.TimeoutError:
+            pass
+    # The leader may be gone while members of its group live on.
+    signal_process_group(pgid, signal.SIGKILL)
+    await wait_for_exit(process)
+    janitor.retire(process)
+
+    if process.stdin:
+        process.stdin.close()
+    for name in ("figure_transport", "control_transport", "status_transport", "pty_transport"):
+        side_transport = getattr(process, name, None)
+        if side_transport:
+            side_transport.close()
+    # Closes the stdout/stderr pipe transports even if a reader never hit EOF.
+    transport = getattr(process, "_transport", None)
+    if transport:
+        transport.close()
+
 #--------------------------------------------------------------------------
 # Main function to start interactive execution (API remains compatible)
 #--------------------------------------------------------------------------
-async def start_interactive_docker(language, source_filepath, mount_dir):
+async def start_interactive_docker(language, source_filepath, mount_dir, owner=None, checkpoint_dir=None,
+                                   interactive=True):
     """
     Compatible API that now directly executes Python code without Docker.
+    mount_dir is the directory the program sees as its working directory.
     For non-Python languages, returns a helpful error message.
     """
-    if language.lower() != "python":
+    entry = languages.get(language)
+    if entry is None or entry.name != "python":
         raise Exception(f"Sorry, only Python is supported in this environment. {language} requires Docker which is not available on this hosting plan.")
     
-    return await start_interactive_python(source_filepath)
+    return await start_interactive_python(source_filepath, cwd=mount_dir, owner=owner,
+                                          checkpoint_dir=checkpoint_dir, interactive=interactive)
+
+
+async def start_python_kernel(mount_dir, owner=None):
+    """Starts a persistent Python kernel for cell-by-cell execution."""
+    return await start_interactive_python(None, cwd=mount_dir, owner=owner, kernel=True)
+
+#--------------------------------------------------------------------------
+# Start a Node.js process: a pool worker (see nodepool.py) or a plain run
+#--------------------------------------------------------------------------
+NODE_WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "node_worker.js")
+# A pool worker is replaced after this many runs or once it grows this big.
+NODE_MAX_RUNS = int(os.environ.get("CODE_NODE_MAX_RUNS", "50"))
+NODE_MAX_RSS_MB = int(os.environ.get("CODE_NODE_MAX_RSS_MB", "256"))
+
+
+async def start_node_worker(cwd=None):
+    """
+    Starts a warm Node.js worker that runs one job after another, each sent
+    with nodepool.assign. The end of each job, its exit code and how many
+    bytes it wrote to stdout and stderr are reported on
+    process.status_stream, never on the program's own output (see
+    node_worker.js). Returns an asyncio subprocess.Process with
+    process.control_transport.
+    """
+    control_read_fd, control_write_fd = os.pipe()
+    status_read_fd, status_write_fd = os.pipe()
+    child_fds = [control_read_fd, status_write_fd]
+    env = os.environ.copy()
+    env.update({
+        "CODY_CONTROL_FD": str(control_read_fd),
+        "CODY_STATUS_FD": str(status_write_fd),
+        "CODY_NODE_MAX_RUNS": str(NODE_MAX_RUNS),
+        "CODY_NODE_MAX_RSS_MB": str(NODE_MAX_RSS_MB),
+    })
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "node", NODE_WORKER,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=cwd,
+            env=env,
+            pass_fds=child_fds,
+            preexec_fn=workspace.limit_file_size,
+            start_new_session=True
+        )
+    except Exception:
+        os.close(control_write_fd)
+        os.close(status_read_fd)
+        raise
+    finally:
+        for fd in child_fds:
+            os.close(fd)
+
+    janitor.track(process)
+    process.figure_stream = process.figure_transport = None
+    process.status_stream, process.status_transport = await open_pipe_reader(status_read_fd)
+    process.control_transport = await open_pipe_writer(control_write_fd)
+    return process
+
+
+async def start_interactive_node(source_filepath, cwd=None, owner=None):
+    """
+    Runs a JavaScript file in a Node.js process of its own, for programs
+    the pool cannot serve (see nodepool.wants_pool).
+    """
+    process = await asyncio.create_subprocess_exec(
+        "node", source_filepath,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=cwd,
+        preexec_fn=workspace.limit_file_size,
+        start_new_session=True
+    )
+    janitor.track(process, owner)
+    process.figure_stream = process.figure_transport = None
+    process.status_stream = process.status_transport = None
+    process.control_transport = None
+    return process
+
+#--------------------------------------------------------------------------
+# Run a program on a pseudo-terminal
+#--------------------------------------------------------------------------
+# Languages whose interactive runs get a pty as stdin/stdout. libc (and
+# most runtimes) line-buffer a terminal and flush it before reading one,
+# so prompts printed without a newline arrive right away.
+PTY_LANGUAGES = {
+    name.strip() for name in os.environ.get("CODE_PTY_LANGUAGES", "c,cpp").split(",") if name.strip()
+}
+# Where a program sleeps while it reads a terminal (/proc/<pid>/wchan).
+TTY_READ_WCHANS = ("wait_woken", "n_tty_read")
+
+
+class PtyReaderProtocol(asyncio.StreamReaderProtocol):
+    """Reads a pty master, where EIO means the program's side is closed."""
+
+    def connection_lost(self, exc):
+        if isinstance(exc, OSError) and exc.errno == errno.EIO:
+            exc = None
+        super().connection_lost(exc)
+
+
+async def start_interactive_pty(argv, cwd=None, owner=None):
+    """
+    Runs argv with a pseudo-terminal as stdin and stdout (stderr stays a
+    pipe). Echo and output post-processing are turned off, so input is not
+    repeated back and newlines come through as written. Returns an asyncio
+    subprocess.Process whose stdin and stdout are streams on the pty master.
+    """
+    master_fd, slave_fd = os.openpty()
+    try:
+        attrs = termios.tcgetattr(slave_fd)
+        attrs[1] &= ~termios.OPOST
+        attrs[3] &= ~(termios.ECHO | termios.ECHONL)
+        termios.tcsetattr(slave_fd, termios.TCSANOW, attrs)
+        process = await asyncio.create_subprocess_exec(
+            *argv,
+            stdin=slave_fd,
+            stdout=slave_fd,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=cwd,
+            preexec_fn=workspace.limit_file_size,
+            start_new_session=True
+        )
+    except Exception:
+        os.close(master_fd)
+        raise
+    finally:
+        # Only the child keeps the terminal side, so we see EOF when it exits.
+        os.close(slave_fd)
+
+    janitor.track(process, owner)
+    loop = asyncio.get_running_loop()
+    write_file = os.fdopen(os.dup(master_fd), "wb", buffering=0)
+    transport, protocol = await loop.connect_write_pipe(
+        lambda: asyncio.streams.FlowControlMixin(loop=loop), write_file
+    )
+    process.stdin = asyncio.StreamWriter(transport, protocol, None, loop)
+    process.stdout = asyncio.StreamReader()
+    process.pty_transport, _protocol = await loop.connect_read_pipe(
+        lambda: PtyReaderProtocol(process.stdout),
+        os.fdopen(master_fd, "rb", buffering=0)
+    )
+    process.figure_stream = process.figure_transport = None
+    process.status_stream = process.status_transport = None
+    process.control_transport = None
+    return process
+
+
+def reading_terminal(process):
+    """
+    Guesses whether a program is blocked reading its terminal, from
+    /proc/<pid>/stat and wchan. Where the kernel does not tell, any
+    sleeping program counts as reading.
+    """
+    try:
+        with open(f"/proc/{process.pid}/stat") as f:
+            state = f.read().rpartition(")")[2].split()[0]
+        with open(f"/proc/{process.pid}/wchan") as f:
+            wchan = f.read().strip()
+    except (OSError, IndexError):
+        return True
+    if state != "S":
+        return False
+    return wchan in TTY_READ_WCHANS or wchan in ("", "0")
 
 # For compatibility with old code
 async def compile_source(language, source_filepath, mount_dir):
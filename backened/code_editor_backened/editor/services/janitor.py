@@ -0,0 +1,185 @@
+import os
+import time
+import signal
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+#--------------------------------------------------------------------------
+# Configuration: background supervisor that reclaims processes, pipes and
+# files leaked by crashed consumers.
+#--------------------------------------------------------------------------
+JANITOR_INTERVAL_SECONDS = float(os.environ.get("CODE_JANITOR_INTERVAL_SECONDS", "30"))
+# Process groups of finished runs are watched this long for stragglers.
+RETIRED_GROUP_TTL_SECONDS = float(os.environ.get("CODE_JANITOR_RETIRED_TTL_SECONDS", "600"))
+
+# pid -> (process, owner, started_at) for every live child we spawned.
+_children = {}
+# pgid -> time the run was reaped; members still alive are stragglers.
+_retired_groups = {}
+# Zombie children seen during the previous sweep.
+_zombies_seen = set()
+_counters = {
+    "sweeps": 0,
+    "orphans_killed": 0,
+    "stragglers_killed": 0,
+    "zombies_reaped": 0,
+}
+_state = {"task": None, "owner_alive": None}
+
+#--------------------------------------------------------------------------
+# Registration (called by interactive_executor)
+#--------------------------------------------------------------------------
+def track(process, owner=None):
+    """Records a child process and the session that owns it."""
+    _children[process.pid] = (process, owner, time.monotonic())
+    # The pid may be that of a retired group leader; the new run is not a straggler.
+    _retired_groups.pop(process.pid, None)
+
+
+def retire(process):
+    """
+    Forgets a child that has been reaped. Its process group stays on watch
+    for a while so anything that escaped the kill is cleaned up later.
+    """
+    _children.pop(process.pid, None)
+    _retired_groups[process.pid] = time.monotonic()
+
+
+def ensure_started(owner_alive):
+    """
+    Starts the supervisor on the running event loop if it is not running.
+    owner_alive(owner) must return False once a session no longer exists.
+    """
+    _state["owner_alive"] = owner_alive
+    task = _state["task"]
+    if task is None or task.done():
+        _state["task"] = asyncio.get_running_loop().create_task(_run())
+
+#--------------------------------------------------------------------------
+# /proc helpers
+#--------------------------------------------------------------------------
+def _read_stat(pid):
+    """Returns (state, ppid, pgid) for a pid, or None if it is gone."""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    # The command name may contain spaces, so split after its closing paren.
+    fields = data[data.rfind(b")") + 2:].split()
+    return fields[0].decode(), int(fields[1]), int(fields[2])
+
+
+def _all_pids():
+    try:
+        return [int(name) for name in os.listdir("/proc") if name.isdigit()]
+    except OSError:
+        return []
+
+
+def _kill_group(pgid):
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+#--------------------------------------------------------------------------
+# Sweep
+#--------------------------------------------------------------------------
+def sweep():
+    """One pass of the janitor. Safe to call directly (e.g. from tests)."""
+    _counters["sweeps"] += 1
+    owner_alive = _state["owner_alive"]
+    now = time.monotonic()
+
+    # 1. Children whose session is gone, or which exited without being reaped.
+    killed_now = set()
+    for pid, (process, owner, _started) in list(_children.items()):
+        orphaned = owner is not None and owner_alive is not None and not owner_alive(owner)
+        if orphaned or process.returncode is not None:
+            _kill_group(pid)
+            retire(process)
+            killed_now.add(pid)
+            if orphaned:
+                _counters["orphans_killed"] += 1
+
+    # 2. Stragglers left in the process groups of finished runs, and zombies
+    #    among our own children that nobody is waiting for.
+    my_pid = os.getpid()
+    zombies = set()
+    live_groups = set()
+    reused_groups = set()
+    for pid in _all_pids():
+        stat = _read_stat(pid)
+        if stat is None:
+            continue
+        state, ppid, pgid = stat
+        if state == "Z":
+            if ppid == my_pid and pid not in _children:
+                zombies.add(pid)
+            continue
+        if pgid in _retired_groups and pgid not in killed_now and pgid not in _children and pid != my_pid:
+            if pid == pgid:
+                # Our leader was reaped, so a live leader means the pid was
+                # reused for a new group (e.g. an untracked REST run).
+                reused_groups.add(pgid)
+            live_groups.add(pgid)
+
+    for pgid in reused_groups:
+        del _retired_groups[pgid]
+    live_groups -= reused_groups
+    for pgid in live_groups:
+        _kill_group(pgid)
+        _counters["stragglers_killed"] += 1
+    for pgid, retired_at in list(_retired_groups.items()):
+        if pgid not in live_groups and now - retired_at > RETIRED_GROUP_TTL_SECONDS:
+            del _retired_groups[pgid]
+
+    # A zombie seen twice in a row has no waiter; one seen once may be
+    # about to be reaped by subprocess or asyncio, so leave it alone.
+    for pid in zombies & _zombies_seen:
+        try:
+            if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                _counters["zombies_reaped"] += 1
+        except ChildProcessError:
+            pass
+    _zombies_seen.clear()
+    _zombies_seen.update(zombies - set(_children))
+
+    if live_groups:
+        logger.warning("Janitor killed stragglers in %d process groups", len(live_groups))
+
+
+async def _run():
+    while True:
+        await asyncio.sleep(JANITOR_INTERVAL_SECONDS)
+        try:
+            sweep()
+        except Exception:
+            logger.exception("Janitor sweep failed")
+
+#--------------------------------------------------------------------------
+# Metrics
+#--------------------------------------------------------------------------
+def _count_entries(path):
+    try:
+        return len(os.listdir(path))
+    except OSError:
+        return None
+
+
+def snapshot(code_exec_dir=None, workspace_root=None):
+    """Returns leak-related counters for the current process."""
+    metrics = {
+        "live_children": len(_children),
+        "watched_process_groups": len(_retired_groups),
+        "open_fds": _count_entries("/proc/self/fd"),
+    }
+    if code_exec_dir:
+        metrics["code_exec_files"] = _count_entries(code_exec_dir)
+    if workspace_root:
+        metrics["workspaces"] = _count_entries(workspace_root)
+    metrics.update(_counters)
+    return metrics
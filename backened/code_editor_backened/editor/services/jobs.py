@@ -0,0 +1,141 @@
+import os
+import time
+import uuid
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from . import code_executor
+from . import scheduler
+from .interactive_executor import CODE_EXEC_DIR
+
+#--------------------------------------------------------------------------
+# Configuration: background jobs (POST /api/jobs/). Once granted a slot, a
+# job runs on a worker thread of its own pool while the client polls for
+# its output, so a run may take far longer than an HTTP request is allowed
+# to.
+#--------------------------------------------------------------------------
+JOB_WORKERS = int(os.environ.get("CODE_JOB_WORKERS", str(code_executor.EXEC_WORKERS)))
+JOB_TIMEOUT_SECONDS = float(os.environ.get("CODE_JOB_TIMEOUT_SECONDS", "120"))
+# How long a finished job's result can still be fetched.
+JOB_TTL_SECONDS = float(os.environ.get("CODE_JOB_TTL_SECONDS", "600"))
+# Output kept per stream; the rest is dropped and the job marked truncated.
+JOB_MAX_OUTPUT_CHARS = int(os.environ.get("CODE_JOB_MAX_OUTPUT_CHARS", str(1024 * 1024)))
+# Jobs kept at once, queued, running or finished.
+MAX_JOBS = int(os.environ.get("CODE_MAX_JOBS", "1000"))
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_FINISHED = "finished"
+
+_pool = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="code-job")
+_jobs = {}
+_lock = threading.Lock()
+
+
+class Job:
+    """
+    One background run. Output is appended by the worker thread as the
+    program writes it and read by pollers from any offset.
+    """
+
+    def __init__(self, language, timeout, client=None):
+        self.id = uuid.uuid4().hex
+        self.language = language
+        self.client = client
+        self.timeout = timeout
+        self.status = STATUS_QUEUED
+        self.created = time.time()
+        self.finished = None
+        self.output = {"stdout": [], "stderr": []}
+        self.length = {"stdout": 0, "stderr": 0}
+        self.truncated = False
+        self.result = None
+        self.lock = threading.Lock()
+
+    def append(self, stream, text):
+        with self.lock:
+            room = JOB_MAX_OUTPUT_CHARS - self.length[stream]
+            if len(text) > room:
+                text = text[:max(room, 0)]
+                self.truncated = True
+            if text:
+                self.output[stream].append(text)
+                self.length[stream] += len(text)
+
+    def finish(self, result):
+        with self.lock:
+            self.result = result
+            self.status = STATUS_FINISHED
+            self.finished = time.time()
+
+    def snapshot(self, stdout_offset=0, stderr_offset=0):
+        """
+        The job's status and the output past the given offsets (characters
+        already seen). The returned offsets are where the next poll starts.
+        """
+        with self.lock:
+            data = {"job_id": self.id, "status": self.status, "language": self.language}
+            for stream, offset in (("stdout", stdout_offset), ("stderr", stderr_offset)):
+                text = "".join(self.output[stream])
+                # Joined once, so later polls do not join again.
+                self.output[stream] = [text] if text else []
+                data[stream] = text[offset:]
+                data[stream + "_offset"] = len(text)
+            data["truncated"] = self.truncated
+            if self.result is not None:
+                data["result"] = self.result
+            return data
+
+    def expired(self, now):
+        return self.finished is not None and now - self.finished > JOB_TTL_SECONDS
+
+
+def _purge(now):
+    for job_id in [job_id for job_id, job in _jobs.items() if job.expired(now)]:
+        del _jobs[job_id]
+
+
+def submit(language, code, user_input="", timeout=JOB_TIMEOUT_SECONDS, client=None):
+    """
+    Queues code to run in the background, as client's batch work (see
+    scheduler.py), and returns its Job at once. Raises RuntimeError when
+    MAX_JOBS jobs are already kept.
+    """
+    job = Job(language, min(timeout, JOB_TIMEOUT_SECONDS), client)
+    with _lock:
+        _purge(time.time())
+        if len(_jobs) >= MAX_JOBS:
+            raise RuntimeError("Too many jobs; try again later.")
+        _jobs[job.id] = job
+    scheduler.submit(_pool, client, scheduler.PRIORITY_BATCH, _run_job, job, code, user_input)
+    return job
+
+
+def get(job_id):
+    """Returns the Job with job_id, or None if unknown or expired."""
+    with _lock:
+        _purge(time.time())
+        return _jobs.get(job_id)
+
+
+def _run_job(job, code, user_input):
+    job.status = STATUS_RUNNING
+    build_dir = tempfile.mkdtemp(prefix="job_", dir=CODE_EXEC_DIR)
+    try:
+        try:
+            argv = code_executor.prepare_program(job.language, code, build_dir)
+        except code_executor.CompileError as e:
+            job.append("stderr", str(e))
+            job.finish({"exit_code": None, "timed_out": False, "execution_time": 0.0,
+                        "diagnostics": e.diagnostics})
+            return
+        result = code_executor.run_streaming(argv, user_input, build_dir, job.append, job.timeout, job.client)
+        if result["timed_out"]:
+            job.append("stderr", f"\nTime limit of {job.timeout:g}s exceeded.")
+        job.finish(result)
+    except Exception as e:
+        job.append("stderr", str(e))
+        job.finish({"exit_code": None, "timed_out": False, "execution_time": 0.0})
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
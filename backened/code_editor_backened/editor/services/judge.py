@@ -0,0 +1,175 @@
+import io
+import re
+import math
+
+#--------------------------------------------------------------------------
+# Streaming output comparison. A comparator is fed stdout in chunks as the
+# program produces it and reports the first mismatch straight away, so the
+# program can be killed early. Only the current line or token is held in
+# memory, however much the program prints.
+#--------------------------------------------------------------------------
+COMPARATOR_EXACT = "exact"
+COMPARATOR_WHITESPACE = "whitespace"
+COMPARATOR_FLOAT = "float"
+COMPARATORS = (COMPARATOR_EXACT, COMPARATOR_WHITESPACE, COMPARATOR_FLOAT)
+
+DEFAULT_FLOAT_TOLERANCE = 1e-6
+# A single output token longer than this is a wrong answer, which keeps
+# the partial-token buffer bounded.
+MAX_TOKEN_CHARS = 1024 * 1024
+
+_TOKEN_RE = re.compile(r"\S+")
+
+
+class LineComparator:
+    """
+    Line-by-line comparison. Trailing whitespace on a line and trailing
+    blank lines are ignored; everything else must match exactly.
+    """
+
+    def __init__(self, expected):
+        self._lines = io.StringIO(expected)
+        self._line = None
+        self._pos = 0
+        self.mismatch = None
+        self._next_line()
+
+    def _next_line(self):
+        line = self._lines.readline()
+        # None once expected output is exhausted: only whitespace may follow.
+        self._line = line.rstrip() if line else None
+        self._pos = 0
+
+    def feed(self, chunk):
+        """Consumes a chunk of output. Returns False at the first mismatch."""
+        if self.mismatch:
+            return False
+        start = 0
+        while start < len(chunk):
+            end = chunk.find("\n", start)
+            segment = chunk[start:] if end == -1 else chunk[start:end]
+            if not self._match_segment(segment):
+                return False
+            if end == -1:
+                break
+            if self._line is not None:
+                if self._pos < len(self._line):
+                    self.mismatch = "Output line ended early."
+                    return False
+                self._next_line()
+            start = end + 1
+        return True
+
+    def _match_segment(self, segment):
+        line = self._line
+        if line is None:
+            if segment.strip():
+                self.mismatch = "Extra output after the expected answer."
+                return False
+            return True
+        if self._pos < len(line):
+            overlap = segment[:len(line) - self._pos]
+            if line[self._pos:self._pos + len(overlap)] != overlap:
+                self.mismatch = "Output differs from the expected line."
+                return False
+            segment = segment[len(overlap):]
+            self._pos += len(overlap)
+        if segment.strip():
+            self.mismatch = "Output line is longer than expected."
+            return False
+        self._pos += len(segment)
+        return True
+
+    def finish(self):
+        """Called at end of output. Returns True if the output matched."""
+        if self.mismatch:
+            return False
+        if self._line is not None and self._pos < len(self._line):
+            self.mismatch = "Output ended early."
+            return False
+        if self._line is not None:
+            self._next_line()
+        while self._line is not None:
+            if self._line:
+                self.mismatch = "Output ended early."
+                return False
+            self._next_line()
+        return True
+
+
+class TokenComparator:
+    """
+    Compares whitespace-separated tokens, so line breaks and spacing do
+    not matter. With a tolerance, numeric tokens match when they are within
+    it (absolute or relative).
+    """
+
+    def __init__(self, expected, tolerance=None):
+        self._expected = _TOKEN_RE.finditer(expected)
+        self._tolerance = tolerance
+        self._partial = ""
+        self.mismatch = None
+
+    def feed(self, chunk):
+        """Consumes a chunk of output. Returns False at the first mismatch."""
+        if self.mismatch:
+            return False
+        text = self._partial + chunk
+        tokens = text.split()
+        # A token touching the end of the chunk may continue in the next one.
+        if tokens and not text[-1:].isspace():
+            self._partial = tokens.pop()
+            if len(self._partial) > MAX_TOKEN_CHARS:
+                self.mismatch = "Output token is too long."
+                return False
+        else:
+            self._partial = ""
+        for token in tokens:
+            if not self._match(token):
+                return False
+        return True
+
+    def _match(self, token):
+        expected = next(self._expected, None)
+        if expected is None:
+            self.mismatch = "Extra output after the expected answer."
+            return False
+        expected = expected.group()
+        if token == expected or self._close(token, expected):
+            return True
+        self.mismatch = f"Expected {expected[:50]!r}, got {token[:50]!r}."
+        return False
+
+    def _close(self, token, expected):
+        if self._tolerance is None:
+            return False
+        try:
+            actual, wanted = float(token), float(expected)
+        except ValueError:
+            return False
+        if math.isnan(actual) or math.isnan(wanted):
+            return math.isnan(actual) and math.isnan(wanted)
+        return math.isclose(actual, wanted, rel_tol=self._tolerance, abs_tol=self._tolerance)
+
+    def finish(self):
+        """Called at end of output. Returns True if the output matched."""
+        if self.mismatch:
+            return False
+        if self._partial and not self._match(self._partial):
+            return False
+        self._partial = ""
+        if next(self._expected, None) is not None:
+            self.mismatch = "Output ended early."
+            return False
+        return True
+
+
+def make_comparator(expected, comparator=COMPARATOR_EXACT, tolerance=DEFAULT_FLOAT_TOLERANCE):
+    """Returns a fresh streaming comparator for the expected output."""
+    if comparator == COMPARATOR_EXACT:
+        return LineComparator(expected)
+    if comparator == COMPARATOR_WHITESPACE:
+        return TokenComparator(expected)
+    if comparator == COMPARATOR_FLOAT:
+        return TokenComparator(expected, tolerance)
+    raise ValueError(f"Unknown comparator: {comparator}")
@@ -0,0 +1,111 @@
+import os
+import sys
+import shutil
+import functools
+import subprocess
+from collections import namedtuple
+
+#--------------------------------------------------------------------------
+# Language registry: the one place that knows how each language is
+# compiled and run. Commands are argv templates; {python}, {source} and
+# {binary} are filled in by command().
+#--------------------------------------------------------------------------
+Language = namedtuple("Language", [
+    "name",         # canonical name used by the API and the WebSocket
+    "code",         # numeric language_code of the REST API
+    "aliases",      # other accepted names
+    "extension",    # source file extension
+    "compile",      # argv template, or None if nothing is compiled
+    "run",          # argv template, or None if the browser renders it
+    "version",      # argv that prints the toolchain version
+    "interactive",  # supports interactive (WebSocket) runs
+])
+
+LANGUAGES = [
+    Language("python", 1, (), "py", None, ["{python}", "{source}"], ["{python}", "--version"], True),
+    Language("c", 2, (), "c", ["gcc", "-O2", "-o", "{binary}", "{source}", "-lm"], ["{binary}"], ["gcc", "--version"], True),
+    Language("cpp", 3, ("c++",), "cpp", ["g++", "-O2", "-o", "{binary}", "{source}"], ["{binary}"], ["g++", "--version"], True),
+    Language("javascript", 4, ("js", "node"), "js", None, ["node", "{source}"], ["node", "--version"], True),
+    Language("html", 5, (), "html", None, None, None, False),
+]
+
+VERSION_PROBE_TIMEOUT_SECONDS = 5
+
+_by_name = {}
+for _language in LANGUAGES:
+    for _name in (_language.name,) + _language.aliases:
+        _by_name[_name] = _language
+_by_code = {language.code: language for language in LANGUAGES}
+
+#--------------------------------------------------------------------------
+# Lookup
+#--------------------------------------------------------------------------
+def get(name):
+    """Returns the Language for a name or alias (any case), or None."""
+    return _by_name.get((name or "").lower().strip())
+
+
+def by_code(code):
+    """Returns the Language for a REST language_code, or None."""
+    return _by_code.get(code)
+
+
+def command(template, source=None, binary=None):
+    """Fills in an argv template."""
+    values = {"python": sys.executable, "source": source, "binary": binary}
+    return [part.format(**values) for part in template]
+
+
+def timeout(language, default):
+    """Per-language time limit: CODE_TIMEOUT_<NAME> seconds, else default."""
+    return float(os.environ.get(f"CODE_TIMEOUT_{language.name.upper()}", default))
+
+#--------------------------------------------------------------------------
+# Toolchain probing (once per process)
+#--------------------------------------------------------------------------
+def _probe_version(argv):
+    try:
+        result = subprocess.run(
+            command(argv), capture_output=True, text=True, timeout=VERSION_PROBE_TIMEOUT_SECONDS
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    lines = (result.stdout or result.stderr).strip().splitlines()
+    return lines[0] if lines else None
+
+
+@functools.lru_cache(maxsize=None)
+def probe():
+    """
+    Checks which toolchains are installed and their versions. Runs once;
+    later calls return the cached result. Returns {name: {"available",
+    "version"}}.
+    """
+    toolchains = {}
+    for language in LANGUAGES:
+        tools = [argv for argv in (language.compile, language.run) if argv]
+        executables = [command(argv)[0] for argv in tools if not argv[0].startswith("{binary")]
+        available = all(shutil.which(executable) for executable in executables)
+        version = _probe_version(language.version) if available and language.version else None
+        toolchains[language.name] = {"available": available, "version": version}
+    return toolchains
+
+
+def is_available(language):
+    return probe()[language.name]["available"]
+
+
+def describe():
+    """Registry entries with their probed toolchain, for the API."""
+    toolchains = probe()
+    return [
+        {
+            "name": language.name,
+            "code": language.code,
+            "extension": language.extension,
+            "interactive": language.interactive,
+            "available": toolchains[language.name]["available"],
+            "version": toolchains[language.name]["version"],
+        }
+        for language in LANGUAGES
+    ]
@@ -0,0 +1,632 @@
+'use strict';
+/*
+ * Warm Node.js worker for interactive JavaScript runs (see nodepool.py).
+ *
+ *     node node_worker.js
+ *
+ * Waits for jobs on CODY_CONTROL_FD, one JSON line each:
+ * {"job": id, "source": path, "cwd": dir, "flush_ms": n}. Each job runs as a CommonJS
+ * module in a fresh vm context. readline and process.stdin read the
+ * worker's stdin, and question()/prompt() are flushed with an explicit
+ * PROMPT: marker, as python_runner.py does for input(). stdout is buffered
+ * and flushed every flush_ms, before each prompt and at the end of the job.
+ *
+ * A job ends when it has nothing left to do (no timers, pending I/O or
+ * open readline interface), calls process.exit() or throws. The worker
+ * then writes "EXIT:<job id>:<exit code>:<reusable 0|1>:<stdout bytes>:
+ * <stderr bytes>\n" on CODY_STATUS_FD, a pipe of its own so the program's
+ * output can never pass for it, and waits for the next job. The byte
+ * counts tell the server when it has read all of the job's output. It is
+ * not reusable after
+ * CODY_NODE_MAX_RUNS jobs, once its RSS exceeds CODY_NODE_MAX_RSS_MB, once
+ * stdin has been closed, or when a job was cut short with I/O pending.
+ * SIGINT interrupts the running job; it is ignored while the worker is idle.
+ *
+ * This file runs inside the child process, so it must only use Node's
+ * standard library.
+ */
+const fs = require('fs');
+const net = require('net');
+const vm = require('vm');
+const path = require('path');
+const util = require('util');
+const { EventEmitter } = require('events');
+const { Console } = require('console');
+const { createRequire } = require('module');
+
+const CONTROL_FD = Number(process.env.CODY_CONTROL_FD);
+const STATUS_FD = Number(process.env.CODY_STATUS_FD);
+const MAX_RUNS = Number(process.env.CODY_NODE_MAX_RUNS || 50);
+const MAX_RSS = Number(process.env.CODY_NODE_MAX_RSS_MB || 256) * 1024 * 1024;
+const OUTPUT_BUFFER_BYTES = 64 * 1024;
+// How often a job is checked for having nothing left to do.
+const IDLE_POLL_MS = 5;
+const PROMPT_MARKER = 'PROMPT:';
+
+let current = null;
+let runs = 0;
+// Input lines not yet taken by the running job.
+const inputLines = [];
+let partialLine = '';
+let inputEnded = false;
+
+//--------------------------------------------------------------------------
+// Output
+//--------------------------------------------------------------------------
+// Returns the number of bytes written.
+function writeAll(fd, text) {
+  const data = Buffer.from(text, 'utf8');
+  let offset = 0;
+  while (offset < data.length) {
+    try {
+      offset += fs.writeSync(fd, data, offset);
+    } catch (e) {
+      if (e.code !== 'EAGAIN') throw e;
+    }
+  }
+  return data.length;
+}
+
+class Job {
+  constructor(spec) {
+    this.id = String(spec.job || '');
+    this.source = spec.source;
+    this.cwd = spec.cwd;
+    this.exitCode = 0;
+    this.exiting = false;
+    this.done = false;
+    this.timers = new Set();
+    this.interfaces = new Set();
+    this.modules = new Map();
+    // "<source>:<line>:" of the module wrapper's own stack frame.
+    this.wrapperFrame = null;
+    this.globals = null;
+    this.firstCheck = null;
+    this.output = [];
+    this.outputBytes = 0;
+    // Bytes written to stdout (1) and stderr (2), for the exit report.
+    this.written = { 1: 0, 2: 0 };
+    this.stdin = new StdinShim(this);
+    this.process = makeProcess(this);
+    this.baseline = process.getActiveResourcesInfo().length;
+    this.flushTimer = spec.flush_ms > 0 ? setInterval(() => this.flush(), spec.flush_ms).unref() : null;
+    this.pollTimer = setInterval(() => checkDone(this), IDLE_POLL_MS).unref();
+  }
+
+  write(fd, text) {
+    if (this.done) return;
+    text = typeof text === 'string' ? text : Buffer.from(text).toString('utf8');
+    if (fd === 2) {
+      this.written[2] += writeAll(2, text);
+      return;
+    }
+    this.output.push(text);
+    this.outputBytes += text.length;
+    if (this.outputBytes >= OUTPUT_BUFFER_BYTES) this.flush();
+  }
+
+  flush() {
+    if (!this.output.length) return;
+    const text = this.output.join('');
+    this.output = [];
+    this.outputBytes = 0;
+    this.written[1] += writeAll(1, text);
+  }
+
+  prompt(text) {
+    this.write(1, PROMPT_MARKER + String(text) + '\n');
+    this.flush();
+  }
+
+  stream(fd) {
+    return Object.assign(new EventEmitter(), {
+      fd,
+      isTTY: false,
+      writable: true,
+      write: (chunk, encoding, callback) => {
+        this.write(fd, chunk);
+        if (typeof encoding === 'function') encoding();
+        else if (typeof callback === 'function') callback();
+        return true;
+      },
+      end() {},
+    });
+  }
+
+  // True while the job still waits on input it asked for.
+  readingInput() {
+    for (const rl of this.interfaces) {
+      if (!rl.paused) return true;
+    }
+    return this.stdin.flowing && !this.stdin.ended;
+  }
+}
+
+//--------------------------------------------------------------------------
+// Input: one queue of lines, handed to readline interfaces and
+// process.stdin listeners in the order they ask for them
+//--------------------------------------------------------------------------
+function readInput(chunk) {
+  const lines = (partialLine + chunk).split('\n');
+  partialLine = lines.pop();
+  inputLines.push(...lines);
+  pump();
+}
+
+function endInput() {
+  inputEnded = true;
+  if (partialLine) inputLines.push(partialLine);
+  partialLine = '';
+  pump();
+}
+
+function pump() {
+  const job = current;
+  if (!job) return;
+  while (inputLines.length) {
+    const consumer = [...job.interfaces].find((rl) => rl.wantsLine()) ||
+      (job.stdin.wantsLine() ? job.stdin : null);
+    if (!consumer) return;
+    consumer.take(inputLines.shift());
+  }
+  if (inputEnded) {
+    for (const rl of [...job.interfaces]) rl.close();
+    job.stdin.end();
+  }
+}
+
+class StdinShim extends EventEmitter {
+  constructor(job) {
+    super();
+    this.job = job;
+    this.fd = 0;
+    this.isTTY = false;
+    this.encoding = null;
+    this.flowing = false;
+    this.ended = false;
+    this.buffered = '';
+    this.on('newListener', (event) => {
+      if (event === 'data' || event === 'readable') this.flowing = true;
+      process.nextTick(pump);
+    });
+  }
+
+  setEncoding(encoding) { this.encoding = encoding; return this; }
+  resume() { this.flowing = true; process.nextTick(pump); return this; }
+  pause() { this.flowing = false; return this; }
+  setRawMode() { return this; }
+  unref() { return this; }
+  ref() { return this; }
+
+  wantsLine() {
+    return this.flowing && !this.ended && this.job.interfaces.size === 0;
+  }
+
+  take(line) {
+    const text = line + '\n';
+    if (this.listenerCount('readable')) {
+      this.buffered += text;
+      this.emit('readable');
+    }
+    if (this.listenerCount('data')) {
+      this.emit('data', this.encoding ? text : Buffer.from(text));
+    }
+  }
+
+  read() {
+    if (!this.buffered) return null;
+    const text = this.buffered;
+    this.buffered = '';
+    return this.encoding ? text : Buffer.from(text);
+  }
+
+  end() {
+    if (this.ended || !this.flowing) return;
+    this.ended = true;
+    if (this.listenerCount('readable')) this.emit('readable');
+    this.emit('end');
+    this.emit('close');
+  }
+}
+
+class Interface extends EventEmitter {
+  constructor(job, options, promises) {
+    super();
+    this.job = job;
+    this.promises = promises;
+    this.promptText = (options && options.prompt) || '> ';
+    this.closed = false;
+    this.paused = false;
+    this.questions = [];
+    this.waiters = [];
+    this.terminal = false;
+    this.line = '';
+    job.interfaces.add(this);
+    this.on('newListener', () => process.nextTick(pump));
+  }
+
+  wantsLine() {
+    return !this.closed && !this.paused &&
+      (this.questions.length > 0 || this.waiters.length > 0 || this.listenerCount('line') > 0);
+  }
+
+  take(line) {
+    if (this.questions.length) this.questions.shift()(line);
+    else if (this.waiters.length) this.waiters.shift()({ value: line, done: false });
+    else this.emit('line', line);
+  }
+
+  question(query, options, callback) {
+    callback = typeof options === 'function' ? options : callback;
+    if (this.promises) {
+      return new Promise((resolve, reject) => {
+        if (this.closed) reject(new Error('readline was closed'));
+        else this.ask(query, resolve);
+      });
+    }
+    if (!this.closed) this.ask(query, callback || (() => {}));
+  }
+
+  ask(query, callback) {
+    this.job.prompt(query);
+    this.questions.push(callback);
+    process.nextTick(pump);
+  }
+
+  setPrompt(text) { this.promptText = String(text); }
+  getPrompt() { return this.promptText; }
+  prompt() {
+    this.resume();
+    this.job.prompt(this.promptText);
+  }
+  write(data) { if (data) this.job.write(1, data); }
+  pause() { this.paused = true; this.emit('pause'); return this; }
+  resume() {
+    this.paused = false;
+    this.emit('resume');
+    process.nextTick(pump);
+    return this;
+  }
+
+  close() {
+    if (this.closed) return;
+    this.closed = true;
+    this.job.interfaces.delete(this);
+    for (const resolve of this.waiters.splice(0)) resolve({ value: undefined, done: true });
+    this.emit('close');
+  }
+
+  [Symbol.asyncIterator]() {
+    return {
+      next: () => new Promise((resolve) => {
+        if (this.closed) resolve({ value: undefined, done: true });
+        else {
+          this.waiters.push(resolve);
+          process.nextTick(pump);
+        }
+      }),
+      return: () => {
+        this.close();
+        return Promise.resolve({ value: undefined, done: true });
+      },
+      [Symbol.asyncIterator]() { return this; },
+    };
+  }
+}
+
+function makeReadline(job, promises) {
+  return {
+    createInterface: (input, output) => new Interface(job, input && input.input ? input : {}, promises),
+    Interface,
+    clearLine: () => true,
+    cursorTo: () => true,
+    moveCursor: () => true,
+    emitKeypressEvents: () => {},
+  };
+}
+
+//--------------------------------------------------------------------------
+// The job's view of Node: process, require and timers
+//--------------------------------------------------------------------------
+class ExitRequest {
+  constructor(code) { this.code = code; }
+}
+
+function makeProcess(job) {
+  const proc = new EventEmitter();
+  const env = { ...process.env };
+  for (const name of Object.keys(env)) {
+    if (name.startsWith('CODY_')) delete env[name];
+  }
+  Object.assign(proc, {
+    argv: [process.argv[0], job.source],
+    argv0: process.argv0,
+    execPath: process.execPath,
+    env,
+    pid: process.pid,
+    platform: process.platform,
+    arch: process.arch,
+    version: process.version,
+    versions: process.versions,
+    release: process.release,
+    stdout: job.stream(1),
+    stderr: job.stream(2),
+    stdin: job.stdin,
+    cwd: () => process.cwd(),
+    chdir: (dir) => process.chdir(dir),
+    hrtime: process.hrtime,
+    uptime: process.uptime,
+    memoryUsage: process.memoryUsage,
+    cpuUsage: process.cpuUsage,
+    nextTick: process.nextTick,
+    emitWarning: (warning) => job.write(2, `Warning: ${warning}\n`),
+    exit: (code) => {
+      if (code !== undefined) job.exitCode = Number(code) || 0;
+      job.exiting = true;
+      throw new ExitRequest(job.exitCode);
+    },
+  });
+  Object.defineProperty(proc, 'exitCode', {
+    get: () => job.exitCode,
+    set: (code) => { job.exitCode = Number(code) || 0; },
+  });
+  return proc;
+}
+
+function trackTimer(job, set) {
+  return (callback, ...args) => {
+    const handle = set((...values) => {
+      job.timers.delete(handle);
+      callback(...values);
+    }, ...args);
+    job.timers.add(handle);
+    return handle;
+  };
+}
+
+// Node's Console is slow to call from a vm context (~20us a line), so
+// the everyday methods format and write directly; the rest (table, dir,
+// time, count, ...) are Console's own.
+function makeConsole(job) {
+  const console = new Console({ stdout: job.process.stdout, stderr: job.process.stderr });
+  let indent = '';
+  const print = (fd) => (...args) => {
+    let text = util.format(...args);
+    if (indent) text = indent + text.replace(/\n/g, '\n' + indent);
+    job.write(fd, text + '\n');
+  };
+  const group = (...label) => {
+    if (label.length) print(1)(...label);
+    indent += '  ';
+  };
+  return Object.assign(console, {
+    log: print(1),
+    info: print(1),
+    debug: print(1),
+    error: print(2),
+    warn: print(2),
+    group,
+    groupCollapsed: group,
+    groupEnd: () => { indent = indent.slice(2); },
+  });
+}
+
+function makeGlobals(job) {
+  return {
+    console: makeConsole(job),
+    process: job.process,
+    Buffer, URL, URLSearchParams, TextEncoder, TextDecoder,
+    AbortController, AbortSignal, EventTarget, Event,
+    atob, btoa, structuredClone, queueMicrotask, performance,
+    setTimeout: trackTimer(job, setTimeout),
+    setImmediate: trackTimer(job, setImmediate),
+    setInterval: (callback, ...args) => {
+      const handle = setInterval(callback, ...args);
+      job.timers.add(handle);
+      return handle;
+    },
+    clearTimeout: (handle) => { job.timers.delete(handle); clearTimeout(handle); },
+    clearInterval: (handle) => { job.timers.delete(handle); clearInterval(handle); },
+    clearImmediate: (handle) => { job.timers.delete(handle); clearImmediate(handle); },
+  };
+}
+
+const WRAPPER_PARAMS = ['exports', 'require', 'module', '__filename', '__dirname'];
+
+// Reading a global inside a vm context goes through the context's property
+// interceptor, which makes e.g. Math.sqrt() in a loop some 30x slower than
+// in plain Node. Module wrappers therefore take every global as a parameter
+// so that lookups stay local.
+function bindGlobals(context) {
+  const names = vm.runInContext('Object.getOwnPropertyNames(globalThis)', context)
+    .filter((name) => /^[A-Za-z_$][\w$]*$/.test(name) && name !== 'eval' && name !== 'arguments' &&
+      !WRAPPER_PARAMS.includes(name));
+  return { names, values: vm.runInContext(`[${names.join(', ')}]`, context) };
+}
+
+// A source that declares one of the globals with let, const or class
+// cannot take it as a parameter; such names are left unbound.
+function withBindings(compile, names) {
+  for (;;) {
+    try {
+      return compile(names);
+    } catch (error) {
+      const match = error && error.name === 'SyntaxError' &&
+        /Identifier '([\w$]+)' has already been declared/.exec(error.message);
+      if (!match || !names.includes(match[1])) throw error;
+      names = names.filter((name) => name !== match[1]);
+    }
+  }
+}
+
+// Files the job requires by path are loaded into its own context, so every
+// run sees the current workspace files and nothing survives between runs.
+function makeRequire(job, context, parentPath) {
+  const nodeRequire = createRequire(parentPath);
+  const jobRequire = (id) => {
+    const name = id.startsWith('node:') ? id.slice(5) : id;
+    if (name === 'readline') return makeReadline(job, false);
+    if (name === 'readline/promises') return makeReadline(job, true);
+    if (!/^\.{0,2}\//.test(id)) return nodeRequire(id);
+    const filename = nodeRequire.resolve(id);
+    if (path.extname(filename) === '.json') return JSON.parse(fs.readFileSync(filename, 'utf8'));
+    return loadModule(job, context, filename);
+  };
+  jobRequire.resolve = nodeRequire.resolve;
+  return jobRequire;
+}
+
+function loadModule(job, context, filename) {
+  if (job.modules.has(filename)) return job.modules.get(filename).exports;
+  const module = { exports: {}, filename, id: filename, loaded: false };
+  job.modules.set(filename, module);
+  const source = fs.readFileSync(filename, 'utf8').replace(/^#!.*/, '');
+  const { names, values } = job.globals;
+  let bound = names;
+  const run = withBindings((params) => {
+    bound = params;
+    return vm.compileFunction(source, WRAPPER_PARAMS.concat(params), { filename, parsingContext: context });
+  }, names);
+  run.call(module.exports, module.exports, makeRequire(job, context, filename), module,
+    filename, path.dirname(filename), ...values.slice(0, bound.length));
+  module.loaded = true;
+  return module.exports;
+}
+
+//--------------------------------------------------------------------------
+// Jobs
+//--------------------------------------------------------------------------
+function runJob(spec) {
+  process.chdir(spec.cwd);
+  const job = new Job(spec);
+  current = job;
+  const context = vm.createContext(makeGlobals(job));
+  context.global = vm.runInContext('globalThis', context);
+  // Relative requires resolve against the workspace, as if main.js lived there.
+  const main = path.join(job.cwd, 'main.js');
+  const module = { exports: {}, filename: main, id: '.', loaded: false };
+  Object.assign(context, {
+    module,
+    exports: module.exports,
+    require: makeRequire(job, context, main),
+    __filename: job.source,
+    __dirname: job.cwd,
+  });
+  job.globals = bindGlobals(context);
+  try {
+    const source = fs.readFileSync(job.source, 'utf8').replace(/^#!.*/, '');
+    job.wrapperFrame = `${job.source}:${source.split('\n').length + 1}:`;
+    // The wrapper gets a line of its own, numbered 0, so lines match the source.
+    const script = withBindings((params) => {
+      const args = WRAPPER_PARAMS.concat(params).join(', ');
+      return new vm.Script(
+        `(function (${args}) {\n${source}\n}).call(module.exports, ${args});`,
+        { filename: job.source, lineOffset: -1 }
+      );
+    }, job.globals.names);
+    // Lets SIGINT break out of a busy loop in the top-level code.
+    script.runInContext(context, { breakOnSigint: true });
+  } catch (error) {
+    jobFailed(job, error);
+    return;
+  }
+  job.firstCheck = setImmediate(() => checkDone(job));
+}
+
+function jobFailed(job, error) {
+  if (job.done) return;
+  if (error instanceof ExitRequest) {
+    finish(job, error.code);
+    return;
+  }
+  if (error && /Script execution was interrupted by `SIGINT`/.test(error.message)) {
+    finish(job, 130);
+    return;
+  }
+  let text = error && error.stack ? error.stack : 'Uncaught ' + util.inspect(error);
+  // Frames of Node internals and of the worker itself mean nothing to the user.
+  text = text.split('\n')
+    .filter((line) => !/^\s+at /.test(line) ||
+      !(/\(?node:|node_worker\.js/.test(line) || (job.wrapperFrame && line.includes(job.wrapperFrame))))
+    .join('\n');
+  job.flush();
+  job.write(2, text + '\n');
+  finish(job, 1);
+}
+
+function checkDone(job) {
+  if (job.done) return;
+  if (job.exiting) {
+    finish(job, job.exitCode);
+  } else if (process.getActiveResourcesInfo().length <= job.baseline && !job.readingInput()) {
+    finish(job, job.exitCode);
+  }
+}
+
+function finish(job, code) {
+  if (job.done) return;
+  try {
+    job.process.emit('exit', code);
+  } catch (error) {
+    // An exit handler that throws or exits again changes nothing.
+  }
+  job.done = true;
+  current = null;
+  clearInterval(job.pollTimer);
+  clearImmediate(job.firstCheck);
+  if (job.flushTimer) clearInterval(job.flushTimer);
+  for (const handle of job.timers) {
+    clearTimeout(handle);
+    clearInterval(handle);
+    clearImmediate(handle);
+  }
+  job.flush();
+  runs += 1;
+  // I/O still pending would call back into a job that has finished.
+  const clean = process.getActiveResourcesInfo().length <= job.baseline;
+  const reusable = clean && !inputEnded && runs < MAX_RUNS && process.memoryUsage().rss < MAX_RSS;
+  inputLines.length = 0;
+  partialLine = '';
+  writeAll(STATUS_FD, `EXIT:${job.id}:${code | 0}:${reusable ? 1 : 0}:${job.written[1]}:${job.written[2]}\n`);
+}
+
+//--------------------------------------------------------------------------
+// Main
+//--------------------------------------------------------------------------
+function main() {
+  // Console internals open these lazily; opening them up front keeps them
+  // out of the resources a job is judged by.
+  void process.stdout;
+  void process.stderr;
+  process.on('uncaughtException', (error) => {
+    if (current) jobFailed(current, error);
+    else writeAll(2, String(error && error.stack || error) + '\n');
+  });
+  process.on('unhandledRejection', (reason) => {
+    if (current) jobFailed(current, reason);
+  });
+  process.on('SIGINT', () => {
+    if (current) finish(current, 130);
+  });
+
+  const stdin = new net.Socket({ fd: 0, readable: true, writable: false });
+  stdin.setEncoding('utf8');
+  stdin.on('data', readInput);
+  stdin.on('end', endInput);
+  stdin.on('error', endInput);
+
+  const control = new net.Socket({ fd: CONTROL_FD, readable: true, writable: false });
+  control.setEncoding('utf8');
+  let pending = '';
+  control.on('data', (chunk) => {
+    const lines = (pending + chunk).split('\n');
+    pending = lines.pop();
+    for (const line of lines) {
+      if (line.trim()) runJob(JSON.parse(line));
+    }
+  });
+  // The server closed the pool: nothing more to run.
+  control.on('end', () => process.exit(0));
+}
+
+main();
@@ -0,0 +1,103 @@
+import os
+import re
+import json
+import uuid
+import asyncio
+from . import interactive_executor
+from . import janitor
+
+#--------------------------------------------------------------------------
+# Configuration: Node.js workers started ahead of time, so a JavaScript run
+# does not pay for Node's startup. Each run gets a fresh vm context in a
+# worker (see node_worker.js); a worker serves many runs until it reports
+# itself worn out (NODE_MAX_RUNS, NODE_MAX_RSS_MB in interactive_executor).
+#--------------------------------------------------------------------------
+# Idle workers that have never run anything, ready for any session.
+NODE_POOL_SIZE = int(os.environ.get("CODE_NODE_POOL_SIZE", "2"))
+
+# Reading all of stdin synchronously needs a real fd 0; such programs get a
+# Node process of their own.
+SYNC_STDIN_RE = re.compile(r"readFileSync\s*\(\s*(?:0\s*[,)]|['\"]/dev/stdin['\"]|process\.stdin\.fd)")
+
+# Fresh workers, workers that already ran code (kept for the session that
+# ran it, by owner), and the tasks starting new ones.
+_idle = []
+_used = {}
+_filling = set()
+
+
+def wants_pool(code):
+    """True unless the code reads stdin in a way only a plain Node can."""
+    return not SYNC_STDIN_RE.search(code)
+
+#--------------------------------------------------------------------------
+# Pool
+#--------------------------------------------------------------------------
+async def _fill():
+    process = await interactive_executor.start_node_worker(interactive_executor.CODE_EXEC_DIR)
+    _idle.append(process)
+
+
+def replenish():
+    """Starts fresh workers in the background until the pool is full."""
+    while len(_idle) + len(_filling) < NODE_POOL_SIZE:
+        task = asyncio.get_running_loop().create_task(_fill())
+        _filling.add(task)
+        task.add_done_callback(_filling.discard)
+
+
+async def _take(workers):
+    while workers:
+        candidate = workers.pop()
+        if candidate.returncode is None:
+            return candidate
+        await interactive_executor.stop_process_group(candidate)
+    return None
+
+
+async def acquire(owner=None):
+    """
+    Takes a worker for a run of owner's: one that already ran owner's code,
+    else a fresh one, else a new one started right away.
+    """
+    process = await _take(_used.get(owner, []))
+    if process is None:
+        process = await _take(_idle)
+    if process is None:
+        process = await interactive_executor.start_node_worker(interactive_executor.CODE_EXEC_DIR)
+    janitor.track(process, owner)
+    replenish()
+    return process
+
+
+async def assign(process, source_filepath, cwd):
+    """
+    Starts the program on the worker, with cwd as working directory.
+    Returns the job id the worker's exit report will carry.
+    """
+    job_id = uuid.uuid4().hex
+    job = json.dumps({
+        "job": job_id,
+        "source": source_filepath,
+        "cwd": cwd,
+        "flush_ms": interactive_executor.FLUSH_INTERVAL_MS,
+    })
+    process.control_transport.write(job.encode("utf-8") + b"\n")
+    return job_id
+
+
+async def release(process, owner, reusable):
+    """
+    Takes a worker back after its run has ended. It only ever serves the
+    same owner again, so no session's code shares a process with another's.
+    """
+    if reusable and process.returncode is None:
+        _used.setdefault(owner, []).append(process)
+    else:
+        await interactive_executor.stop_process_group(process)
+
+
+async def discard(owner):
+    """Stops the workers kept for owner (called when its session closes)."""
+    for process in _used.pop(owner, []):
+        await interactive_executor.stop_process_group(process)
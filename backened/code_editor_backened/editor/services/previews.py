@@ -0,0 +1,306 @@
+import os
+import json
+import time
+import hashlib
+import mimetypes
+import posixpath
+import tempfile
+import threading
+from collections import OrderedDict
+from .interactive_executor import CODE_EXEC_DIR
+
+#--------------------------------------------------------------------------
+# Configuration: HTML previews. A bundle (index.html plus its CSS, JS and
+# other files) is stored content-addressed: every file under the SHA-256
+# of its bytes and the bundle under the SHA-256 of its manifest. The same
+# bundle therefore always gets the same preview id, is written to disk
+# once, and its files never change, so they can be cached forever.
+# Bundles unused for PREVIEW_TTL_SECONDS are deleted, and the oldest ones
+# go first when the directory outgrows PREVIEW_DIR_MAX_BYTES.
+#--------------------------------------------------------------------------
+PREVIEW_DIR = os.environ.get("CODE_PREVIEW_DIR", os.path.join(CODE_EXEC_DIR, "previews"))
+PREVIEW_MAX_BYTES = int(os.environ.get("CODE_PREVIEW_MAX_BYTES", str(2 * 1024 * 1024)))
+PREVIEW_MAX_FILES = int(os.environ.get("CODE_PREVIEW_MAX_FILES", "50"))
+# Bytes of preview files kept in memory, most recently served first.
+PREVIEW_CACHE_BYTES = int(os.environ.get("CODE_PREVIEW_CACHE_BYTES", str(32 * 1024 * 1024)))
+PREVIEW_TTL_SECONDS = float(os.environ.get("CODE_PREVIEW_TTL_SECONDS", str(7 * 24 * 3600)))
+PREVIEW_DIR_MAX_BYTES = int(os.environ.get("CODE_PREVIEW_DIR_MAX_BYTES", str(512 * 1024 * 1024)))
+# Cleanup runs from store(), at most this often.
+PREVIEW_CLEANUP_SECONDS = float(os.environ.get("CODE_PREVIEW_CLEANUP_SECONDS", "600"))
+# Manifests of existing bundles kept in memory.
+PREVIEW_MANIFEST_CACHE = 1024
+# A blob younger than this may belong to a bundle still being stored.
+_BLOB_GRACE_SECONDS = 60
+
+PREVIEW_INDEX = "index.html"
+
+_BLOB_DIR = os.path.join(PREVIEW_DIR, "blobs")
+_BUNDLE_DIR = os.path.join(PREVIEW_DIR, "bundles")
+os.makedirs(_BLOB_DIR, exist_ok=True)
+os.makedirs(_BUNDLE_DIR, exist_ok=True)
+
+
+class BlobCache:
+    """
+    In-memory LRU of file contents by hash, bounded by total size. Files
+    larger than a quarter of the budget are not kept.
+    """
+
+    def __init__(self, max_bytes=PREVIEW_CACHE_BYTES):
+        self.blobs = OrderedDict()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, digest):
+        with self.lock:
+            data = self.blobs.get(digest)
+            if data is not None:
+                self.blobs.move_to_end(digest)
+            return data
+
+    def put(self, digest, data):
+        if len(data) > self.max_bytes // 4:
+            return
+        with self.lock:
+            if digest in self.blobs:
+                return
+            self.blobs[digest] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                self.size -= len(self.blobs.popitem(last=False)[1])
+
+
+_cache = BlobCache()
+# preview id -> (manifest, when the bundle was last marked as used)
+_manifests = OrderedDict()
+_manifests_lock = threading.Lock()
+_cleanup_lock = threading.Lock()
+_last_cleanup = [0.0]
+
+#--------------------------------------------------------------------------
+# Storing
+#--------------------------------------------------------------------------
+def normalize_path(name):
+    """
+    Returns the bundle-relative path for a file name, or None if it is
+    absolute, climbs out of the bundle or is otherwise unusable.
+    """
+    if not isinstance(name, str) or not name or "\\" in name or "\x00" in name:
+        return None
+    path = posixpath.normpath(name)
+    if path.startswith(("/", "../")) or path in (".", ".."):
+        return None
+    return path
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _write_once(path, data):
+    """Writes a content-addressed file unless it already exists."""
+    if os.path.exists(path):
+        return
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def store(files):
+    """
+    Stores a bundle given as {path: text}; it must contain index.html.
+    Returns the preview id. Storing a bundle that already exists writes
+    nothing. Raises ValueError if the bundle is invalid or too big.
+    """
+    if len(files) > PREVIEW_MAX_FILES:
+        raise ValueError(f"A preview can have at most {PREVIEW_MAX_FILES} files.")
+    manifest = {}
+    blobs = {}
+    total = 0
+    for name, content in files.items():
+        path = normalize_path(name)
+        if path is None:
+            raise ValueError(f"Invalid file name: {name!r}")
+        data = content.encode("utf-8")
+        total += len(data)
+        digest = _digest(data)
+        manifest[path] = digest
+        blobs[digest] = data
+    if PREVIEW_INDEX not in manifest:
+        raise ValueError(f"A preview needs an {PREVIEW_INDEX}.")
+    if total > PREVIEW_MAX_BYTES:
+        raise ValueError(f"A preview can be at most {PREVIEW_MAX_BYTES} bytes.")
+
+    manifest_data = json.dumps(manifest, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    preview_id = _digest(manifest_data)
+    bundle_path = os.path.join(_BUNDLE_DIR, preview_id + ".json")
+    with _cleanup_lock:
+        if os.path.exists(bundle_path):
+            # Storing it again counts as a use.
+            os.utime(bundle_path)
+        else:
+            for digest, data in blobs.items():
+                _write_once(os.path.join(_BLOB_DIR, digest), data)
+            # Written last, so a bundle that exists has all of its files.
+            _write_once(bundle_path, manifest_data)
+    maybe_cleanup()
+    return preview_id
+
+#--------------------------------------------------------------------------
+# Cleanup
+#--------------------------------------------------------------------------
+def _scan(directory):
+    """Returns {name: os.stat_result} of the content-addressed files in directory."""
+    found = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            name = entry.name[:-5] if entry.name.endswith(".json") else entry.name
+            if not is_preview_id(name):
+                continue
+            try:
+                found[name] = entry.stat()
+            except OSError:
+                pass
+    return found
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+        return True
+    except OSError:
+        return False
+
+
+def cleanup(now=None):
+    """
+    Deletes bundles unused for PREVIEW_TTL_SECONDS, then the least recently
+    used ones until the kept bundles fit in PREVIEW_DIR_MAX_BYTES, then
+    every blob no kept bundle refers to. Returns the number of bundles deleted.
+    """
+    now = time.time() if now is None else now
+    with _cleanup_lock:
+        blob_stats = _scan(_BLOB_DIR)
+        referenced = set()
+        size = 0
+        removed = 0
+        bundles = sorted(_scan(_BUNDLE_DIR).items(), key=lambda item: item[1].st_mtime, reverse=True)
+        for preview_id, stat in bundles:
+            bundle_path = os.path.join(_BUNDLE_DIR, preview_id + ".json")
+            manifest = _read_manifest(preview_id) if now - stat.st_mtime <= PREVIEW_TTL_SECONDS else None
+            if manifest is not None:
+                digests = set(manifest.values()) - referenced
+                extra = sum(blob_stats[digest].st_size for digest in digests if digest in blob_stats)
+                if size + extra <= PREVIEW_DIR_MAX_BYTES:
+                    referenced |= digests
+                    size += extra
+                    continue
+            if _remove(bundle_path):
+                removed += 1
+            with _manifests_lock:
+                _manifests.pop(preview_id, None)
+        for digest, stat in blob_stats.items():
+            if digest not in referenced and now - stat.st_mtime > _BLOB_GRACE_SECONDS:
+                _remove(os.path.join(_BLOB_DIR, digest))
+        _last_cleanup[0] = time.monotonic()
+        return removed
+
+
+def maybe_cleanup():
+    """Runs cleanup() if it has not run for PREVIEW_CLEANUP_SECONDS."""
+    if time.monotonic() - _last_cleanup[0] >= PREVIEW_CLEANUP_SECONDS:
+        cleanup()
+
+#--------------------------------------------------------------------------
+# Serving
+#--------------------------------------------------------------------------
+def _read_manifest(preview_id):
+    try:
+        with open(os.path.join(_BUNDLE_DIR, preview_id + ".json"), "rb") as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+def _manifest(preview_id):
+    """
+    Returns the manifest of a bundle, or None if there is none. Only found
+    manifests are cached: a missing bundle may be stored later. A bundle
+    served is marked as used (its mtime) at most once per a tenth of the TTL.
+    """
+    now = time.time()
+    with _manifests_lock:
+        entry = _manifests.get(preview_id)
+        if entry is not None:
+            _manifests.move_to_end(preview_id)
+    if entry is not None and now - entry[1] < PREVIEW_TTL_SECONDS / 10:
+        return entry[0]
+    manifest = entry[0] if entry is not None else _read_manifest(preview_id)
+    if manifest is None:
+        return None
+    try:
+        os.utime(os.path.join(_BUNDLE_DIR, preview_id + ".json"))
+    except OSError:
+        # Deleted by cleanup in the meantime.
+        with _manifests_lock:
+            _manifests.pop(preview_id, None)
+        return None
+    with _manifests_lock:
+        _manifests[preview_id] = (manifest, now)
+        _manifests.move_to_end(preview_id)
+        while len(_manifests) > PREVIEW_MANIFEST_CACHE:
+            _manifests.popitem(last=False)
+    return manifest
+
+
+def is_preview_id(value):
+    return len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+
+def etag_for(digest):
+    """Strong ETag of a file: its content hash."""
+    return f'"{digest}"'
+
+
+def lookup(preview_id, path=PREVIEW_INDEX):
+    """
+    Finds a file of a preview without reading it. Returns (digest,
+    content_type), or None if the preview or the file does not exist.
+    """
+    if not is_preview_id(preview_id):
+        return None
+    manifest = _manifest(preview_id)
+    path = normalize_path(path or PREVIEW_INDEX)
+    if manifest is None or path is None:
+        return None
+    if path not in manifest and PREVIEW_INDEX in manifest and posixpath.join(path, PREVIEW_INDEX) in manifest:
+        path = posixpath.join(path, PREVIEW_INDEX)
+    digest = manifest.get(path)
+    if digest is None:
+        return None
+    content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    if content_type.startswith("text/") or content_type in ("application/javascript", "application/json"):
+        content_type += "; charset=utf-8"
+    return digest, content_type
+
+
+def read(digest):
+    """
+    Returns a stored file's bytes, from memory when recently served, or
+    None if cleanup deleted the file since it was looked up.
+    """
+    data = _cache.get(digest)
+    if data is None:
+        try:
+            with open(os.path.join(_BLOB_DIR, digest), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        _cache.put(digest, data)
+    return data
@@ -0,0 +1,84 @@
+import os
+import json
+import asyncio
+from . import analysis
+from . import interactive_executor
+from . import janitor
+
+#--------------------------------------------------------------------------
+# Configuration: interpreters that have already imported the heavy modules
+# submissions commonly use. Code that imports none of them is started the
+# usual (light) way.
+#--------------------------------------------------------------------------
+PREWARM_MODULES = tuple(
+    name.strip() for name in
+    os.environ.get("CODE_PREWARM_MODULES", "numpy,matplotlib.pyplot").split(",")
+    if name.strip()
+)
+# Idle warm interpreters kept ready; 0 still prewarms, but only on demand.
+PREWARM_POOL_SIZE = int(os.environ.get("CODE_PREWARM_POOL_SIZE", "1"))
+
+HEAVY_PACKAGES = {name.split(".")[0] for name in PREWARM_MODULES}
+
+# Warm interpreters waiting for a job, and the tasks starting new ones.
+_idle = []
+_filling = set()
+
+
+def wants_warm(code):
+    """True if the code imports any of the prewarmed modules."""
+    return bool(HEAVY_PACKAGES and analysis.find_imports(code) & HEAVY_PACKAGES)
+
+#--------------------------------------------------------------------------
+# Pool
+#--------------------------------------------------------------------------
+async def _spawn():
+    return await interactive_executor.start_interactive_python(
+        None, cwd=interactive_executor.CODE_EXEC_DIR, warm_modules=PREWARM_MODULES
+    )
+
+
+async def _fill():
+    process = await _spawn()
+    _idle.append(process)
+
+
+def replenish():
+    """Starts warm interpreters in the background until the pool is full."""
+    while len(_idle) + len(_filling) < PREWARM_POOL_SIZE:
+        task = asyncio.get_running_loop().create_task(_fill())
+        _filling.add(task)
+        task.add_done_callback(_filling.discard)
+
+
+async def acquire(owner=None):
+    """
+    Takes a warm interpreter from the pool, or starts one right away when
+    the pool is empty so that its imports overlap with writing the source.
+    """
+    process = None
+    while _idle:
+        candidate = _idle.pop()
+        if candidate.returncode is None:
+            process = candidate
+            break
+        await interactive_executor.stop_process_group(candidate)
+    if process is None:
+        process = await _spawn()
+    janitor.track(process, owner)
+    replenish()
+    return process
+
+
+async def assign(process, source_filepath, cwd, interactive=True):
+    """
+    Hands the program to a warm interpreter; it runs with cwd as working
+    directory and the periodic stdout flush. A non-interactive program gets
+    end-of-file on stdin, like a cold start.
+    """
+    job = json.dumps({"source": source_filepath, "cwd": cwd, "flush_ms": interactive_executor.FLUSH_INTERVAL_MS})
+    process.stdin.write(job.encode("utf-8") + b"\n")
+    await process.stdin.drain()
+    if not interactive:
+        process.stdin.close()
+    return process
@@ -0,0 +1,119 @@
+import json
+import struct
+
+#--------------------------------------------------------------------------
+# WebSocket framing for InteractiveExecConsumer.
+#
+# Clients that offer the binary subprotocol get frames made of a fixed
+# 8-byte header followed by the raw payload:
+#
+#   type (u8) | stream (u8) | run (u16) | sequence (u32) | payload
+#
+# All integers are big endian. run identifies which of the connection's
+# concurrent runs a frame belongs to (0 for session-level frames).
+#
+# Output payloads are the program's bytes exactly as read from the pipe, so
+# neither side has to JSON-encode or JSON-parse them. Clients that offer
+# nothing (or the JSON subprotocol) keep receiving the original
+# {"output": ...} / {"error": ...} messages.
+#--------------------------------------------------------------------------
+SUBPROTOCOL_BINARY = "codyskool.binary.v2"
+SUBPROTOCOL_JSON = "codyskool.json.v2"
+
+HEADER = struct.Struct("!BBHI")
+MAX_RUN_ID = 0xFFFF
+
+# Stream ids
+STREAM_CONTROL = 0
+STREAM_STDOUT = 1
+STREAM_STDERR = 2
+STREAM_STDIN = 3
+
+# Frame types
+FRAME_OUTPUT = 1      # raw program output
+FRAME_PROMPT = 2      # input() prompt text, marker already stripped
+FRAME_ERROR = 3       # UTF-8 error message
+FRAME_STATS = 4       # JSON object, e.g. exit code and elapsed time
+FRAME_FIGURE_PNG = 5  # PNG image bytes
+FRAME_FIGURE_SVG = 6  # SVG document bytes
+FRAME_CONTROL = 7     # JSON object with session metadata
+FRAME_INPUT = 8       # client -> server: one line for the program's stdin
+
+# Close codes
+CLOSE_RATE_LIMITED = 4429  # too many connections; the reason is the seconds to wait
+CLOSE_SERVER_ERROR = 1011  # the session could not be set up; the reason says why
+
+FIGURE_FRAME_TYPES = {
+    "png": FRAME_FIGURE_PNG,
+    "svg": FRAME_FIGURE_SVG,
+}
+FIGURE_FORMATS = {frame_type: fmt for fmt, frame_type in FIGURE_FRAME_TYPES.items()}
+
+SEQUENCE_MASK = 0xFFFFFFFF
+
+
+def is_run_id(value):
+    """True for a run id a client may name: an int from 1 to MAX_RUN_ID."""
+    return isinstance(value, int) and not isinstance(value, bool) and 0 < value <= MAX_RUN_ID
+
+
+def choose_subprotocol(offered):
+    """
+    Picks the subprotocol to accept from the list the client offered.
+    Returns None when the client offered neither, which means plain JSON.
+    """
+    if SUBPROTOCOL_BINARY in offered:
+        return SUBPROTOCOL_BINARY
+    if SUBPROTOCOL_JSON in offered:
+        return SUBPROTOCOL_JSON
+    return None
+
+#--------------------------------------------------------------------------
+# Binary frames
+#--------------------------------------------------------------------------
+def payload_bytes(payload):
+    """Normalises a frame payload (bytes, str or dict) to bytes."""
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        return bytes(payload)
+    if isinstance(payload, str):
+        return payload.encode("utf-8")
+    return json.dumps(payload).encode("utf-8")
+
+
+def encode_frame(frame_type, stream, seq, payload, run_id=0):
+    return HEADER.pack(frame_type, stream, run_id, seq & SEQUENCE_MASK) + payload_bytes(payload)
+
+
+def decode_frame(data):
+    """Returns (frame_type, stream, run_id, seq, payload) for a binary frame."""
+    if len(data) < HEADER.size:
+        raise ValueError("Frame shorter than header.")
+    frame_type, stream, run_id, seq = HEADER.unpack_from(data)
+    return frame_type, stream, run_id, seq, bytes(data[HEADER.size:])
+
+#--------------------------------------------------------------------------
+# JSON fallback
+#--------------------------------------------------------------------------
+def encode_json(frame_type, payload, seq=None, run_id=0):
+    """
+    Builds the JSON message for a frame, matching the messages the consumer
+    has always sent plus the frame's sequence number and run id. Figures are
+    announced here and their bytes follow in a separate binary message.
+    """
+    if frame_type == FRAME_OUTPUT:
+        message = {"output": payload.decode("utf-8", errors="replace")}
+    elif frame_type == FRAME_PROMPT:
+        message = {"output": payload.decode("utf-8", errors="replace"), "prompt": "true"}
+    elif frame_type == FRAME_ERROR:
+        message = {"error": payload}
+    elif frame_type == FRAME_STATS:
+        message = {"stats": payload}
+    elif frame_type in FIGURE_FORMATS:
+        message = {"figure": FIGURE_FORMATS[frame_type], "bytes": len(payload)}
+    else:
+        message = dict(payload)
+    if seq is not None:
+        message["seq"] = seq
+    if run_id:
+        message["run"] = run_id
+    return json.dumps(message)
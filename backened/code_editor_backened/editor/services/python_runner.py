@@ -0,0 +1,367 @@
+"""
+Runner for interactive Python sessions.
+
+Usage: python python_runner.py <source_file>
+       python python_runner.py --kernel
+       python python_runner.py --warm <module,module,...>
+
+Executes the submitted source in a fresh __main__ namespace with input()
+overridden so that prompts are flushed with an explicit PROMPT: marker.
+This file runs inside the child process, so it must not import Django or
+anything else from the editor package.
+
+stdout is block-buffered. If CODY_FLUSH_MS is set, a background thread
+flushes it that often, and input() flushes it before every prompt, so
+prompts appear at once while bulk output travels in large writes.
+
+With --kernel the runner stays alive and executes cells, read from
+CODY_CONTROL_FD as "<cell id> <size>\\n" followed by the source, one after
+another in the same namespace. The end of each cell is marked on stdout by
+"\\x1eCELL:<cell id>:<ok|error|interrupted>\\n". SIGINT interrupts the
+running cell; it is ignored while the kernel is idle.
+
+With --warm the runner imports the listed modules first and then waits for
+its job, a JSON line {"source": <file>, "cwd": <dir>, "flush_ms": <ms>}
+on stdin, so heavy imports are paid before the program is even submitted.
+
+If CODY_FIGURE_FD is set, matplotlib is forced onto the Agg backend and
+plt.show()/savefig() stream the rendered figures to that file descriptor as
+"<format> <size>\\n" followed by the raw image bytes.
+
+If CODY_CHECKPOINT_DIR is set, every input() call (up to
+CODY_MAX_CHECKPOINTS of them) first forks. The parent stays frozen as a
+checkpoint waiting on the FIFO <dir>/checkpoint_<n>, and the child carries on
+and reports "CHECKPOINT:<n>:<holder pid>:<child pid>\\n" on CODY_STATUS_FD.
+Writing to the FIFO rewinds: the frozen copy forks again and the new child
+asks prompt n afresh, without repeating the work done before it. Since the
+program may end in a grandchild, its exit is reported as "EXIT:<code>\\n".
+Reports go to their own pipe, after stdout has been flushed, so nothing the
+program prints can pass for one.
+"""
+import io
+import os
+import sys
+import ast
+import json
+import time
+import signal
+import threading
+import contextlib
+import importlib
+import importlib.abc
+import importlib.util
+
+FIGURE_FD = int(os.environ.get("CODY_FIGURE_FD", "-1"))
+FIGURE_FORMAT = os.environ.get("CODY_FIGURE_FORMAT", "png")
+FIGURE_MAX_PX = int(os.environ.get("CODY_FIGURE_MAX_PX", "1200"))
+FIGURE_MAX_BYTES = int(os.environ.get("CODY_FIGURE_MAX_BYTES", str(2 * 1024 * 1024)))
+FIGURE_MAX_COUNT = int(os.environ.get("CODY_FIGURE_MAX_COUNT", "20"))
+FLUSH_MS = int(os.environ.get("CODY_FLUSH_MS", "0"))
+CONTROL_FD = int(os.environ.get("CODY_CONTROL_FD", "-1"))
+STATUS_FD = int(os.environ.get("CODY_STATUS_FD", "-1"))
+CELL_MARKER = "\x1eCELL:"
+CHECKPOINT_DIR = os.environ.get("CODY_CHECKPOINT_DIR")
+MAX_CHECKPOINTS = int(os.environ.get("CODY_MAX_CHECKPOINTS", "8"))
+
+
+def custom_input(prompt=''):
+    if CHECKPOINT_DIR and _prompts_seen < MAX_CHECKPOINTS:
+        checkpoint()
+    sys.stdout.write("PROMPT:" + str(prompt) + "\n")
+    sys.stdout.flush()
+    return sys.stdin.readline().rstrip("\n")
+
+#--------------------------------------------------------------------------
+# Periodic stdout flush
+#--------------------------------------------------------------------------
+_flush_interval = None
+
+
+def _flush_loop():
+    while True:
+        time.sleep(_flush_interval)
+        try:
+            sys.stdout.flush()
+        except Exception:
+            # stdout closed or replaced by the program; try again next tick.
+            pass
+
+
+def _start_flush_thread():
+    threading.Thread(target=_flush_loop, name="cody-flush", daemon=True).start()
+
+
+def start_flush_timer(interval_ms):
+    """Flushes stdout every interval_ms, also in processes forked later."""
+    global _flush_interval
+    if _flush_interval is not None or interval_ms <= 0:
+        return
+    _flush_interval = interval_ms / 1000
+    _start_flush_thread()
+    # Threads do not survive fork(); checkpoint branches need their own.
+    os.register_at_fork(after_in_child=_start_flush_thread)
+
+#--------------------------------------------------------------------------
+# Fork-at-prompt checkpoints
+#--------------------------------------------------------------------------
+_prompts_seen = 0
+
+
+def _report(text):
+    """Writes a report on the status pipe, after the output that precedes it."""
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.write(STATUS_FD, f"{text}\n".encode("ascii"))
+
+
+def _reap_children():
+    """Collects branches killed by a rewind (we are their (sub)reaper)."""
+    while True:
+        try:
+            pid, _status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+
+
+def _wait_for_rewind(fifo):
+    while True:
+        # Opening blocks until the server opens the FIFO to rewind.
+        with open(fifo, "rb") as f:
+            if f.read():
+                return
+
+
+def checkpoint():
+    """
+    Forks before prompt n. Returns in the child, which runs on; the parent
+    never returns and instead spawns a fresh child for every rewind.
+    """
+    global _prompts_seen
+    _prompts_seen += 1
+    n = _prompts_seen
+    fifo = os.path.join(CHECKPOINT_DIR, f"checkpoint_{n}")
+    if not os.path.exists(fifo):
+        os.mkfifo(fifo, 0o600)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    resumed = False
+    while True:
+        pid = os.fork()
+        if pid == 0:
+            if resumed:
+                # Type-ahead buffered before the fork belongs to the old branch.
+                sys.stdin = open(0, "r", closefd=False)
+            _report(f"CHECKPOINT:{n}:{os.getppid()}:{os.getpid()}")
+            return
+        _wait_for_rewind(fifo)
+        _reap_children()
+        resumed = True
+
+
+def _become_subreaper():
+    """Orphans of killed branches are reparented to us so we can reap them."""
+    try:
+        import ctypes
+        PR_SET_CHILD_SUBREAPER = 36
+        ctypes.CDLL(None, use_errno=True).prctl(PR_SET_CHILD_SUBREAPER, 1, 0, 0, 0)
+    except Exception:
+        pass
+
+#--------------------------------------------------------------------------
+# Inline matplotlib figures
+#--------------------------------------------------------------------------
+_figures_sent = 0
+
+
+def _render_figure(fig, savefig):
+    """Renders fig with its long side capped at FIGURE_MAX_PX pixels."""
+    width, height = fig.get_size_inches()
+    dpi = min(fig.dpi, FIGURE_MAX_PX / max(width, height, 0.01))
+    for _attempt in range(3):
+        buffer = io.BytesIO()
+        savefig(fig, buffer, format=FIGURE_FORMAT, dpi=dpi)
+        data = buffer.getvalue()
+        if len(data) <= FIGURE_MAX_BYTES or FIGURE_FORMAT == "svg":
+            return data
+        dpi /= 2
+    return data
+
+
+def _send_figure(fig, savefig):
+    global _figures_sent
+    if _figures_sent >= FIGURE_MAX_COUNT:
+        return
+    sys.stdout.flush()
+    data = _render_figure(fig, savefig)
+    if len(data) > FIGURE_MAX_BYTES:
+        print(f"[figure skipped: larger than {FIGURE_MAX_BYTES} bytes]", file=sys.stderr)
+        return
+    _figures_sent += 1
+    payload = f"{FIGURE_FORMAT} {len(data)}\n".encode("ascii") + data
+    view = memoryview(payload)
+    while view:
+        written = os.write(FIGURE_FD, view)
+        view = view[written:]
+    fig._cody_sent = True
+
+
+def _patch_pyplot(plt):
+    from matplotlib.figure import Figure
+    original_savefig = Figure.savefig
+
+    def savefig(self, fname, *args, **kwargs):
+        result = original_savefig(self, fname, *args, **kwargs)
+        _send_figure(self, original_savefig)
+        return result
+
+    def show(*args, **kwargs):
+        for num in plt.get_fignums():
+            fig = plt.figure(num)
+            # Skip figures already streamed by savefig and not changed since.
+            if getattr(fig, "_cody_sent", False) and not fig.stale:
+                continue
+            _send_figure(fig, original_savefig)
+        plt.close("all")
+
+    Figure.savefig = savefig
+    plt.show = show
+
+
+class _PyplotImportHook(importlib.abc.MetaPathFinder):
+    """Patches matplotlib.pyplot right after the user's code imports it."""
+
+    def find_spec(self, name, path, target=None):
+        if name != "matplotlib.pyplot":
+            return None
+        sys.meta_path.remove(self)
+        spec = importlib.util.find_spec(name)
+        if spec is None or spec.loader is None:
+            return spec
+        original_exec_module = spec.loader.exec_module
+
+        def exec_module(module):
+            original_exec_module(module)
+            _patch_pyplot(module)
+
+        spec.loader.exec_module = exec_module
+        return spec
+
+
+def install_figure_hook():
+    os.environ["MPLBACKEND"] = "Agg"
+    sys.meta_path.insert(0, _PyplotImportHook())
+
+#--------------------------------------------------------------------------
+# Kernel mode: cells executed one after another in one namespace
+#--------------------------------------------------------------------------
+def run_cell(code, cell_id, namespace):
+    """
+    Executes one cell. Like a notebook, the value of a trailing expression
+    is printed. Returns "ok", "error" or "interrupted".
+    """
+    global _figures_sent
+    _figures_sent = 0
+    filename = f"<cell {cell_id}>"
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    try:
+        tree = ast.parse(code, filename)
+        last = tree.body.pop() if tree.body and isinstance(tree.body[-1], ast.Expr) else None
+        exec(compile(tree, filename, "exec"), namespace)
+        if last is not None:
+            value = eval(compile(ast.Expression(last.value), filename, "eval"), namespace)
+            if value is not None:
+                namespace["_"] = value
+                print(repr(value))
+        # Figures left open at the end of a cell are shown, as in a notebook.
+        plt = sys.modules.get("matplotlib.pyplot")
+        if FIGURE_FD >= 0 and plt is not None and plt.get_fignums():
+            plt.show()
+        return "ok"
+    except KeyboardInterrupt:
+        print("KeyboardInterrupt", file=sys.stderr)
+        return "interrupted"
+    except SystemExit as e:
+        return "ok" if e.code in (None, 0) else "error"
+    except Exception as e:
+        print(f"Error: {type(e).__name__}: {e}", file=sys.stderr)
+        return "error"
+    finally:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def run_kernel():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    namespace = {"__name__": "__main__", "input": custom_input}
+    with os.fdopen(CONTROL_FD, "rb") as control:
+        while True:
+            header = control.readline()
+            if not header:
+                break
+            cell_id, size = header.decode("ascii").split()
+            code = control.read(int(size)).decode("utf-8")
+            status = run_cell(code, cell_id, namespace)
+            sys.stderr.flush()
+            sys.stdout.write(f"{CELL_MARKER}{cell_id}:{status}\n")
+            sys.stdout.flush()
+
+#--------------------------------------------------------------------------
+# Warm mode: imports done ahead of the job
+#--------------------------------------------------------------------------
+def wait_for_job(modules):
+    """Imports modules, then returns the source file of the job (None at EOF)."""
+    # Import-time chatter (e.g. font cache notices) must not reach the program's output.
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        for name in modules.split(","):
+            try:
+                importlib.import_module(name)
+            except Exception:
+                pass
+    line = sys.stdin.readline()
+    if not line:
+        return None
+    job = json.loads(line)
+    os.chdir(job["cwd"])
+    start_flush_timer(job.get("flush_ms", 0))
+    return job["source"]
+
+#--------------------------------------------------------------------------
+# Entry point
+#--------------------------------------------------------------------------
+def main(source_filepath):
+    start_flush_timer(FLUSH_MS)
+    if FIGURE_FD >= 0:
+        install_figure_hook()
+    if source_filepath == "--warm":
+        source_filepath = wait_for_job(sys.argv[2])
+        if source_filepath is None:
+            return
+    # Resolve imports from the workspace rather than from this directory.
+    sys.path[0] = os.getcwd()
+    if source_filepath == "--kernel":
+        run_kernel()
+        return
+    with open(source_filepath, 'r', encoding='utf-8') as f:
+        code = f.read()
+    exec_globals = {"__name__": "__main__"}
+    exec_globals['input'] = custom_input
+    if CHECKPOINT_DIR:
+        _become_subreaper()
+    exit_code = 0
+    try:
+        exec(code, exec_globals)
+    except SystemExit as e:
+        if not CHECKPOINT_DIR:
+            raise
+        exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except Exception as e:
+        print(f"Error: {type(e).__name__}: {e}", file=sys.stderr)
+        exit_code = 1
+    if CHECKPOINT_DIR:
+        _report(f"EXIT:{exit_code}")
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
@@ -0,0 +1,123 @@
+import os
+import math
+import time
+import threading
+
+#--------------------------------------------------------------------------
+# Configuration: request rate limits. Each action has a token bucket per
+# client (see clients.py) and one shared by all clients; a request needs a
+# token from both. A limit is "<requests>/<seconds>": up to that many
+# requests at once, refilled evenly over the period. "0" turns it off.
+# Set with CODE_RATE_<ACTION>_CLIENT and CODE_RATE_<ACTION>_GLOBAL. A
+# request that runs many programs (bulk snippets, batch cases) costs one
+# token per program: it is let in while a token is left and the bucket
+# goes into debt for the rest, so the client waits longer afterwards.
+#--------------------------------------------------------------------------
+ACTION_CONNECT = "connect"   # WebSocket connections
+ACTION_START = "start"       # runs and kernels started or restarted over a WebSocket
+ACTION_EXECUTE = "execute"   # REST runs: execute, stream, bulk, batch, jobs
+ACTION_UPLOAD = "upload"     # file uploads and previews
+
+_DEFAULT_LIMITS = (
+    (ACTION_CONNECT, "30/60", "600/60"),
+    (ACTION_START, "60/60", "1200/60"),
+    (ACTION_EXECUTE, "30/60", "600/60"),
+    (ACTION_UPLOAD, "30/60", "300/60"),
+)
+# Client buckets kept; idle (full) ones are dropped beyond this.
+RATE_MAX_CLIENTS = int(os.environ.get("CODE_RATE_MAX_CLIENTS", "10000"))
+
+
+def parse_limit(value):
+    """Returns (tokens per second, burst) for "<requests>/<seconds>", or None if off."""
+    count, _, seconds = value.partition("/")
+    count = float(count)
+    if count <= 0:
+        return None
+    return count / float(seconds or 1), count
+
+
+RATE_LIMITS = {
+    action: (
+        parse_limit(os.environ.get(f"CODE_RATE_{action.upper()}_CLIENT", client)),
+        parse_limit(os.environ.get(f"CODE_RATE_{action.upper()}_GLOBAL", shared)),
+    )
+    for action, client, shared in _DEFAULT_LIMITS
+}
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self):
+        """Seconds until a token is available (0 if one is)."""
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class Limiter:
+    """
+    The buckets of one action. A refused request takes no token, so a
+    client that keeps retrying gets in as soon as it is allowed to.
+    """
+
+    def __init__(self, client_limit, global_limit):
+        self.client_limit = client_limit
+        self.shared = TokenBucket(*global_limit, time.monotonic()) if global_limit else None
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, client, cost=1):
+        """Takes cost tokens for client. Returns 0.0, or the seconds to wait if refused."""
+        now = time.monotonic()
+        with self.lock:
+            buckets = [self.shared] if self.shared else []
+            if self.client_limit:
+                bucket = self.buckets.get(client)
+                if bucket is None:
+                    if len(self.buckets) >= RATE_MAX_CLIENTS:
+                        self.prune(now)
+                    bucket = self.buckets[client] = TokenBucket(*self.client_limit, now)
+                buckets.append(bucket)
+            wait = 0.0
+            for bucket in buckets:
+                bucket.refill(now)
+                wait = max(wait, bucket.wait())
+            if wait:
+                return wait
+            for bucket in buckets:
+                bucket.tokens -= cost
+            return 0.0
+
+    def prune(self, now):
+        """Drops client buckets that have refilled: they hold no state."""
+        for client, bucket in list(self.buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst:
+                del self.buckets[client]
+
+
+_limiters = {action: Limiter(*limits) for action, limits in RATE_LIMITS.items()}
+
+
+def take(action, client, cost=1):
+    """Takes cost tokens of action for client; returns the seconds to wait, 0.0 if allowed."""
+    return _limiters[action].take(client, max(1, cost))
+
+
+def retry_after(wait):
+    """Value of a Retry-After header: whole seconds, rounded up."""
+    return str(max(1, math.ceil(wait)))
+
+
+def describe(wait):
+    return f"Too many requests; try again in {retry_after(wait)} seconds."
@@ -0,0 +1,328 @@
+import os
+import time
+import asyncio
+import threading
+import itertools
+import contextlib
+import logging
+from collections import deque
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+#--------------------------------------------------------------------------
+# Configuration: fair sharing of the host between clients (see clients.py).
+# REST runs wait for one of SCHED_SLOTS program slots; a freed slot goes to
+# the waiting client with the fewest running programs, then the least CPU
+# used over the last SCHED_WINDOW_SECONDS (both divided by the client's
+# weight), short runs before batch work. The last SCHED_SHORT_SLOTS free
+# slots are kept for short runs, so batch work can never take them all.
+# Interactive runs never wait for a slot. Batch work is handed to its
+# thread pool only once granted a slot (see submit), so the pool's own FIFO
+# queue never decides who runs next. Every tracked program is reniced as
+# its client's CPU use grows.
+#--------------------------------------------------------------------------
+SCHED_SLOTS = int(os.environ.get("CODE_SCHED_SLOTS", str(max(2, 2 * (os.cpu_count() or 1)))))
+SCHED_SHORT_SLOTS = min(
+    SCHED_SLOTS - 1,
+    int(os.environ.get("CODE_SCHED_SHORT_SLOTS", str(max(1, SCHED_SLOTS // 4)))),
+)
+SCHED_WINDOW_SECONDS = float(os.environ.get("CODE_SCHED_WINDOW_SECONDS", "60"))
+SCHED_SAMPLE_SECONDS = float(os.environ.get("CODE_SCHED_SAMPLE_SECONDS", "1"))
+# CPU seconds per window at which a client's programs reach MAX_NICE.
+SCHED_HEAVY_CPU_SECONDS = float(os.environ.get("CODE_SCHED_HEAVY_CPU_SECONDS", "30"))
+MAX_NICE = 19
+# "client=weight,..." e.g. "ip:10.0.0.5=4" for a grader that may use 4x.
+SCHED_WEIGHTS = {
+    key.strip(): float(weight)
+    for key, _, weight in (
+        item.rpartition("=") for item in os.environ.get("CODE_SCHED_WEIGHTS", "").split(",") if "=" in item
+    )
+}
+
+# Waiting requests are served by priority first.
+PRIORITY_SHORT = 0   # /api/execute/ and its streaming variant
+PRIORITY_BATCH = 1   # test-case batches, bulk snippets, background jobs
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+_lock = threading.Lock()
+_wakeup = threading.Condition(_lock)
+# client -> deque of _Waiter, in arrival order.
+_queues = {}
+# client -> programs holding a slot.
+_running = {}
+_free_slots = [SCHED_SLOTS]
+_arrivals = itertools.count()
+# pid -> [client, last cpu seconds, nice]; pid leads the program's group.
+_tracked = {}
+# client -> deque of (time, cpu seconds) samples within the window.
+_usage = {}
+_sampler = {"thread": None}
+
+
+def weight(client):
+    return SCHED_WEIGHTS.get(client, 1.0)
+
+
+def usage(client, now=None):
+    """CPU seconds the client's programs used over the window (_lock held)."""
+    now = time.monotonic() if now is None else now
+    samples = _usage.get(client)
+    if not samples:
+        return 0.0
+    while samples and now - samples[0][0] > SCHED_WINDOW_SECONDS:
+        samples.popleft()
+    return sum(seconds for _at, seconds in samples)
+
+
+def nice_for(client):
+    """Nice value for a client's programs, from its share of the window (_lock held)."""
+    share = usage(client) / weight(client) / SCHED_HEAVY_CPU_SECONDS
+    return min(MAX_NICE, int(share * MAX_NICE))
+
+#--------------------------------------------------------------------------
+# Slots
+#--------------------------------------------------------------------------
+class _Waiter:
+    def __init__(self, client, priority, loop=None, on_grant=None):
+        self.client = client
+        self.priority = priority
+        self.arrival = next(_arrivals)
+        self.loop = loop
+        self.on_grant = on_grant
+        self.event = None if loop or on_grant else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+    def grant(self):
+        if self.on_grant:
+            self.on_grant()
+        elif self.loop:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+        else:
+            self.event.set()
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _rank(waiter, now):
+    client = waiter.client
+    share = weight(client)
+    return (waiter.priority, _running.get(client, 0) / share, usage(client, now) / share, waiter.arrival)
+
+
+def _candidate(queue, short_only):
+    """The waiter of a client's queue that may take the next slot, if any."""
+    if not short_only:
+        return queue[0]
+    return next((waiter for waiter in queue if waiter.priority == PRIORITY_SHORT), None)
+
+
+def _dispatch():
+    """Hands free slots to the best-placed waiters. Call with _lock held."""
+    now = time.monotonic()
+    while _free_slots[0] > 0 and _queues:
+        short_only = _free_slots[0] <= SCHED_SHORT_SLOTS
+        candidates = [_candidate(queue, short_only) for queue in _queues.values()]
+        candidates = [waiter for waiter in candidates if waiter is not None]
+        if not candidates:
+            break
+        waiter = min(candidates, key=lambda candidate: _rank(candidate, now))
+        queue = _queues[waiter.client]
+        queue.remove(waiter)
+        if not queue:
+            del _queues[waiter.client]
+        _free_slots[0] -= 1
+        _running[waiter.client] = _running.get(waiter.client, 0) + 1
+        waiter.grant()
+
+
+def _enqueue(waiter):
+    with _lock:
+        _queues.setdefault(waiter.client, deque()).append(waiter)
+        _dispatch()
+
+
+def _withdraw(waiter):
+    """Removes a waiter that gave up. Returns False if it already has a slot."""
+    with _lock:
+        queue = _queues.get(waiter.client)
+        if queue is None or waiter not in queue:
+            return False
+        queue.remove(waiter)
+        if not queue:
+            del _queues[waiter.client]
+        return True
+
+
+def _release(client):
+    with _lock:
+        _free_slots[0] += 1
+        _running[client] -= 1
+        if not _running[client]:
+            del _running[client]
+        _dispatch()
+
+
+@contextlib.contextmanager
+def slot(client, priority=PRIORITY_SHORT):
+    """Blocks the calling thread until client may run a program."""
+    waiter = _Waiter(client, priority)
+    _enqueue(waiter)
+    waiter.event.wait()
+    try:
+        yield
+    finally:
+        _release(client)
+
+
+@contextlib.asynccontextmanager
+async def async_slot(client, priority=PRIORITY_SHORT):
+    """slot() for coroutines: waits without blocking the event loop."""
+    waiter = _Waiter(client, priority, asyncio.get_running_loop())
+    _enqueue(waiter)
+    try:
+        await waiter.future
+    except asyncio.CancelledError:
+        if not _withdraw(waiter):
+            _release(client)
+        raise
+    try:
+        yield
+    finally:
+        _release(client)
+
+
+def submit(executor, client, priority, fn, *args):
+    """
+    Runs fn(*args) on executor once client is granted a slot, and frees
+    the slot when it returns. Executor threads thus never wait for slots.
+    Returns a concurrent Future; cancelling it before fn starts gives up
+    the request.
+    """
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            _release(client)
+            return
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            _release(client)
+            future.set_exception(e)
+        else:
+            _release(client)
+            future.set_result(result)
+
+    def withdraw(done):
+        # Until notified, a cancelled future does not count as done for
+        # concurrent.futures.wait(); run() does that once it is granted.
+        if done.cancelled() and _withdraw(waiter):
+            done.set_running_or_notify_cancel()
+
+    # Called with _lock held; submit() only queues the call.
+    waiter = _Waiter(client, priority, on_grant=lambda: executor.submit(run))
+    future.add_done_callback(withdraw)
+    _enqueue(waiter)
+    return future
+
+#--------------------------------------------------------------------------
+# CPU accounting and priorities
+#--------------------------------------------------------------------------
+def _cpu_seconds(pid):
+    """CPU time of a process and its reaped children, or None if gone."""
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    fields = data[data.rfind(b")") + 2:].split()
+    # utime, stime, cutime, cstime (fields 14-17 of proc(5)).
+    return sum(int(field) for field in fields[11:15]) / _CLOCK_TICKS
+
+
+def _renice(pid, nice):
+    try:
+        os.setpriority(os.PRIO_PGRP, pid, nice)
+        return True
+    except (OSError, AttributeError):
+        return False
+
+
+def track(pid, client):
+    """
+    Starts accounting the CPU time of the program led by pid to client,
+    and gives it the client's current nice value.
+    """
+    with _lock:
+        nice = nice_for(client)
+        _tracked[pid] = [client, _cpu_seconds(pid) or 0.0, nice]
+        _wakeup.notify()
+        if _sampler["thread"] is None:
+            _sampler["thread"] = threading.Thread(target=_sample_forever, name="code-sched", daemon=True)
+            _sampler["thread"].start()
+    if nice:
+        _renice(pid, nice)
+
+
+def untrack(pid):
+    """Stops accounting a program, after a last sample if it is still there."""
+    with _lock:
+        _sample(pid, time.monotonic())
+        _tracked.pop(pid, None)
+
+
+def _sample(pid, now):
+    entry = _tracked.get(pid)
+    seconds = _cpu_seconds(pid)
+    if entry is None or seconds is None or seconds <= entry[1]:
+        return
+    client = entry[0]
+    _usage.setdefault(client, deque()).append((now, seconds - entry[1]))
+    entry[1] = seconds
+
+
+def sample():
+    """
+    Adds the CPU time used since the last sample to each client and raises
+    the nice value of programs whose client has become heavier. (Nice is
+    never lowered again: that would need privileges.)
+    """
+    now = time.monotonic()
+    with _lock:
+        for pid in list(_tracked):
+            _sample(pid, now)
+        for client in list(_usage):
+            if not usage(client, now) and client not in _running:
+                del _usage[client]
+        for pid, entry in _tracked.items():
+            nice = nice_for(entry[0])
+            if nice > entry[2] and _renice(pid, nice):
+                entry[2] = nice
+
+
+def _sample_forever():
+    while True:
+        with _lock:
+            while not _tracked:
+                _wakeup.wait()
+        time.sleep(SCHED_SAMPLE_SECONDS)
+        try:
+            sample()
+        except Exception:
+            logger.exception("Scheduler sample failed")
+
+
+def snapshot():
+    """Scheduler state for the metrics endpoint."""
+    with _lock:
+        return {
+            "free_slots": _free_slots[0],
+            "short_only_slots": min(_free_slots[0], SCHED_SHORT_SLOTS),
+            "waiting": sum(len(queue) for queue in _queues.values()),
+            "tracked_programs": len(_tracked),
+        }
@@ -0,0 +1,940 @@
+import os
+import time
+import uuid
+import shutil
+import signal
+import tempfile
+import codecs
+import asyncio
+from collections import deque
+from . import interactive_executor
+from . import workspace
+from . import protocol
+from . import janitor
+from . import prewarm
+from . import nodepool
+from . import analysis
+from . import languages
+from . import code_executor
+from . import scheduler
+
+#--------------------------------------------------------------------------
+# Configuration: how long a session survives without a connected client and
+# how much output is kept for replay after a reconnect.
+#--------------------------------------------------------------------------
+SESSION_GRACE_SECONDS = float(os.environ.get("CODE_SESSION_GRACE_SECONDS", "30"))
+SESSION_BUFFER_FRAMES = int(os.environ.get("CODE_SESSION_BUFFER_FRAMES", "5000"))
+SESSION_BUFFER_BYTES = int(os.environ.get("CODE_SESSION_BUFFER_BYTES", str(4 * 1024 * 1024)))
+# Runs that may be alive at the same time on one connection.
+SESSION_MAX_RUNS = int(os.environ.get("CODE_SESSION_MAX_RUNS", "4"))
+# How long output is still read after the program itself has exited.
+EXIT_DRAIN_SECONDS = float(os.environ.get("CODE_EXIT_DRAIN_SECONDS", "0.5"))
+# Lines of type-ahead input that may wait for the program to read them.
+INPUT_QUEUE_LINES = int(os.environ.get("CODE_INPUT_QUEUE_LINES", "1000"))
+
+# Bytes read at a time from a run's pipes.
+BULK_READ_BYTES = 64 * 1024
+PROMPT_MARKER = b"PROMPT:"
+# A Node worker busy in a callback never sees SIGINT; it is killed when the
+# interrupted run has not ended after this long.
+WORKER_INTERRUPT_SECONDS = 0.5
+# Pty runs: a partial line that sees no more output for this long, while
+# the program waits on its terminal, is sent as a prompt (longer ones are
+# plain output).
+PTY_PROMPT_IDLE_SECONDS = float(os.environ.get("CODE_PTY_PROMPT_IDLE_MS", "30")) / 1000
+PTY_PROMPT_MAX_BYTES = 1024
+
+# Queued in place of a line to close the program's stdin.
+END_OF_INPUT = None
+
+# Live sessions by resume token.
+_sessions = {}
+
+
+def incomplete_utf8_tail(data):
+    """Length of a UTF-8 sequence cut off at the end of data (0 if none)."""
+    for i in range(1, min(4, len(data)) + 1):
+        byte = data[-i]
+        if byte & 0xC0 != 0x80:
+            # Lead byte: is the sequence it starts complete?
+            needed = 1 if byte < 0xC0 else 2 if byte < 0xE0 else 3 if byte < 0xF0 else 4
+            return i if i < needed else 0
+    return 0
+
+
+def prompt_offset(data):
+    """Offset of the first prompt line in data (len(data) if none)."""
+    if data.startswith(PROMPT_MARKER):
+        return 0
+    index = data.find(b"\n" + PROMPT_MARKER)
+    return len(data) if index == -1 else index + 1
+
+
+class OutputBuffer:
+    """
+    Bounded ring buffer of the frames sent to the client. The oldest frames
+    are dropped once either the frame or the byte budget is exceeded.
+    """
+
+    def __init__(self, max_frames=SESSION_BUFFER_FRAMES, max_bytes=SESSION_BUFFER_BYTES):
+        self.frames = deque()
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.size = 0
+
+    def append(self, seq, frame_type, stream, run_id, payload):
+        size = len(protocol.payload_bytes(payload))
+        self.frames.append((seq, frame_type, stream, run_id, payload, size))
+        self.size += size
+        while self.frames and (len(self.frames) > self.max_frames or self.size > self.max_bytes):
+            self.size -= self.frames.popleft()[5]
+
+    def since(self, last_seq):
+        """
+        Returns (frames, complete) for every buffered frame newer than
+        last_seq. complete is False when some of them were already dropped.
+        """
+        frames = [frame[:5] for frame in self.frames if frame[0] > last_seq]
+        complete = not self.frames or self.frames[0][0] <= last_seq + 1
+        return frames, complete
+
+
+class ExecRun:
+    """
+    One program started on a session. Several runs can be alive on the same
+    session at once; every frame they produce is tagged with the run id.
+    A kernel run is a Python interpreter that stays alive and executes cells
+    in one namespace until it is stopped or restarted. A checkpointed run
+    keeps a forked copy of the program frozen at each prompt, so it can be
+    rewound to prompt n and answered differently. A JavaScript run usually
+    borrows a warm Node worker, which goes back to the pool when the
+    program ends. C and C++ programs run on a pseudo-terminal, which
+    their stdio flushes before each read.
+    """
+
+    def __init__(self, session, run_id, kernel=False):
+        self.session = session
+        self.run_id = run_id
+        self.kernel = kernel
+        # Kernel cells sent but not yet finished, oldest (running) first.
+        self.pending_cells = deque()
+        self.last_cell = 0
+        self.cell_started = None
+        # Checkpointed runs: prompt number -> pid of the frozen copy.
+        self.checkpoint_dir = None
+        self.checkpoints = {}
+        self.live_pid = None
+        self.exit_reported = False
+        self.started = None
+        # Non-interactive runs have no stdin and are read in bulk.
+        self.interactive = True
+        # Pooled Node runs: the worker's id for the job, the output byte
+        # counts of its exit report (once it comes) and the bytes read so far.
+        self.worker = False
+        self.worker_job = None
+        self.worker_exit = None
+        self.worker_read = {protocol.STREAM_STDOUT: 0, protocol.STREAM_STDERR: 0}
+        # Runs on a pty, and the directory they were compiled in.
+        self.pty = False
+        self.build_dir = None
+        self.process = None
+        self.tasks = []
+        self.tmp_files = []
+        self.closed = False
+        # Input lines wait here until the writer task feeds them to stdin.
+        self.input_queue = asyncio.Queue(maxsize=INPUT_QUEUE_LINES)
+
+    async def emit(self, frame_type, payload, stream=protocol.STREAM_CONTROL):
+        await self.session.emit(frame_type, payload, stream, self.run_id)
+
+    async def start(self, language, code, inputs=(), close_stdin=False, checkpoints=False, interactive=None):
+        """
+        Starts the program. inputs are lines queued for stdin up front;
+        with close_stdin the program sees end-of-file after them. A kernel
+        run executes code (if any) as its first cell. With checkpoints the
+        run can later be rewound to any of its prompts. interactive=False
+        (or, when None, code that never reads input) takes the fast path:
+        stdin closed, block-buffered output read in bulk.
+        Returns False if it could not be started.
+        """
+        entry = languages.get(language)
+        if entry is None or entry.run is None:
+            await self.emit(protocol.FRAME_ERROR, "Unsupported language.")
+            return False
+        if not languages.is_available(entry):
+            await self.emit(protocol.FRAME_ERROR, f"{entry.name} is not installed on this server.")
+            return False
+        if not entry.interactive:
+            await self.emit(protocol.FRAME_ERROR, f"Interactive {entry.name} runs are not available on this server.")
+            return False
+        language, ext = entry.name, entry.extension
+        if self.kernel and language != "python":
+            await self.emit(protocol.FRAME_ERROR, "Kernel mode is only available for Python.")
+            return False
+        if checkpoints and (self.kernel or language != "python"):
+            await self.emit(protocol.FRAME_ERROR, "Checkpoints are only available for Python programs.")
+            return False
+
+        # Kernel cells are checked one by one in execute().
+        if language == "python" and code and not self.kernel and not await self.syntax_ok(code):
+            return False
+
+        if language == "python" and not self.kernel and not checkpoints and not inputs:
+            if interactive is None:
+                interactive = await asyncio.to_thread(self.may_read_input, code)
+            self.interactive = bool(interactive)
+
+        self.pty = (self.interactive and not self.kernel and not checkpoints
+                    and language in interactive_executor.PTY_LANGUAGES)
+
+        for line in inputs:
+            if not await self.queue_input(str(line).encode('utf-8')):
+                return False
+        if close_stdin and self.interactive:
+            await self.queue_input(END_OF_INPUT)
+
+        try:
+            if self.kernel:
+                self.process = await interactive_executor.start_python_kernel(
+                    self.session.workspace_path, owner=self.session.token
+                )
+            elif self.pty:
+                self.process = await self.start_pty(language, code)
+                if self.process is None:
+                    return False
+            else:
+                warm = None
+                if language == "python" and not checkpoints and prewarm.wants_warm(code):
+                    # Numeric code: take (or start) an interpreter that has
+                    # the heavy imports done, before the source hits the disk.
+                    warm = await prewarm.acquire(owner=self.session.token)
+                    self.process = warm
+                elif language == "javascript" and nodepool.wants_pool(code):
+                    self.process = await nodepool.acquire(owner=self.session.token)
+                    self.worker = True
+                source_filepath = interactive_executor.create_temp_file(code, ext)
+                self.tmp_files.append(source_filepath)
+                if checkpoints:
+                    # Kept out of the workspace, where the program could tamper with it.
+                    self.checkpoint_dir = tempfile.mkdtemp(prefix="ckpt_", dir=interactive_executor.CODE_EXEC_DIR)
+                if warm:
+                    await prewarm.assign(warm, source_filepath, self.session.workspace_path, self.interactive)
+                elif self.worker:
+                    self.worker_job = await nodepool.assign(self.process, source_filepath, self.session.workspace_path)
+                elif language == "javascript":
+                    self.process = await interactive_executor.start_interactive_node(
+                        source_filepath, self.session.workspace_path, owner=self.session.token
+                    )
+                else:
+                    self.process = await interactive_executor.start_interactive_docker(
+                        language, source_filepath, self.session.workspace_path,
+                        owner=self.session.token, checkpoint_dir=self.checkpoint_dir,
+                        interactive=self.interactive
+                    )
+        except Exception as e:
+            await self.emit(protocol.FRAME_ERROR, str(e))
+            return False
+        self.started = time.monotonic()
+        self.live_pid = self.process.pid
+        if not self.worker:
+            # Interactive runs start at once, but their CPU time counts
+            # towards the session's share. (Pooled Node workers are shared
+            # between sessions and keep their priority.)
+            scheduler.track(self.live_pid, self.session.client)
+
+        if self.worker:
+            self.worker_exit = asyncio.get_running_loop().create_future()
+        # Only interactive stdout can carry prompts and runner markers.
+        read = self.read_stream if self.interactive else self.read_chunks
+        output_task = asyncio.create_task(read(self.process.stdout, protocol.STREAM_STDOUT))
+        error_task = asyncio.create_task(self.read_chunks(self.process.stderr, protocol.STREAM_STDERR))
+        readers = [output_task, error_task]
+        if self.process.figure_stream:
+            # Figures arrive on their own pipe so they never hold up stdout.
+            readers.append(asyncio.create_task(self.read_figures(self.process.figure_stream)))
+        exit_task = asyncio.create_task(self.report_exit(readers))
+        self.tasks.extend(readers + [exit_task])
+        if self.worker:
+            self.tasks.append(asyncio.create_task(self.watch_worker(readers)))
+        if self.interactive:
+            self.tasks.append(asyncio.create_task(self.feed_stdin()))
+        self.tasks.append(asyncio.create_task(
+            workspace.watch_quota(self.session.workspace_path, self.quota_exceeded)
+        ))
+        if self.kernel and code:
+            await self.execute(code)
+        return True
+
+    async def start_pty(self, language, code):
+        """
+        Compiles the program off the event loop and starts it on a pty.
+        Returns the process, or None after reporting a compile error.
+        """
+        self.build_dir = tempfile.mkdtemp(prefix="build_", dir=interactive_executor.CODE_EXEC_DIR)
+        try:
+            argv = await asyncio.to_thread(code_executor.prepare_program, language, code, self.build_dir)
+        except code_executor.CompileError as e:
+            await self.emit(protocol.FRAME_ERROR, str(e))
+            if e.diagnostics:
+                await self.emit(protocol.FRAME_CONTROL, {"diagnostics": e.diagnostics})
+            return None
+        return await interactive_executor.start_interactive_pty(
+            argv, self.session.workspace_path, owner=self.session.token
+        )
+
+    def may_read_input(self, code):
+        """
+        Static guess at whether the program reads stdin. Modules imported
+        from the workspace are not analysed, so importing one counts.
+        """
+        if analysis.reads_input(code):
+            return True
+        root = self.session.workspace_path
+        return any(
+            os.path.exists(os.path.join(root, name + ".py")) or os.path.isdir(os.path.join(root, name))
+            for name in analysis.find_imports(code)
+        )
+
+    async def syntax_ok(self, code):
+        """
+        Pre-flight syntax check, off the event loop and cached. A syntax error
+        is reported right away (as text and as a structured diagnostic)
+        instead of spawning an interpreter just to print it.
+        """
+        diagnostic = await asyncio.to_thread(analysis.check_syntax, code)
+        if diagnostic is None:
+            return True
+        await self.emit(protocol.FRAME_ERROR, analysis.format_diagnostic(diagnostic))
+        await self.emit(protocol.FRAME_CONTROL, {"diagnostics": [diagnostic]})
+        return False
+
+    async def execute(self, code, cell_id=None):
+        """
+        Sends a cell to the kernel. Cells run one at a time in the order they
+        were sent; each one's end is reported as a STATS frame with its id.
+        """
+        if cell_id is None:
+            cell_id = self.last_cell + 1
+        if not isinstance(cell_id, int) or cell_id <= 0:
+            await self.emit(protocol.FRAME_ERROR, "Invalid cell id.")
+            return
+        self.last_cell = max(self.last_cell, cell_id)
+        if not await self.syntax_ok(code):
+            # The kernel never sees the cell; report it finished with an error.
+            await self.emit(protocol.FRAME_STATS, {"cell": cell_id, "status": "error", "elapsed": 0.0})
+            return
+        if not self.pending_cells:
+            self.cell_started = time.monotonic()
+        self.pending_cells.append(cell_id)
+        interactive_executor.send_cell(self.process, cell_id, code)
+
+    async def finish_cell(self, fields):
+        """Handles the end-of-cell marker written by the kernel."""
+        cell_id, status = fields.split(":", 1)
+        cell_id = int(cell_id)
+        if self.pending_cells:
+            self.pending_cells.popleft()
+        now = time.monotonic()
+        elapsed = now - self.cell_started if self.cell_started else 0.0
+        self.cell_started = now if self.pending_cells else None
+        await self.emit(protocol.FRAME_STATS, {
+            "cell": cell_id,
+            "status": status,
+            "elapsed": round(elapsed, 3),
+        })
+
+    async def add_checkpoint(self, fields):
+        """Records the copy frozen at a prompt and the branch now running."""
+        n, holder_pid, live_pid = (int(field) for field in fields.split(":"))
+        if min(n, holder_pid, live_pid) <= 0:
+            raise ValueError(fields)
+        self.checkpoints[n] = holder_pid
+        self.live_pid = live_pid
+        await self.emit(protocol.FRAME_CONTROL, {"checkpoint": n})
+
+    async def program_exited(self, fields):
+        """
+        Reports the end of a checkpointed program. The run stays alive so
+        that it can still be rewound, until it is stopped.
+        """
+        self.exit_reported = True
+        self.live_pid = None
+        await self.emit(protocol.FRAME_STATS, {
+            "exit_code": int(fields),
+            "elapsed": round(time.monotonic() - self.started, 3),
+            "checkpoints": sorted(self.checkpoints),
+        })
+
+    async def rewind(self, n):
+        """
+        Abandons the current branch and resumes the copy frozen at prompt n,
+        which asks that prompt again.
+        """
+        if n not in self.checkpoints:
+            await self.emit(protocol.FRAME_ERROR, f"No checkpoint at prompt {n}.")
+            return
+        # Later checkpoints and the live branch all descend from the abandoned path.
+        for later in [m for m in self.checkpoints if m > n]:
+            interactive_executor.kill_pid(self.checkpoints.pop(later), self.process.pid)
+        if self.live_pid:
+            interactive_executor.kill_pid(self.live_pid, self.process.pid)
+            self.live_pid = None
+        while not self.input_queue.empty():
+            self.input_queue.get_nowait()
+        self.exit_reported = False
+        self.started = time.monotonic()
+        await self.emit(protocol.FRAME_CONTROL, {"rewound": n})
+        if not await interactive_executor.resume_checkpoint(self.checkpoint_dir, n):
+            await self.emit(protocol.FRAME_ERROR, f"Checkpoint {n} is gone.")
+
+    async def watch_worker(self, readers):
+        """
+        Waits for the Node worker to report the end of this run's job on its
+        status pipe. Once the readers have relayed every byte of output the
+        report counts, the worker goes back to the pool and the run ends.
+        """
+        try:
+            while True:
+                line = await self.process.status_stream.readline()
+                if not line:
+                    # The worker died; report_exit takes over.
+                    return
+                name, _, fields = line.decode("ascii", errors="replace").strip().partition(":")
+                job, *counts = fields.split(":")
+                if name != "EXIT" or job != self.worker_job or len(counts) != 4:
+                    continue
+                try:
+                    exit_code, reusable, stdout_bytes, stderr_bytes = map(int, counts)
+                except ValueError:
+                    continue
+                break
+            self.worker_exit.set_result({
+                protocol.STREAM_STDOUT: stdout_bytes,
+                protocol.STREAM_STDERR: stderr_bytes,
+            })
+            await asyncio.wait(readers)
+            await self.worker_finished(exit_code, reusable == 1)
+        except asyncio.CancelledError:
+            pass
+
+    async def worker_finished(self, exit_code, reusable):
+        """Hands the Node worker back to the pool and ends the run."""
+        process, self.process = self.process, None
+        elapsed = time.monotonic() - self.started
+        await self.session.finish_run(self)
+        await nodepool.release(process, self.session.token, reusable)
+        await self.emit(protocol.FRAME_STATS, {
+            "exit_code": exit_code,
+            "elapsed": round(elapsed, 3),
+        })
+
+    def markers(self):
+        """Names of the runner markers this run expects on stdout."""
+        if self.kernel:
+            return (b"CELL",)
+        return ()
+
+    async def handle_marker(self, body, stream_id):
+        """
+        Dispatches a "<NAME>:<fields>" report of the runner: a marker line
+        on stdout, or a line of a checkpointed run's status pipe.
+        """
+        name, _, fields = body.decode("ascii", errors="replace").strip().partition(":")
+        try:
+            if name == "CELL":
+                await self.finish_cell(fields)
+            elif name == "CHECKPOINT" and stream_id is None:
+                await self.add_checkpoint(fields)
+            elif name == "EXIT" and stream_id is None:
+                await self.program_exited(fields)
+        except ValueError:
+            # Markers on stdout can be imitated by the program; a
+            # malformed one is dropped.
+            pass
+
+    def interrupt(self):
+        """Sends SIGINT, like Ctrl-C in a terminal."""
+        if self.process and self.process.returncode is None:
+            interactive_executor.signal_process_group(self.process.pid, signal.SIGINT)
+            if self.worker:
+                self.tasks.append(asyncio.create_task(self.kill_if_stuck(self.process)))
+
+    async def kill_if_stuck(self, process):
+        await asyncio.sleep(WORKER_INTERRUPT_SECONDS)
+        if self.process is process:
+            interactive_executor.signal_process_group(process.pid, signal.SIGKILL)
+
+    async def queue_input(self, line):
+        """
+        Queues a line (or END_OF_INPUT) for the program's stdin without
+        waiting for the program to read it. Returns False if the queue is full.
+        """
+        if not self.interactive:
+            await self.emit(protocol.FRAME_ERROR, "This run does not read input.")
+            return False
+        try:
+            self.input_queue.put_nowait(line)
+        except asyncio.QueueFull:
+            await self.emit(protocol.FRAME_ERROR, f"Input queue is full ({INPUT_QUEUE_LINES} lines).")
+            return False
+        return True
+
+    async def feed_stdin(self):
+        """
+        Writes queued input to stdin one line at a time. drain() applies the
+        pipe's backpressure here, so a program that is slow to read input
+        never blocks the WebSocket receive loop.
+        """
+        stdin = self.process.stdin
+        try:
+            while True:
+                line = await self.input_queue.get()
+                if line is END_OF_INPUT:
+                    if self.pty:
+                        # Ctrl-D at the start of a line: end-of-file on a terminal.
+                        stdin.write(b"\x04")
+                        await stdin.drain()
+                    else:
+                        stdin.close()
+                    break
+                stdin.write(line + b'\n')
+                await stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # The program exited or closed its stdin; remaining input is dropped.
+            pass
+        except asyncio.CancelledError:
+            pass
+
+    async def read_stream(self, stream, stream_id):
+        """
+        Relays interactive output. The runner block-buffers stdout, so each
+        read may hold many lines: plain text goes out as one frame, while
+        prompt lines and runner markers become frames of their own.
+        """
+        pending = b""
+        read = None
+        # A checkpointed run's reports are read along with its stdout, so
+        # each is handled after the output written before it.
+        status = self.process.status_stream if stream_id == protocol.STREAM_STDOUT and self.checkpoint_dir else None
+        report = None
+        try:
+            while True:
+                if read is None:
+                    read = asyncio.ensure_future(self.read_output(stream, stream_id))
+                if status and report is None:
+                    report = asyncio.ensure_future(status.readline())
+                if status or (self.pty and pending):
+                    timeout = PTY_PROMPT_IDLE_SECONDS if self.pty and pending else None
+                    done, _ = await asyncio.wait(
+                        {read, report} - {None}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    if not done:
+                        pending = await self.flush_partial_line(pending, stream_id)
+                        continue
+                data = b""
+                if read.done() or not status:
+                    data = await read
+                    read = None
+                    if not data:
+                        break
+                if report is not None and report.done():
+                    line = report.result()
+                    report = None
+                    if line:
+                        # The runner reports a checkpoint right before its
+                        # prompt, and the exit after all of its output.
+                        data = pending + data
+                        cut = prompt_offset(data) if line.startswith(b"CHECKPOINT:") else len(data)
+                        pending = await self.relay(data[:cut], stream_id)
+                        if pending:
+                            await self.emit(protocol.FRAME_OUTPUT, pending, stream_id)
+                        await self.handle_marker(line, None)
+                        pending, data = b"", data[cut:]
+                    else:
+                        status = None
+                if data:
+                    pending = await self.relay(pending + data, stream_id)
+            if report:
+                report.cancel()
+            if pending:
+                await self.emit(protocol.FRAME_OUTPUT, pending, stream_id)
+        except asyncio.CancelledError:
+            if read:
+                read.cancel()
+            if report:
+                report.cancel()
+        except Exception as e:
+            await self.emit(protocol.FRAME_ERROR, str(e))
+
+    async def flush_partial_line(self, pending, stream_id):
+        """
+        Called when a pty run's output has gone idle in the middle of a
+        line. If the program is waiting for input the line is its prompt;
+        otherwise it goes out as output. Returns the bytes still held back.
+        """
+        if interactive_executor.reading_terminal(self.process):
+            await self.emit(protocol.FRAME_PROMPT, pending + b"\n", stream_id)
+            return b""
+        held = incomplete_utf8_tail(pending)
+        if held < len(pending):
+            await self.emit(protocol.FRAME_OUTPUT, pending[:len(pending) - held], stream_id)
+        return pending[len(pending) - held:]
+
+    async def relay(self, data, stream_id):
+        """
+        Emits the frames for data and returns the bytes held back: a partial
+        line that may still turn into a prompt or marker, or a cut-off
+        UTF-8 sequence.
+        """
+        output = bytearray()
+        start = 0
+        while True:
+            end = data.find(b"\n", start)
+            if end == -1:
+                break
+            line = data[start:end + 1]
+            start = end + 1
+            if stream_id == protocol.STREAM_STDOUT and line.startswith(PROMPT_MARKER):
+                if output:
+                    await self.emit(protocol.FRAME_OUTPUT, bytes(output), stream_id)
+                    output.clear()
+                # Remove the marker from the output text.
+                await self.emit(protocol.FRAME_PROMPT, line[len(PROMPT_MARKER):], stream_id)
+                continue
+            # A marker may follow output that did not end in a newline.
+            index = line.find(interactive_executor.MARKER_PREFIX)
+            body = line[index + len(interactive_executor.MARKER_PREFIX):]
+            if index >= 0 and body.partition(b":")[0] in self.markers():
+                output += line[:index]
+                if output:
+                    await self.emit(protocol.FRAME_OUTPUT, bytes(output), stream_id)
+                    output.clear()
+                await self.handle_marker(body, stream_id)
+                continue
+            output += line
+
+        rest = data[start:]
+        if (stream_id == protocol.STREAM_STDOUT and rest.startswith(PROMPT_MARKER[:len(rest)])) or (
+                self.markers() and interactive_executor.MARKER_PREFIX in rest) or (
+                self.pty and stream_id == protocol.STREAM_STDOUT and len(rest) <= PTY_PROMPT_MAX_BYTES):
+            held = len(rest)
+        else:
+            held = incomplete_utf8_tail(rest)
+        output += rest[:len(rest) - held]
+        if output:
+            await self.emit(protocol.FRAME_OUTPUT, bytes(output), stream_id)
+        return rest[len(rest) - held:]
+
+    async def read_output(self, stream, stream_id):
+        """
+        Reads the next chunk of the program's output, b"" at its end. A Node
+        worker outlives its job, so there its streams end once the byte
+        count of the job's exit report has been read.
+        """
+        if not self.worker:
+            return await stream.read(BULK_READ_BYTES)
+        read = asyncio.ensure_future(stream.read(BULK_READ_BYTES))
+        try:
+            if not self.worker_exit.done():
+                await asyncio.wait({read, self.worker_exit}, return_when=asyncio.FIRST_COMPLETED)
+            if not read.done() and self.worker_read[stream_id] >= self.worker_exit.result()[stream_id]:
+                # Anything the worker writes later belongs to its next job.
+                read.cancel()
+                return b""
+            data = await read
+        except asyncio.CancelledError:
+            read.cancel()
+            raise
+        self.worker_read[stream_id] += len(data)
+        return data
+
+    async def read_chunks(self, stream, stream_id):
+        """Relays a non-interactive run's output in large chunks."""
+        # Chunks can split a UTF-8 sequence; carry the partial bytes over.
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        try:
+            while True:
+                data = await self.read_output(stream, stream_id)
+                text = decoder.decode(data, final=not data)
+                if text:
+                    await self.emit(protocol.FRAME_OUTPUT, text.encode("utf-8"), stream_id)
+                if not data:
+                    break
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            await self.emit(protocol.FRAME_ERROR, str(e))
+
+    async def read_figures(self, stream):
+        """Relays figures rendered by the runner as typed figure frames."""
+        try:
+            while True:
+                figure = await interactive_executor.read_figure(stream)
+                if figure is None:
+                    break
+                fmt, data = figure
+                frame_type = protocol.FIGURE_FRAME_TYPES.get(fmt)
+                if frame_type:
+                    await self.emit(frame_type, data)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            await self.emit(protocol.FRAME_ERROR, f"Figure stream failed: {e}")
+
+    async def report_exit(self, readers):
+        """
+        Once the program exits, drains what is left in its pipes, reaps the
+        run (killing anything it left behind in its process group) and sends
+        the exit code and wall time.
+        """
+        try:
+            returncode = await interactive_executor.wait_for_exit(self.process)
+            # A background grandchild may hold the pipes open; don't wait on it.
+            await asyncio.wait(readers, timeout=EXIT_DRAIN_SECONDS)
+            elapsed = time.monotonic() - self.started
+            await self.session.finish_run(self)
+            # A checkpointed program may already have reported its exit code.
+            if not self.exit_reported:
+                await self.emit(protocol.FRAME_STATS, {
+                    "exit_code": returncode,
+                    "elapsed": round(elapsed, 3),
+                })
+        except asyncio.CancelledError:
+            pass
+
+    async def quota_exceeded(self):
+        """Stops a run that filled its workspace past the quota."""
+        await self.emit(protocol.FRAME_ERROR, f"Workspace quota of {workspace.WORKSPACE_QUOTA_MB} MB exceeded; run stopped.")
+        await self.session.finish_run(self)
+        await self.emit(protocol.FRAME_CONTROL, {"stopped": self.run_id})
+
+    async def reap(self):
+        """
+        Stops the program's whole process group, cancels every reader task,
+        closes its pipes and deletes its files.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        current = asyncio.current_task()
+        for task in self.tasks:
+            if task is not current:
+                task.cancel()
+        if self.process:
+            if not self.worker:
+                scheduler.untrack(self.process.pid)
+            await interactive_executor.stop_process_group(self.process)
+        for filepath in self.tmp_files:
+            try:
+                os.unlink(filepath)
+            except Exception:
+                pass
+        if self.checkpoint_dir:
+            shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+        if self.build_dir:
+            shutil.rmtree(self.build_dir, ignore_errors=True)
+
+
+class ExecSession:
+    """
+    State of one interactive session: its runs, workspace and output buffer.
+    It outlives the WebSocket connection for SESSION_GRACE_SECONDS so that
+    a client can reconnect and resume.
+    """
+
+    def __init__(self, workspace_id, workspace_path, client):
+        self.token = uuid.uuid4().hex
+        self.client = client
+        self.workspace_id = workspace_id
+        self.workspace_path = workspace_path
+        self.runs = {}
+        self.last_run_id = 0
+        self.buffer = OutputBuffer()
+        self.seq = 0
+        self.consumer = None
+        self.expiry = None
+        # The close() started when the grace period ran out, kept referenced
+        # so it is not collected before it finishes.
+        self.closing = None
+        self.closed = False
+
+    #----------------------------------------------------------------------
+    # Client attachment
+    #----------------------------------------------------------------------
+    async def attach(self, consumer, last_seq=None):
+        """
+        Connects a consumer to the session. When last_seq is given, every
+        buffered frame after it is replayed first. Returns False if part of
+        that output had already been dropped from the buffer.
+        """
+        if self.expiry:
+            self.expiry.cancel()
+            self.expiry = None
+        previous = self.consumer
+        self.consumer = None
+        if previous is not None and previous is not consumer:
+            await previous.close(code=4001)
+
+        complete = True
+        if last_seq is not None:
+            frames, complete = self.buffer.since(last_seq)
+            while frames:
+                for seq, frame_type, stream, run_id, payload in frames:
+                    await consumer.send_frame(frame_type, payload, stream, seq, run_id)
+                    last_seq = seq
+                # Frames emitted while we were replaying are picked up here.
+                frames, _ = self.buffer.since(last_seq)
+        self.consumer = consumer
+        return complete
+
+    def detach(self, consumer):
+        """Disconnects a consumer and starts the grace period."""
+        if self.consumer is not consumer:
+            return
+        self.consumer = None
+        self.expiry = asyncio.get_running_loop().call_later(SESSION_GRACE_SECONDS, self.expire)
+
+    def expire(self):
+        """Ends the grace period: closes the session in the background."""
+        self.expiry = None
+        self.closing = asyncio.get_running_loop().create_task(self.close())
+
+    async def emit(self, frame_type, payload, stream=protocol.STREAM_CONTROL, run_id=0):
+        """Numbers a frame, buffers it and sends it to the attached client."""
+        self.seq += 1
+        self.buffer.append(self.seq, frame_type, stream, run_id, payload)
+        if self.consumer is not None:
+            await self.consumer.send_frame(frame_type, payload, stream, self.seq, run_id)
+
+    #----------------------------------------------------------------------
+    # Runs
+    #----------------------------------------------------------------------
+    async def start_run(self, run_id, language, code, inputs=(), close_stdin=False, kernel=False,
+                        checkpoints=False, interactive=None):
+        """
+        Starts a new run (a kernel with kernel=True). run_id is chosen by the
+        client; when it is missing the next free id is used. Returns the run,
+        or None on failure.
+        """
+        if run_id is None:
+            run_id = self.last_run_id + 1
+            while run_id in self.runs:
+                run_id += 1
+        if not protocol.is_run_id(run_id):
+            await self.emit(protocol.FRAME_ERROR, "Invalid run id.")
+            return None
+        if run_id in self.runs:
+            await self.emit(protocol.FRAME_ERROR, f"Run {run_id} is already active.", run_id=run_id)
+            return None
+        if len(self.runs) >= SESSION_MAX_RUNS:
+            await self.emit(protocol.FRAME_ERROR, f"At most {SESSION_MAX_RUNS} runs can be active at once.", run_id=run_id)
+            return None
+
+        run = ExecRun(self, run_id, kernel)
+        self.runs[run_id] = run
+        self.last_run_id = run_id
+        if not await run.start(language, code, inputs, close_stdin, checkpoints, interactive):
+            await self.finish_run(run)
+            return None
+        return run
+
+    def get_run(self, run_id):
+        """Looks a run up by id, defaulting to the most recently started one."""
+        if run_id is None:
+            run_id = self.last_run_id
+        return self.runs.get(run_id)
+
+    def get_kernel(self, run_id):
+        """Returns the kernel run with run_id, or any kernel when run_id is None."""
+        if run_id is None:
+            return next((run for run in self.runs.values() if run.kernel), None)
+        run = self.runs.get(run_id)
+        return run if run is not None and run.kernel else None
+
+    async def execute_cell(self, run_id, code, cell_id=None):
+        """
+        Executes a cell on a kernel, starting the kernel on first use so the
+        namespace persists across cells.
+        """
+        run = self.get_kernel(run_id)
+        if run is None:
+            if run_id in self.runs:
+                await self.emit(protocol.FRAME_ERROR, f"Run {run_id} is not a kernel.", run_id=run_id)
+                return
+            run = await self.start_run(run_id, "python", None, kernel=True)
+            if run is None:
+                return
+        await run.execute(code, cell_id)
+
+    async def interrupt_run(self, run_id):
+        """Interrupts the running cell (or program) without killing the run."""
+        # Without a run id a kernel is preferred, being the usual target.
+        run = (run_id is None and self.get_kernel(None)) or self.get_run(run_id)
+        if run is None:
+            await self.emit(protocol.FRAME_ERROR, "No such run.", run_id=run_id or 0)
+            return
+        run.interrupt()
+
+    async def rewind_run(self, run_id, prompt):
+        """Rewinds a checkpointed run to one of its earlier prompts."""
+        run = self.get_run(run_id)
+        if run is None or not run.checkpoint_dir:
+            await self.emit(protocol.FRAME_ERROR, "No such checkpointed run.", run_id=run_id or 0)
+            return
+        await run.rewind(prompt)
+
+    async def restart_kernel(self, run_id):
+        """Replaces a kernel with a fresh interpreter under the same run id."""
+        run = self.get_kernel(run_id)
+        if run is None:
+            await self.emit(protocol.FRAME_ERROR, "No such kernel.", run_id=run_id or 0)
+            return
+        await self.finish_run(run)
+        if await self.start_run(run.run_id, "python", None, kernel=True):
+            await self.emit(protocol.FRAME_CONTROL, {"restarted": run.run_id}, run_id=run.run_id)
+
+    async def finish_run(self, run):
+        """Frees the run id and reaps the run."""
+        if self.runs.get(run.run_id) is run:
+            del self.runs[run.run_id]
+        await run.reap()
+
+    async def stop_run(self, run_id):
+        """Stops a run and everything it spawned."""
+        run = self.get_run(run_id)
+        if run is None:
+            await self.emit(protocol.FRAME_ERROR, "No such run.", run_id=run_id or 0)
+            return
+        await self.finish_run(run)
+        await self.emit(protocol.FRAME_CONTROL, {"stopped": run.run_id}, run_id=run.run_id)
+
+    #----------------------------------------------------------------------
+    # Teardown
+    #----------------------------------------------------------------------
+    async def close(self):
+        """Kills every run, releases their files and forgets the session."""
+        if self.closed:
+            return
+        self.closed = True
+        _sessions.pop(self.token, None)
+        if self.expiry:
+            self.expiry.cancel()
+        runs = list(self.runs.values())
+        await asyncio.gather(*(self.finish_run(run) for run in runs))
+        await nodepool.discard(self.token)
+        workspace.schedule_removal(self.workspace_path)
+
+#--------------------------------------------------------------------------
+# Registry
+#--------------------------------------------------------------------------
+async def create_session(client):
+    """Creates a session whose runs are accounted to client (see clients.py)."""
+    janitor.ensure_started(lambda token: token in _sessions)
+    workspace_id, workspace_path = await workspace.create_workspace()
+    session = ExecSession(workspace_id, workspace_path, client)
+    _sessions[session.token] = session
+    return session
+
+
+def get_session(token):
+    return _sessions.get(token) if token else None
@@ -0,0 +1,176 @@
+import os
+import re
+import uuid
+import shutil
+import asyncio
+import resource
+import tempfile
+
+#--------------------------------------------------------------------------
+# Configuration: every interactive session gets its own scratch directory
+# on a RAM-backed filesystem (/dev/shm is tmpfs on Linux).
+#--------------------------------------------------------------------------
+if os.path.isdir("/dev/shm"):
+    DEFAULT_WORKSPACE_ROOT = "/dev/shm/codyskool"
+else:
+    DEFAULT_WORKSPACE_ROOT = os.path.join(tempfile.gettempdir(), "codyskool")
+WORKSPACE_ROOT = os.environ.get("CODE_WORKSPACE_ROOT", DEFAULT_WORKSPACE_ROOT)
+WORKSPACE_QUOTA_MB = int(os.environ.get("CODE_WORKSPACE_QUOTA_MB", "64"))
+# Mounting a dedicated tmpfs per session gives a hard quota but needs
+# CAP_SYS_ADMIN, so it is opt-in. Without it the quota is enforced per file
+# through RLIMIT_FSIZE, on uploads, and by stopping a run once the
+# workspace as a whole grows past it (checked every QUOTA_CHECK_SECONDS).
+WORKSPACE_MOUNT_TMPFS = os.environ.get("CODE_WORKSPACE_MOUNT_TMPFS", "0") == "1"
+QUOTA_CHECK_SECONDS = float(os.environ.get("CODE_WORKSPACE_QUOTA_CHECK_SECONDS", "1"))
+os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+
+WORKSPACE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+# Keep references to background teardown tasks so they are not collected
+# before they finish.
+_pending_removals = set()
+
+
+def quota_bytes():
+    return WORKSPACE_QUOTA_MB * 1024 * 1024
+
+#--------------------------------------------------------------------------
+# Create / look up workspaces
+#--------------------------------------------------------------------------
+async def create_workspace():
+    """
+    Creates an isolated workspace directory and returns (workspace_id, path).
+    When CODE_WORKSPACE_MOUNT_TMPFS=1 a size-limited tmpfs is mounted on it;
+    OSError is raised if that fails.
+    """
+    workspace_id = uuid.uuid4().hex
+    path = os.path.join(WORKSPACE_ROOT, f"ws_{workspace_id}")
+    os.mkdir(path, 0o700)
+
+    if WORKSPACE_MOUNT_TMPFS:
+        proc = await asyncio.create_subprocess_exec(
+            "mount", "-t", "tmpfs",
+            "-o", f"size={WORKSPACE_QUOTA_MB}m,mode=0700",
+            "tmpfs", path,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        if await proc.wait() != 0:
+            # Never fall back to an unbounded directory silently.
+            os.rmdir(path)
+            raise OSError(f"Could not mount the workspace tmpfs (mount exited with {proc.returncode}).")
+
+    return workspace_id, path
+
+
+def workspace_path(workspace_id):
+    """
+    Returns the directory of an existing workspace, or None if the id is
+    malformed or the workspace has already been torn down.
+    """
+    if not workspace_id or not WORKSPACE_ID_RE.match(workspace_id):
+        return None
+    path = os.path.join(WORKSPACE_ROOT, f"ws_{workspace_id}")
+    return path if os.path.isdir(path) else None
+
+
+def workspace_usage(path):
+    """Returns the total size in bytes of the files under path."""
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+async def watch_quota(path, on_exceeded):
+    """
+    Without a tmpfs, polls the size of the workspace and awaits on_exceeded()
+    once it is over the quota and larger than when watching began (so a run
+    started in a full workspace may still clean it up).
+    """
+    if WORKSPACE_MOUNT_TMPFS:
+        return
+    allowed = max(quota_bytes(), await asyncio.to_thread(workspace_usage, path))
+    while True:
+        await asyncio.sleep(QUOTA_CHECK_SECONDS)
+        if await asyncio.to_thread(workspace_usage, path) > allowed:
+            await on_exceeded()
+            return
+
+#--------------------------------------------------------------------------
+# Uploaded files
+#--------------------------------------------------------------------------
+def save_upload(path, filename, chunks):
+    """
+    Writes an uploaded file into the workspace and returns its path.
+    The name is reduced to its basename so uploads cannot escape the
+    workspace. Raises ValueError if the file would exceed the quota.
+    """
+    name = os.path.basename(filename or "")
+    if name in ("", ".", ".."):
+        raise ValueError("Invalid file name.")
+
+    target = os.path.join(path, name)
+    budget = quota_bytes() - workspace_usage(path)
+    if os.path.exists(target):
+        budget += os.path.getsize(target)
+
+    written = 0
+    with open(target, "wb") as destination:
+        for chunk in chunks:
+            written += len(chunk)
+            if written > budget:
+                break
+            destination.write(chunk)
+
+    if written > budget:
+        os.unlink(target)
+        raise ValueError(f"Workspace quota of {WORKSPACE_QUOTA_MB} MB exceeded.")
+    return target
+
+#--------------------------------------------------------------------------
+# Child process limits
+#--------------------------------------------------------------------------
+def limit_file_size():
+    """
+    preexec_fn for child processes: caps the size of any single file the
+    program writes to the workspace quota.
+    """
+    limit = quota_bytes()
+    resource.setrlimit(resource.RLIMIT_FSIZE, (limit, limit))
+
+#--------------------------------------------------------------------------
+# Teardown
+#--------------------------------------------------------------------------
+async def remove_workspace(path, processes=()):
+    """
+    Waits for the processes using the workspace to exit, then unmounts and
+    deletes the workspace without blocking the event loop.
+    """
+    for process in processes:
+        try:
+            await process.wait()
+        except Exception:
+            pass
+
+    if WORKSPACE_MOUNT_TMPFS:
+        proc = await asyncio.create_subprocess_exec(
+            "umount", "-l", path,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        await proc.wait()
+
+    await asyncio.to_thread(shutil.rmtree, path, True)
+
+
+def schedule_removal(path, processes=()):
+    """Tears a workspace down in the background."""
+    task = asyncio.get_running_loop().create_task(remove_workspace(path, list(processes)))
+    _pending_removals.add(task)
+    task.add_done_callback(_pending_removals.discard)
+    return task
@@ -1,3 +1,297 @@
-from django.test import TestCase
+import os
+import time
+import shutil
+import struct
+import tempfile
+from collections import OrderedDict, deque
+from concurrent.futures import wait
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from .services import analysis, judge, previews, protocol, ratelimit, scheduler
+
+
+class ProtocolTests(SimpleTestCase):
+    def test_frame_round_trip(self):
+        data = protocol.encode_frame(protocol.FRAME_OUTPUT, protocol.STREAM_STDOUT, 7, b"hi\n", run_id=3)
+        self.assertEqual(len(data), protocol.HEADER.size + 3)
+        self.assertEqual(
+            protocol.decode_frame(data),
+            (protocol.FRAME_OUTPUT, protocol.STREAM_STDOUT, 3, 7, b"hi\n"),
+        )
+
+    def test_payloads_are_normalised(self):
+        frame = protocol.encode_frame(protocol.FRAME_STATS, protocol.STREAM_CONTROL, 1, {"exit_code": 0})
+        self.assertEqual(protocol.decode_frame(frame)[4], b'{"exit_code": 0}')
+        frame = protocol.encode_frame(protocol.FRAME_ERROR, protocol.STREAM_CONTROL, 1, "é")
+        self.assertEqual(protocol.decode_frame(frame)[4], "é".encode("utf-8"))
+
+    def test_sequence_wraps(self):
+        frame = protocol.encode_frame(protocol.FRAME_OUTPUT, protocol.STREAM_STDOUT, 2 ** 32 + 5, b"")
+        self.assertEqual(protocol.decode_frame(frame)[3], 5)
+
+    def test_short_frame_is_rejected(self):
+        with self.assertRaises(ValueError):
+            protocol.decode_frame(b"\x01\x01")
+
+    def test_run_id_bounds(self):
+        frame = protocol.encode_frame(protocol.FRAME_OUTPUT, protocol.STREAM_STDOUT, 0, b"", protocol.MAX_RUN_ID)
+        self.assertEqual(protocol.decode_frame(frame)[2], protocol.MAX_RUN_ID)
+        with self.assertRaises(struct.error):
+            protocol.encode_frame(protocol.FRAME_OUTPUT, protocol.STREAM_STDOUT, 0, b"", protocol.MAX_RUN_ID + 1)
+
+    def test_is_run_id(self):
+        for value in (1, 2, protocol.MAX_RUN_ID):
+            self.assertTrue(protocol.is_run_id(value), value)
+        for value in (0, -1, protocol.MAX_RUN_ID + 1, True, "1", 1.0, None):
+            self.assertFalse(protocol.is_run_id(value), value)
+
+    def test_choose_subprotocol(self):
+        self.assertEqual(
+            protocol.choose_subprotocol([protocol.SUBPROTOCOL_JSON, protocol.SUBPROTOCOL_BINARY]),
+            protocol.SUBPROTOCOL_BINARY,
+        )
+        self.assertIsNone(protocol.choose_subprotocol(["other"]))
+
+
+class SyntaxCheckTests(SimpleTestCase):
+    def test_valid_code(self):
+        self.assertIsNone(analysis.check_syntax("print(1)\n"))
+
+    def test_syntax_error_has_position(self):
+        error = analysis.check_syntax("x = 1\nprint(\n")
+        self.assertEqual(error["type"], "SyntaxError")
+        self.assertEqual(error["line"], 2)
+
+    def test_deeply_nested_code_gets_a_diagnostic(self):
+        for code in ("-" * 100000 + "1", "1+" * 200000 + "1", "(" * 100000 + ")" * 100000):
+            error = analysis.check_syntax(code)
+            self.assertIsNotNone(error)
+            self.assertIn(error["type"], ("SyntaxError", "RecursionError", "MemoryError"))
+
+    def test_deeply_nested_code_is_not_analysed(self):
+        code = "1+" * 200000 + "1"
+        self.assertEqual(analysis.find_imports(code), set())
+        self.assertTrue(analysis.reads_input(code))
+
+    def test_find_imports(self):
+        code = "import numpy as np\nfrom matplotlib import pyplot\nfrom . import local\n"
+        self.assertEqual(analysis.find_imports(code), {"numpy", "matplotlib"})
+
+
+class ComparatorTests(SimpleTestCase):
+    def feed(self, comparator, *chunks):
+        for chunk in chunks:
+            if not comparator.feed(chunk):
+                return False
+        return comparator.finish()
+
+    def test_exact_ignores_trailing_whitespace(self):
+        comparator = judge.make_comparator("1\n2\n")
+        self.assertTrue(self.feed(comparator, "1  \n", "2", "\n\n"))
+
+    def test_exact_across_chunks(self):
+        comparator = judge.make_comparator("hello world\n")
+        self.assertTrue(self.feed(comparator, "hel", "lo wo", "rld\n"))
+
+    def test_exact_mismatch(self):
+        comparator = judge.make_comparator("1\n2\n")
+        self.assertFalse(self.feed(comparator, "1\n3\n"))
+        self.assertEqual(comparator.mismatch, "Output differs from the expected line.")
+
+    def test_exact_short_and_extra_output(self):
+        comparator = judge.make_comparator("1\n2\n")
+        self.assertFalse(self.feed(comparator, "1\n"))
+        self.assertEqual(comparator.mismatch, "Output ended early.")
+        comparator = judge.make_comparator("1\n")
+        self.assertFalse(self.feed(comparator, "1\n2\n"))
+        self.assertEqual(comparator.mismatch, "Extra output after the expected answer.")
+
+    def test_whitespace(self):
+        comparator = judge.make_comparator("1 2\n3", judge.COMPARATOR_WHITESPACE)
+        self.assertTrue(self.feed(comparator, "1\n", "2   3\n"))
+        comparator = judge.make_comparator("1 2", judge.COMPARATOR_WHITESPACE)
+        self.assertFalse(self.feed(comparator, "1 23"))
+
+    def test_float_tolerance(self):
+        comparator = judge.make_comparator("0.333333 0.6666667", judge.COMPARATOR_FLOAT)
+        self.assertTrue(self.feed(comparator, "0.3333333333 ", "0.666666666\n"))
+        comparator = judge.make_comparator("1.0", judge.COMPARATOR_FLOAT, 1e-9)
+        self.assertFalse(self.feed(comparator, "1.001"))
+        comparator = judge.make_comparator("nan", judge.COMPARATOR_FLOAT)
+        self.assertTrue(self.feed(comparator, "nan"))
+
+    def test_unknown_comparator(self):
+        with self.assertRaises(ValueError):
+            judge.make_comparator("", "fuzzy")
+
+
+class RateLimitTests(SimpleTestCase):
+    def test_parse_limit(self):
+        self.assertEqual(ratelimit.parse_limit("30/60"), (0.5, 30.0))
+        self.assertIsNone(ratelimit.parse_limit("0"))
+
+    def test_client_bucket(self):
+        limiter = ratelimit.Limiter(ratelimit.parse_limit("2/60"), None)
+        self.assertEqual(limiter.take("a"), 0.0)
+        self.assertEqual(limiter.take("a"), 0.0)
+        self.assertGreater(limiter.take("a"), 0.0)
+        self.assertEqual(limiter.take("b"), 0.0)
+
+    def test_refused_request_takes_nothing(self):
+        limiter = ratelimit.Limiter(ratelimit.parse_limit("1/60"), None)
+        limiter.take("a")
+        first = limiter.take("a")
+        self.assertAlmostEqual(limiter.take("a"), first, places=1)
+
+    def test_cost_goes_into_debt(self):
+        limiter = ratelimit.Limiter(ratelimit.parse_limit("10/60"), None)
+        self.assertEqual(limiter.take("a", 12), 0.0)
+        # Two tokens of debt plus the one needed: 3 tokens at 1/6 per second.
+        self.assertAlmostEqual(limiter.take("a"), 18.0, places=0)
+
+    def test_global_bucket(self):
+        limiter = ratelimit.Limiter(ratelimit.parse_limit("5/60"), ratelimit.parse_limit("2/60"))
+        self.assertEqual(limiter.take("a"), 0.0)
+        self.assertEqual(limiter.take("b"), 0.0)
+        self.assertGreater(limiter.take("c"), 0.0)
+
+    def test_prune_drops_full_buckets(self):
+        limiter = ratelimit.Limiter(ratelimit.parse_limit("2/60"), None)
+        limiter.take("a")
+        limiter.buckets["b"] = ratelimit.TokenBucket(1 / 30, 2, time.monotonic())
+        limiter.prune(time.monotonic())
+        self.assertEqual(list(limiter.buckets), ["a"])
+
+
+class _Executor:
+    """Holds submitted calls until the test runs them."""
+
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, fn):
+        self.calls.append(fn)
+
+
+class SchedulerTests(SimpleTestCase):
+    def setUp(self):
+        for name, value in (("_free_slots", [2]), ("_queues", {}), ("_running", {}), ("_usage", {})):
+            patcher = mock.patch.object(scheduler, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(scheduler, "SCHED_SHORT_SLOTS", 1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.executor = _Executor()
+
+    def submit(self, client, priority, result):
+        return scheduler.submit(self.executor, client, priority, lambda: result)
+
+    def test_batch_work_leaves_short_slots_free(self):
+        first = self.submit("a", scheduler.PRIORITY_BATCH, 1)
+        second = self.submit("a", scheduler.PRIORITY_BATCH, 2)
+        self.assertEqual(len(self.executor.calls), 1)
+        short = self.submit("b", scheduler.PRIORITY_SHORT, 3)
+        self.assertEqual(len(self.executor.calls), 2)
+        for run in list(self.executor.calls):
+            run()
+        self.assertEqual((first.result(), short.result()), (1, 3))
+        self.assertEqual(len(self.executor.calls), 3)
+        self.executor.calls[2]()
+        self.assertEqual(second.result(), 2)
+        self.assertEqual(scheduler._free_slots, [2])
+
+    def test_lighter_client_goes_first(self):
+        self.submit("busy", scheduler.PRIORITY_BATCH, None)
+        scheduler._usage["heavy"] = deque([(time.monotonic(), 50.0)])
+        heavy = self.submit("heavy", scheduler.PRIORITY_BATCH, "heavy")
+        light = self.submit("light", scheduler.PRIORITY_BATCH, "light")
+        self.executor.calls.pop()()
+        self.executor.calls.pop()()
+        self.assertTrue(light.done())
+        self.assertFalse(heavy.done())
+        self.executor.calls.pop()()
+        self.assertEqual(heavy.result(), "heavy")
+
+    def test_fewer_running_programs_goes_first(self):
+        self.submit("a", scheduler.PRIORITY_SHORT, None)
+        self.submit("b", scheduler.PRIORITY_SHORT, None)
+        a = self.submit("a", scheduler.PRIORITY_SHORT, "a")
+        c = self.submit("c", scheduler.PRIORITY_SHORT, "c")
+        # "b" finishes; "a" still runs a program, so "c" gets the slot.
+        self.executor.calls.pop(1)()
+        self.executor.calls.pop()()
+        self.assertTrue(c.done())
+        self.assertFalse(a.done())
+
+    def test_cancelled_work_gives_up_its_place(self):
+        self.submit("a", scheduler.PRIORITY_BATCH, None)
+        queued = self.submit("a", scheduler.PRIORITY_BATCH, None)
+        self.assertTrue(queued.cancel())
+        self.assertEqual(wait([queued], timeout=1).not_done, set())
+        self.assertEqual(scheduler._queues, {})
+        self.executor.calls.pop()()
+        self.assertEqual(self.executor.calls, [])
+        self.assertEqual(scheduler._free_slots, [2])
+
+    def test_exception_frees_the_slot(self):
+        future = scheduler.submit(self.executor, "a", scheduler.PRIORITY_SHORT, lambda: 1 / 0)
+        self.executor.calls.pop()()
+        self.assertIsInstance(future.exception(), ZeroDivisionError)
+        self.assertEqual(scheduler._running, {})
+
+
+class PreviewTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        self.blob_dir = os.path.join(directory, "blobs")
+        self.bundle_dir = os.path.join(directory, "bundles")
+        os.makedirs(self.blob_dir)
+        os.makedirs(self.bundle_dir)
+        for name, value in (
+            ("_BLOB_DIR", self.blob_dir),
+            ("_BUNDLE_DIR", self.bundle_dir),
+            ("_cache", previews.BlobCache()),
+            ("_manifests", OrderedDict()),
+        ):
+            patcher = mock.patch.object(previews, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_store_and_serve(self):
+        preview_id = previews.store({"index.html": "<p>hi</p>", "css/site.css": "p {}"})
+        self.assertTrue(previews.is_preview_id(preview_id))
+        digest, content_type = previews.lookup(preview_id)
+        self.assertEqual(content_type, "text/html; charset=utf-8")
+        self.assertEqual(previews.read(digest), b"<p>hi</p>")
+        self.assertEqual(previews.lookup(preview_id, "css/site.css")[1], "text/css; charset=utf-8")
+        self.assertIsNone(previews.lookup(preview_id, "missing.js"))
+
+    def test_same_bundle_same_id(self):
+        files = {"index.html": "<p>same</p>"}
+        self.assertEqual(previews.store(files), previews.store(dict(files)))
+        self.assertEqual(len(os.listdir(self.bundle_dir)), 1)
+
+    def test_invalid_bundles(self):
+        with self.assertRaises(ValueError):
+            previews.store({"page.html": "<p></p>"})
+        with self.assertRaises(ValueError):
+            previews.store({"index.html": "", "../escape.txt": ""})
+
+    def test_cleanup_removes_expired_bundles_and_their_blobs(self):
+        old = previews.store({"index.html": "<p>old</p>"})
+        new = previews.store({"index.html": "<p>new</p>"})
+        later = time.time() + previews.PREVIEW_TTL_SECONDS + previews._BLOB_GRACE_SECONDS + 1
+        os.utime(os.path.join(self.bundle_dir, new + ".json"), (later, later))
+        self.assertEqual(previews.cleanup(now=later), 1)
+        self.assertIsNone(previews.lookup(old))
+        self.assertIsNotNone(previews.lookup(new))
+        self.assertEqual(len(os.listdir(self.blob_dir)), 1)
+
+    def test_read_after_cleanup_deleted_the_file(self):
+        digest, _ = previews.lookup(previews.store({"index.html": "<p>gone</p>"}))
+        os.remove(os.path.join(self.blob_dir, digest))
+        self.assertIsNone(previews.read(digest))
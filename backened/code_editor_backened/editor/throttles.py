@@ -0,0 +1,30 @@
+from rest_framework.throttling import BaseThrottle
+from .services import clients
+from .services import ratelimit
+
+
+class ClientRateThrottle(BaseThrottle):
+    """
+    DRF throttle backed by the token buckets of services/ratelimit.py, per
+    client and global. Refused requests get a 429 with Retry-After.
+    """
+    action = ratelimit.ACTION_EXECUTE
+
+    def cost(self, request):
+        """Tokens the request takes: one per program it runs."""
+        return 1
+
+    def allow_request(self, request, view):
+        self.wait_seconds = ratelimit.take(self.action, clients.from_request(request), self.cost(request))
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class ExecuteThrottle(ClientRateThrottle):
+    action = ratelimit.ACTION_EXECUTE
+
+
+class UploadThrottle(ClientRateThrottle):
+    action = ratelimit.ACTION_UPLOAD
@@ -1,10 +1,19 @@
 
 # urls.py
 from django.urls import path
-from .views import CodeExecutionView, FileUploadView, FileDownloadView
+from .views import (CodeExecutionView, BatchExecutionView, FileUploadView, FileDownloadView, MetricsView,
+                    LanguageListView, PreviewCreateView, PreviewView, JobCreateView, JobDetailView)
 
 urlpatterns = [
     path('execute/', CodeExecutionView.as_view(), name='code_execute'),
+    path('execute/batch/', BatchExecutionView.as_view(), name='code_execute_batch'),
     path('files/upload/', FileUploadView.as_view(), name='file_upload'),
     path('files/download/', FileDownloadView.as_view(), name='file_download'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('languages/', LanguageListView.as_view(), name='languages'),
+    path('previews/', PreviewCreateView.as_view(), name='preview_create'),
+    path('previews/<str:preview_id>/', PreviewView.as_view(), name='preview'),
+    path('previews/<str:preview_id>/<path:path>', PreviewView.as_view(), name='preview_file'),
+    path('jobs/', JobCreateView.as_view(), name='job_create'),
+    path('jobs/<str:job_id>/', JobDetailView.as_view(), name='job_detail'),
 ]
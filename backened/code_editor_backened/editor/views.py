@@ -1,55 +1,191 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .serializers import CodeExecutionSerializer, FileUploadSerializer
-from .services.code_executor import execute_code
+from .serializers import CodeExecutionSerializer, BatchExecutionSerializer, FileUploadSerializer, PreviewSerializer, JobSerializer
+from .services.code_executor import execute_code_async, execute_batch_async, BATCH_MAX_CASES, EXEC_TIMEOUT_SECONDS
+from .services import workspace
+from .services import janitor
+from .services import languages
+from .services import previews
+from .services import jobs
+from .services import clients
+from .services import scheduler
+from .services import ratelimit
+from .throttles import ExecuteThrottle, UploadThrottle
+from .services.interactive_executor import CODE_EXEC_DIR
+from django.urls import reverse
+from django.http import Http404, HttpResponse, HttpResponseNotModified, JsonResponse
+from django.utils.cache import parse_etags
+from django.views import View
+from django.views.decorators.clickjacking import xframe_options_exempt
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.decorators import method_decorator
 import os
+import json
+import asyncio
 
-# Map numeric codes to language names.
-LANGUAGE_MAPPING = {
-    1: "python",
-    2: "c",
-    3: "cpp",
-    4: "javascript",
-    5: "html",
-}
+PREVIEW_CSP = "sandbox allow-scripts allow-forms allow-modals allow-popups"
 
-class CodeExecutionView(APIView):
+def check_language(language_code, runnable=False):
+    """
+    Looks up a language_code in the registry. Returns (name, None), or
+    (None, error message) if the code is unknown, the toolchain is not
+    installed, or runnable is asked for and the language is not.
+    """
+    entry = languages.by_code(language_code)
+    if entry is None or (runnable and entry.run is None):
+        return None, "Unsupported language code provided."
+    if not languages.is_available(entry):
+        return None, f"{entry.name} is not installed on this server."
+    return entry.name, None
+
+def resolve_language(language_code, runnable=False):
+    """check_language with the error as a 400 Response."""
+    name, error = check_language(language_code, runnable)
+    if error:
+        return None, Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+    return name, None
+
+def request_data(request):
+    """
+    Parses the body of a plain (non-DRF) Django request: JSON, or form
+    data otherwise. Raises ValueError if the JSON is invalid.
+    """
+    if request.content_type == "application/json":
+        return json.loads(request.body or b"{}")
+    return request.POST
+
+def throttled_response(wait):
+    """The 429 of a DRF throttle, for plain Django views."""
+    response = JsonResponse({"error": ratelimit.describe(wait)}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    response["Retry-After"] = ratelimit.retry_after(wait)
+    return response
+
+def preview_response(request, files):
+    """Stores a preview bundle and returns its preview_id and preview_url."""
+    preview_id = previews.store(files)
+    return {
+        "preview_id": preview_id,
+        "preview_url": request.build_absolute_uri(reverse("preview", args=[preview_id])),
+    }
+
+@method_decorator(csrf_exempt, name="dispatch")
+class CodeExecutionView(View):
     """
     POST /api/execute/
     Accepts code, a language_code, and optional user_input.
     Returns JSON with stdout, stderr, gui_output, and execution_time.
-    Stateless endpoint.
+    HTML (language_code 5) is stored as a preview and preview_id and
+    preview_url are returned as well.
+    Stateless, public endpoint, rate limited per client (429 with
+    Retry-After). It is an async view: the program runs on
+    the event loop instead of holding a worker thread until it exits.
+    For output as it is produced, see POST /api/execute/stream/.
     """
-    permission_classes = []  # Public endpoint
 
-    def post(self, request, *args, **kwargs):
-        serializer = CodeExecutionSerializer(data=request.data)
+    async def post(self, request, *args, **kwargs):
+        client = clients.from_request(request)
+        wait = ratelimit.take(ratelimit.ACTION_EXECUTE, client)
+        if wait:
+            return throttled_response(wait)
+        try:
+            serializer = CodeExecutionSerializer(data=request_data(request))
+        except ValueError:
+            return JsonResponse({"error": "Invalid JSON."}, status=status.HTTP_400_BAD_REQUEST)
+        if serializer.is_valid():
+            data = serializer.validated_data
+            language, error = check_language(data["language_code"])
+            if error:
+                return JsonResponse({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+            result = await execute_code_async(
+                language, data["code"], data.get("user_input", ""), client
+            )
+            if language == "html":
+                try:
+                    # Writes files (and may clean up old previews): off the event loop.
+                    result.update(await asyncio.to_thread(
+                        preview_response, request, {previews.PREVIEW_INDEX: data["code"]}
+                    ))
+                except ValueError as e:
+                    return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            return JsonResponse(result, status=status.HTTP_200_OK)
+        else:
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+@method_decorator(csrf_exempt, name="dispatch")
+class BatchExecutionView(View):
+    """
+    POST /api/execute/batch/
+    Accepts code, a language_code and a list of cases ({stdin, expected_stdout}).
+    The program is compiled once and the cases run in parallel, each judged
+    while its output streams (comparator: exact, whitespace or float);
+    returns a verdict (AC, WA, TLE, RE, SKIPPED) and timing for each case.
+    Public endpoint, rate limited per client at one token per case. An
+    async view, so a long batch holds no request thread.
+    """
+
+    async def post(self, request, *args, **kwargs):
+        try:
+            body = request_data(request)
+        except ValueError:
+            return JsonResponse({"error": "Invalid JSON."}, status=status.HTTP_400_BAD_REQUEST)
+        client = clients.from_request(request)
+        cases = body.get("cases") if hasattr(body, "get") else None
+        cost = min(len(cases), BATCH_MAX_CASES) if isinstance(cases, list) else 1
+        wait = ratelimit.take(ratelimit.ACTION_EXECUTE, client, cost)
+        if wait:
+            return throttled_response(wait)
+        serializer = BatchExecutionSerializer(data=body)
         if serializer.is_valid():
             data = serializer.validated_data
-            language = LANGUAGE_MAPPING.get(data["language_code"])
-            
-            if not language:
-                return Response(
-                    {"error": "Unsupported language code provided."},
+            language, error = check_language(data["language_code"], runnable=True)
+            if error:
+                return JsonResponse({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+            if len(data["cases"]) > BATCH_MAX_CASES:
+                return JsonResponse(
+                    {"error": f"At most {BATCH_MAX_CASES} cases are allowed."},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            result = execute_code(language, data["code"], data.get("user_input", ""))
-            return Response(result, status=status.HTTP_200_OK)
+            result = await execute_batch_async(
+                language,
+                data["code"],
+                data["cases"],
+                stop_on_failure=data["stop_on_failure"],
+                timeout=data.get("time_limit", EXEC_TIMEOUT_SECONDS),
+                comparator=data["comparator"],
+                tolerance=data["tolerance"],
+                client=client
+            )
+            return JsonResponse(result, status=status.HTTP_200_OK)
         else:
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 class FileUploadView(APIView):
     """
     POST /api/files/upload/
-    Expects a file and saves it to a temporary location.
+    Expects a file and saves it to a temporary location, or into the
+    session workspace when a workspace id is given.
     """
     permission_classes = []
+    throttle_classes = [UploadThrottle]
 
     def post(self, request, *args, **kwargs):
         serializer = FileUploadSerializer(data=request.data)
         if serializer.is_valid():
             uploaded_file = serializer.validated_data["file"]
+            workspace_id = serializer.validated_data.get("workspace")
+            if workspace_id:
+                workspace_dir = workspace.workspace_path(workspace_id)
+                if not workspace_dir:
+                    return Response(
+                        {"error": "Unknown workspace."},
+                        status=status.HTTP_404_NOT_FOUND
+                    )
+                try:
+                    saved_path = workspace.save_upload(workspace_dir, uploaded_file.name, uploaded_file.chunks())
+                except ValueError as e:
+                    return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+                return Response({"file_path": saved_path}, status=status.HTTP_200_OK)
             import tempfile
             temp_dir = tempfile.gettempdir()
             temp_path = os.path.join(temp_dir, uploaded_file.name)
@@ -73,3 +209,136 @@ class FileDownloadView(APIView):
         if not file_path or not os.path.exists(file_path):
             raise Http404("File not found.")
         return FileResponse(open(file_path, 'rb'), as_attachment=True)
+
+class MetricsView(APIView):
+    """
+    GET /api/metrics/
+    Returns counts of live child processes, open file descriptors, files in
+    CODE_EXEC_DIR and what the janitor has reclaimed, so leaks show up in
+    monitoring before they degrade the host, plus free program slots and
+    waiting runs.
+    """
+    permission_classes = []
+
+    def get(self, request, *args, **kwargs):
+        metrics = janitor.snapshot(CODE_EXEC_DIR, workspace.WORKSPACE_ROOT)
+        metrics["scheduler"] = scheduler.snapshot()
+        return Response(metrics, status=status.HTTP_200_OK)
+
+class LanguageListView(APIView):
+    """
+    GET /api/languages/
+    Returns the supported languages with their language_code, whether the
+    toolchain is installed and its version (probed once at startup).
+    """
+    permission_classes = []
+
+    def get(self, request, *args, **kwargs):
+        return Response(languages.describe(), status=status.HTTP_200_OK)
+
+class PreviewCreateView(APIView):
+    """
+    POST /api/previews/
+    Accepts files ({path: content}, with an index.html). Returns the
+    preview_id and preview_url; the same bundle always gets the same id and
+    is only stored once.
+    """
+    permission_classes = []
+    throttle_classes = [UploadThrottle]
+
+    def post(self, request, *args, **kwargs):
+        serializer = PreviewSerializer(data=request.data)
+        if serializer.is_valid():
+            try:
+                result = preview_response(request, serializer.validated_data["files"])
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            return Response(result, status=status.HTTP_201_CREATED)
+        else:
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+@method_decorator(xframe_options_exempt, name="dispatch")
+class PreviewView(View):
+    """
+    GET /api/previews/<preview_id>/[<path>]
+    Serves a file of a stored preview (index.html by default). Files never
+    change, so they carry a strong ETag and may be cached indefinitely;
+    If-None-Match gets a 304. The sandbox CSP gives the page an opaque
+    origin, so its scripts cannot act as the editor's own origin; it may
+    be framed by the editor.
+    """
+
+    def get(self, request, preview_id, path=""):
+        found = previews.lookup(preview_id, path)
+        if found is None:
+            raise Http404("Preview not found.")
+        digest, content_type = found
+        etag = previews.etag_for(digest)
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            response = HttpResponseNotModified()
+        else:
+            data = previews.read(digest)
+            if data is None:
+                raise Http404("Preview not found.")
+            response = HttpResponse(data, content_type=content_type)
+        response["ETag"] = etag
+        response["Cache-Control"] = "public, max-age=31536000, immutable"
+        response["Content-Security-Policy"] = PREVIEW_CSP
+        response["X-Content-Type-Options"] = "nosniff"
+        return response
+
+class JobCreateView(APIView):
+    """
+    POST /api/jobs/
+    Accepts the body of POST /api/execute/ plus an optional time_limit.
+    The program runs in the background; returns 202 with the job_id and
+    the status_url to poll.
+    """
+    permission_classes = []
+    throttle_classes = [ExecuteThrottle]
+
+    def post(self, request, *args, **kwargs):
+        serializer = JobSerializer(data=request.data)
+        if serializer.is_valid():
+            data = serializer.validated_data
+            language, error = resolve_language(data["language_code"], runnable=True)
+            if error:
+                return error
+            try:
+                job = jobs.submit(
+                    language,
+                    data["code"],
+                    data.get("user_input", ""),
+                    timeout=data.get("time_limit", jobs.JOB_TIMEOUT_SECONDS),
+                    client=clients.from_request(request)
+                )
+            except RuntimeError as e:
+                return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            return Response({
+                "job_id": job.id,
+                "status": job.status,
+                "status_url": request.build_absolute_uri(reverse("job_detail", args=[job.id])),
+            }, status=status.HTTP_202_ACCEPTED)
+        else:
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+class JobDetailView(APIView):
+    """
+    GET /api/jobs/<job_id>/?stdout_offset=N&stderr_offset=M
+    Returns the job's status (queued, running, finished), the stdout and
+    stderr written past the given offsets, the offsets to send next time
+    and, once finished, the result (exit_code, timed_out, execution_time).
+    Finished jobs are kept for CODE_JOB_TTL_SECONDS.
+    """
+    permission_classes = []
+
+    def get(self, request, job_id, *args, **kwargs):
+        job = jobs.get(job_id)
+        if job is None:
+            return Response({"error": "Unknown or expired job."}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            stdout_offset = max(int(request.query_params.get("stdout_offset", 0)), 0)
+            stderr_offset = max(int(request.query_params.get("stderr_offset", 0)), 0)
+        except ValueError:
+            return Response({"error": "Offsets must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(job.snapshot(stdout_offset, stderr_offset), status=status.HTTP_200_OK)
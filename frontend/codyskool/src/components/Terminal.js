@@ -1,6 +1,6 @@
 import React, { useEffect, useRef } from 'react';
 
-export default function Terminal({ title, output, input, setInput, onSendInput, onClear, prompt }) {
+export default function Terminal({ title, output, input, setInput, onSendInput, onClear, prompt, figures = [] }) {
   const outputRef = useRef(null);
 
   // Auto-scroll whenever the output or prompt is updated
@@ -8,7 +8,7 @@ export default function Terminal({ title, output, input, setInput, onSendInput,
     if (outputRef.current) {
       outputRef.current.scrollTop = outputRef.current.scrollHeight;
     }
-  }, [output, prompt]);
+  }, [output, prompt, figures]);
 
   return (
     <div className="border rounded bg-black text-white p-2 mb-4">
@@ -23,6 +23,9 @@ export default function Terminal({ title, output, input, setInput, onSendInput,
       </div>
       <div ref={outputRef} className="bg-gray-900 p-2 rounded h-64 overflow-y-auto font-mono">
         <pre>{output}</pre>
+        {figures.map((url, index) => (
+          <img key={url} src={url} alt={`Figure ${index + 1}`} className="bg-white rounded my-2 max-w-full" />
+        ))}
         {prompt && (
           <div className="flex items-center">
             <span></span>
@@ -1,8 +1,21 @@
-import React, { useState, useRef } from 'react';
+import React, { useState, useRef, useEffect } from 'react';
 import Navbar from '../components/Navbar';
 import CodeEditor from '../components/CodeEditor';
 import Terminal from '../components/Terminal';
 import API_BASE_URL from '../config';
+import {
+  SUBPROTOCOL_BINARY,
+  SUBPROTOCOL_JSON,
+  STREAM,
+  FRAME,
+  FIGURE_FRAME_TYPES,
+  FIGURE_MIME_TYPES,
+  decodeFrame,
+  decodeJsonPayload,
+  encodeInputFrame
+} from '../protocol';
+
+const MAX_RECONNECT_ATTEMPTS = 5;
 
 export default function Home() {
   const [code, setCode] = useState('');
@@ -10,10 +23,65 @@ export default function Home() {
   const [interactiveInput, setInteractiveInput] = useState(''); // current text typed in the prompt
   const [output, setOutput] = useState('');
   const [prompt, setPrompt] = useState(null); // holds prompt message (e.g., "Enter first number:")
+  const [figures, setFigures] = useState([]); // object URLs of figures streamed by the program
   const [user, setUser] = useState(null);
   const [snippets, setSnippets] = useState([]);
   
   const socketRef = useRef(null);
+  const pendingFigureRef = useRef(null); // format announced for the next binary frame
+  const decodersRef = useRef({}); // streaming UTF-8 decoders, one per output stream
+  const sessionRef = useRef({ token: null, lastSeq: 0 }); // used to resume after a dropped connection
+  const reconnectAttemptsRef = useRef(0);
+  const runIdRef = useRef(0); // last run id handed out on this connection
+  const activeRunRef = useRef(null); // run whose output the terminal shows
+
+  const addFigure = (data, mime) => {
+    const url = URL.createObjectURL(new Blob([data], { type: mime }));
+    setFigures(prev => [...prev, url]);
+  };
+
+  const decodeText = (stream, payload) => {
+    if (!decodersRef.current[stream]) {
+      decodersRef.current[stream] = new TextDecoder();
+    }
+    return decodersRef.current[stream].decode(payload, { stream: true });
+  };
+
+  // Handles one frame received over the binary subprotocol.
+  const handleFrame = ({ type, stream, run, payload }) => {
+    if (run && run !== activeRunRef.current) {
+      return; // late output from a run that was replaced or cancelled
+    }
+    switch (type) {
+      case FRAME.OUTPUT:
+        setOutput(prev => prev + decodeText(stream, payload));
+        break;
+      case FRAME.PROMPT:
+        setOutput(prev => prev + decodeText(stream, payload));
+        setPrompt(true);
+        break;
+      case FRAME.ERROR:
+        setOutput(prev => prev + "\nError: " + decodeText(STREAM.CONTROL, payload));
+        break;
+      case FRAME.FIGURE_PNG:
+      case FRAME.FIGURE_SVG:
+        addFigure(payload, FIGURE_MIME_TYPES[type]);
+        break;
+      case FRAME.STATS:
+      case FRAME.CONTROL:
+        console.log("Session:", decodeJsonPayload(payload));
+        break;
+      default:
+        console.warn("Unknown frame type:", type);
+    }
+  };
+
+  const clearFigures = () => {
+    setFigures(prev => {
+      prev.forEach(url => URL.revokeObjectURL(url));
+      return [];
+    });
+  };
 
   const languageMapping = {
     Python: 1,
@@ -21,30 +89,62 @@ export default function Home() {
     "C++": 3
   };
 
-  // Start execution via WebSocket.
-  const handleRun = () => {
-    setOutput('');
-    setPrompt(null);
-    
-    if (socketRef.current) {
-      socketRef.current.close();
+  const recordControl = (data) => {
+    if (data.session) {
+      sessionRef.current.token = data.session;
     }
-    const wsUrl = process.env.REACT_APP_WS_URL || `wss://cuddly-octo-fishstick.onrender.com/ws/interactive/`;
-    const socket = new WebSocket(wsUrl);
+    if (data.resumed && !data.complete) {
+      setOutput(prev => prev + "\n[some output was lost while reconnecting]\n");
+    }
+  };
+
+  // Opens the WebSocket. When resuming, the server replays everything after
+  // the last sequence number we saw instead of re-running the program.
+  const openSocket = (onOpen, resume = false) => {
+    const baseUrl = process.env.REACT_APP_WS_URL || `wss://cuddly-octo-fishstick.onrender.com/ws/interactive/`;
+    const { token, lastSeq } = sessionRef.current;
+    const wsUrl = resume ? `${baseUrl}?resume=${token}&last_seq=${lastSeq}` : baseUrl;
+    const socket = new WebSocket(wsUrl, [SUBPROTOCOL_BINARY, SUBPROTOCOL_JSON]);
+    socket.binaryType = 'arraybuffer';
     socketRef.current = socket;
 
     socket.onopen = () => {
-      const payload = {
-        action: "start",
-        language: selectedLanguage.toLowerCase(),
-        code: code
-      };
-      socket.send(JSON.stringify(payload));
+      reconnectAttemptsRef.current = 0;
+      if (onOpen) {
+        onOpen(socket);
+      }
     };
 
     socket.onmessage = (event) => {
+      if (event.data instanceof ArrayBuffer) {
+        if (socket.protocol === SUBPROTOCOL_BINARY) {
+          const frame = decodeFrame(event.data);
+          sessionRef.current.lastSeq = frame.seq;
+          if (frame.type === FRAME.CONTROL) {
+            recordControl(decodeJsonPayload(frame.payload));
+          }
+          handleFrame(frame);
+          return;
+        }
+        // JSON mode: binary messages carry the image announced by the preceding "figure" message.
+        if (pendingFigureRef.current) {
+          addFigure(event.data, FIGURE_MIME_TYPES[FIGURE_FRAME_TYPES[pendingFigureRef.current]] || 'image/png');
+          pendingFigureRef.current = null;
+        }
+        return;
+      }
       try {
         const data = JSON.parse(event.data);
+        if (data.seq) {
+          sessionRef.current.lastSeq = data.seq;
+        }
+        recordControl(data);
+        if (data.run && data.run !== activeRunRef.current) {
+          return;
+        }
+        if (data.figure) {
+          pendingFigureRef.current = data.figure;
+        }
         if (data.output) {
           setOutput(prev => prev + data.output);
         }
@@ -61,19 +161,81 @@ export default function Home() {
 
     socket.onerror = (errorEvent) => {
       console.error("WebSocket error:", errorEvent);
-      setOutput(prev => prev + "\nSocket error: " + JSON.stringify(errorEvent));
     };
 
     socket.onclose = () => {
       console.log("WebSocket connection closed.");
+      if (socketRef.current !== socket) {
+        return; // closed on purpose, a newer socket has taken over
+      }
+      socketRef.current = null;
+      // Unexpected drop: resume the same session after a short backoff.
+      if (sessionRef.current.token && reconnectAttemptsRef.current < MAX_RECONNECT_ATTEMPTS) {
+        const delay = 500 * 2 ** reconnectAttemptsRef.current;
+        reconnectAttemptsRef.current += 1;
+        setTimeout(() => openSocket(null, true), delay);
+      } else {
+        setOutput(prev => prev + "\nConnection lost.");
+      }
     };
+    return socket;
+  };
+
+  // Ends the current session on the server and closes its socket.
+  const endSession = () => {
+    const socket = socketRef.current;
+    socketRef.current = null;
+    sessionRef.current = { token: null, lastSeq: 0 };
+    if (socket) {
+      if (socket.readyState === WebSocket.OPEN) {
+        socket.send(JSON.stringify({ action: "end" }));
+      }
+      socket.close();
+    }
+  };
+
+  // Sends a control message on the shared connection, opening it first if needed.
+  const sendMessage = (message) => {
+    const socket = socketRef.current;
+    if (socket && socket.readyState === WebSocket.OPEN) {
+      socket.send(JSON.stringify(message));
+    } else if (socket && socket.readyState === WebSocket.CONNECTING) {
+      socket.addEventListener('open', () => socket.send(JSON.stringify(message)), { once: true });
+    } else {
+      reconnectAttemptsRef.current = 0;
+      openSocket((opened) => opened.send(JSON.stringify(message)));
+    }
+  };
+
+  // The connection is kept for the lifetime of the page.
+  useEffect(() => endSession, []);
+
+  // Start execution on the shared WebSocket, replacing the current run.
+  const handleRun = () => {
+    setOutput('');
+    setPrompt(null);
+    clearFigures();
+    decodersRef.current = {};
+
+    if (activeRunRef.current) {
+      sendMessage({ action: "stop", run: activeRunRef.current });
+    }
+    runIdRef.current = runIdRef.current % 65535 + 1;
+    activeRunRef.current = runIdRef.current;
+    sendMessage({
+      action: "start",
+      run: activeRunRef.current,
+      language: selectedLanguage.toLowerCase(),
+      code: code
+    });
   };
 
-  // Stop execution by closing the WebSocket.
+  // Stop execution by cancelling the active run.
   const handleStop = () => {
-    if (socketRef.current) {
-      socketRef.current.close();
-      socketRef.current = null;
+    if (activeRunRef.current) {
+      sendMessage({ action: "stop", run: activeRunRef.current });
+      activeRunRef.current = null;
+      setPrompt(null);
     }
   };
 
@@ -83,8 +245,12 @@ export default function Home() {
       // Echo only the input value, not the prompt text.
       setOutput(prev => prev  + inputText + "\n");
       setPrompt(null); // clear the prompt
-      const payload = { action: "input", data: inputText };
-      socketRef.current.send(JSON.stringify(payload));
+      if (socketRef.current.protocol === SUBPROTOCOL_BINARY) {
+        socketRef.current.send(encodeInputFrame(inputText, activeRunRef.current));
+      } else {
+        const payload = { action: "input", run: activeRunRef.current, data: inputText };
+        socketRef.current.send(JSON.stringify(payload));
+      }
     } else {
       console.warn("No open WebSocket connection to send input.");
     }
@@ -148,8 +314,9 @@ export default function Home() {
               input={interactiveInput}
               setInput={setInteractiveInput}
               onSendInput={handleSendInput}
-              onClear={() => { setOutput(''); setPrompt(null); }}
+              onClear={() => { setOutput(''); setPrompt(null); clearFigures(); }}
               prompt={prompt}
+              figures={figures}
             />
           </div>
         </div>
@@ -0,0 +1,74 @@
+// src/protocol.js
+// Binary framing shared with editor/services/protocol.py on the backend.
+// Each frame is: type (u8) | stream (u8) | run (u16) | sequence (u32) | payload
+// All integers are big endian; run is 0 for session-level frames.
+
+export const SUBPROTOCOL_BINARY = 'codyskool.binary.v2';
+export const SUBPROTOCOL_JSON = 'codyskool.json.v2';
+
+export const HEADER_SIZE = 8;
+
+export const STREAM = {
+  CONTROL: 0,
+  STDOUT: 1,
+  STDERR: 2,
+  STDIN: 3
+};
+
+export const FRAME = {
+  OUTPUT: 1,
+  PROMPT: 2,
+  ERROR: 3,
+  STATS: 4,
+  FIGURE_PNG: 5,
+  FIGURE_SVG: 6,
+  CONTROL: 7,
+  INPUT: 8
+};
+
+// Figure format names, as announced by JSON-mode "figure" messages.
+export const FIGURE_FRAME_TYPES = {
+  png: FRAME.FIGURE_PNG,
+  svg: FRAME.FIGURE_SVG
+};
+
+export const FIGURE_MIME_TYPES = {
+  [FRAME.FIGURE_PNG]: 'image/png',
+  [FRAME.FIGURE_SVG]: 'image/svg+xml'
+};
+
+const encoder = new TextEncoder();
+const jsonDecoder = new TextDecoder();
+
+// Splits an ArrayBuffer into its header fields and payload bytes.
+export function decodeFrame(buffer) {
+  const view = new DataView(buffer);
+  return {
+    type: view.getUint8(0),
+    stream: view.getUint8(1),
+    run: view.getUint16(2),
+    seq: view.getUint32(4),
+    payload: new Uint8Array(buffer, HEADER_SIZE)
+  };
+}
+
+// Parses the JSON payload carried by STATS and CONTROL frames.
+export function decodeJsonPayload(payload) {
+  return JSON.parse(jsonDecoder.decode(payload));
+}
+
+export function encodeFrame(type, stream, run, seq, text) {
+  const payload = encoder.encode(text);
+  const buffer = new ArrayBuffer(HEADER_SIZE + payload.length);
+  const view = new DataView(buffer);
+  view.setUint8(0, type);
+  view.setUint8(1, stream);
+  view.setUint16(2, run);
+  view.setUint32(4, seq);
+  new Uint8Array(buffer, HEADER_SIZE).set(payload);
+  return buffer;
+}
+
+export function encodeInputFrame(text, run, seq = 0) {
+  return encodeFrame(FRAME.INPUT, STREAM.STDIN, run, seq, text);
+}